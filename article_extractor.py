@@ -0,0 +1,129 @@
+"""
+article_extractor.py
+- HTML-to-text extraction for fetched articles (newspaper3k first, BeautifulSoup fallback).
+- Runs in a bounded worker pool so parsing never blocks the crawl's event loop.
+- The HTML is always downloaded by the caller through the shared aiohttp session;
+  newspaper3k is only used as a parser here, never for its own HTTP stack.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# "process" scales extraction with cores; "thread" avoids worker start-up on tiny deployments.
+EXTRACT_EXECUTOR = os.getenv("EXTRACT_EXECUTOR", "process")
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+MIN_ARTICLE_CHARS = 200
+
+
+def _extract_with_newspaper(url, html):
+    from newspaper import Article
+    article = Article(url)
+    article.download(input_html=html)
+    article.parse()
+    published = article.publish_date.isoformat() if article.publish_date else ''
+    return article.text.strip(), article.title or '', published
+
+
+def _extract_with_bs4(html):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    # Try <article>, then <main>, then <body>
+    main_content = ''
+    for tag in ['article', 'main', 'body']:
+        found = soup.find(tag)
+        if found and found.get_text(strip=True):
+            main_content = found.get_text(separator=' ', strip=True)
+            break
+    # Always extract metadata if possible
+    title = (soup.title.string.strip() if soup.title and soup.title.string else '')
+    author = ''
+    pubdate = ''
+    summary = ''
+    # Try Open Graph/meta tags for better metadata
+    og_title = soup.find('meta', property='og:title')
+    if og_title and og_title.get('content'): title = og_title['content']
+    og_desc = soup.find('meta', property='og:description')
+    if og_desc and og_desc.get('content'): summary = og_desc['content']
+    meta_author = soup.find('meta', attrs={'name': 'author'})
+    if meta_author and meta_author.get('content'): author = meta_author['content']
+    meta_date = soup.find('meta', attrs={'property': 'article:published_time'}) or soup.find('meta', attrs={'name': 'pubdate'})
+    if meta_date and meta_date.get('content'): pubdate = meta_date['content']
+    # Compose fallback text
+    fallback_text = f"Title: {title}\nAuthor: {author}\nPublished: {pubdate}\nSummary: {summary}\nContent: {main_content[:2000]}"
+    return fallback_text, len(main_content), title, pubdate
+
+
+def extract_article(url, html):
+    """
+    Extracts readable text from an already-downloaded HTML page. Runs inside a pool worker.
+    Returns:
+        dict with 'text', 'method' ('newspaper3k' or 'bs4'), 'length', 'title', 'published_date'
+        and 'seconds' (extraction CPU time).
+    """
+    start = time.perf_counter()
+    try:
+        text, title, published = _extract_with_newspaper(url, html)
+        # If text is too short, try fallback
+        if len(text) >= MIN_ARTICLE_CHARS:
+            return {"text": text, "method": "newspaper3k", "length": len(text), "title": title,
+                    "published_date": published, "seconds": time.perf_counter() - start}
+    except Exception:
+        pass
+    text, length, title, published = _extract_with_bs4(html)
+    return {"text": text, "method": "bs4", "length": length, "title": title,
+            "published_date": published, "seconds": time.perf_counter() - start}
+
+
+class ExtractionPool:
+    """Bounded executor for extract_article plus per-document timing stats."""
+
+    def __init__(self, workers=EXTRACT_WORKERS, kind=EXTRACT_EXECUTOR):
+        self.workers = max(1, int(workers))
+        self.kind = kind
+        if kind == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="extract")
+        else:
+            # spawn: forking a process that already runs aiohttp/tokenizer threads can deadlock.
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.stats = {"docs": 0, "errors": 0, "extract_seconds": 0.0, "wall_seconds": 0.0, "by_method": {}}
+
+    async def extract(self, url, html):
+        """Runs extract_article in the pool; raises whatever the worker raised."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self._executor, extract_article, url, html)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        wall = time.perf_counter() - start
+        self.stats["docs"] += 1
+        self.stats["extract_seconds"] += result["seconds"]
+        self.stats["wall_seconds"] += wall
+        self.stats["by_method"][result["method"]] = self.stats["by_method"].get(result["method"], 0) + 1
+        result["wall_seconds"] = wall
+        return result
+
+    def log_stats(self):
+        s = self.stats
+        docs = max(1, s["docs"])
+        logging.info(f"[Article Extraction] docs: {s['docs']} | errors: {s['errors']} | methods: {s['by_method']} | "
+                     f"avg extract: {s['extract_seconds'] / docs * 1000:.1f}ms | avg wall: {s['wall_seconds'] / docs * 1000:.1f}ms | "
+                     f"workers: {self.workers} ({self.kind})")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+
+
+def get_extraction_pool():
+    """Process-wide ExtractionPool, created on first use so worker start-up is paid once."""
+    global _pool
+    if _pool is None:
+        _pool = ExtractionPool()
+    return _pool
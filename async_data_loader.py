@@ -1,157 +1,228 @@
-import aiohttp
 import asyncio
 import feedparser
-from newspaper import Article
 from datetime import datetime
 from data_sources_config import AI_SOURCES
+from fetch_scheduler import FetchScheduler
+from article_extractor import get_extraction_pool
+from feed_state import FeedStateStore
+from content_store import get_content_store, snippet, VARIANT_FULL, VARIANT_FALLBACK
+from near_duplicates import canonical_url
 
-import hashlib
-import os
 
-CACHE_DIR = 'cache'
-os.makedirs(CACHE_DIR, exist_ok=True)
-
-async def fetch_article_content(session, url, timeout=10):
+async def fetch_article_content(session, url, timeout=10, scheduler=None, extractor=None, store=None):
+    """
+    Downloads `url` through the shared session/scheduler and extracts its text in the
+    extraction pool (newspaper3k first, BeautifulSoup fallback), so parsing never runs on the event loop.
+    The complete extraction is kept in the content store; the caller gets `content_store.snippet`
+    of it, so cache hits and fresh fetches return the same text.
+    """
     import logging
-    from bs4 import BeautifulSoup
-    # Use a simple file cache to avoid refetching content
-    cache_key = hashlib.md5(url.encode()).hexdigest()
-    cache_path = os.path.join(CACHE_DIR, cache_key + '.txt')
-    if os.path.exists(cache_path):
-        with open(cache_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    # Try newspaper3k first
+    store = store or get_content_store()
+    cached = store.get(url)
+    if cached is not None:
+        return snippet(cached)
+    scheduler = scheduler or FetchScheduler()
+    extractor = extractor or get_extraction_pool()
     try:
-        article = Article(url)
-        article.download()
-        article.parse()
-        text = article.text.strip()
-        # If text is too short, try fallback
-        if len(text) < 200:
-            raise Exception("Too short, fallback to BS4")
-        with open(cache_path, 'w', encoding='utf-8') as f:
-            f.write(text)
-        logging.info(f"[Article Extraction] {url} | newspaper3k | length: {len(text)}")
-        return text[:2000]
-    except Exception:
-        # Fallback: fetch raw HTML and parse with BeautifulSoup
-        try:
-            async with session.get(url, timeout=timeout) as resp:
-                html = await resp.text()
-            soup = BeautifulSoup(html, 'html.parser')
-            # Try <article>, then <main>, then <body>
-            main_content = ''
-            for tag in ['article', 'main', 'body']:
-                found = soup.find(tag)
-                if found and found.get_text(strip=True):
-                    main_content = found.get_text(separator=' ', strip=True)
-                    break
-            # Always extract metadata if possible
-            title = (soup.title.string.strip() if soup.title else '')
-            author = ''
-            pubdate = ''
-            summary = ''
-            # Try Open Graph/meta tags for better metadata
-            og_title = soup.find('meta', property='og:title')
-            if og_title and og_title.get('content'): title = og_title['content']
-            og_desc = soup.find('meta', property='og:description')
-            if og_desc and og_desc.get('content'): summary = og_desc['content']
-            meta_author = soup.find('meta', attrs={'name':'author'})
-            if meta_author and meta_author.get('content'): author = meta_author['content']
-            meta_date = soup.find('meta', attrs={'property':'article:published_time'}) or soup.find('meta', attrs={'name':'pubdate'})
-            if meta_date and meta_date.get('content'): pubdate = meta_date['content']
-            # Compose fallback text
-            fallback_text = f"Title: {title}\nAuthor: {author}\nPublished: {pubdate}\nSummary: {summary}\nContent: {main_content[:2000]}"
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                f.write(fallback_text)
-            logging.info(f"[Article Extraction] {url} | BeautifulSoup | length: {len(main_content)}")
-            return fallback_text
-        except Exception as e:
-            logging.warning(f"[Article Extraction] {url} | Extraction failed: {e}")
-            return ''
+        fetched = await scheduler.fetch(session, url, timeout=timeout)
+        if fetched.status >= 400:
+            raise Exception(f"HTTP {fetched.status}")
+        result = await extractor.extract(url, fetched.text)
+    except Exception as e:
+        logging.warning(f"[Article Extraction] {url} | Extraction failed: {e}")
+        return ''
+    variant = VARIANT_FULL if result['method'] == 'newspaper3k' else VARIANT_FALLBACK
+    record = {'text': result['text'], 'variant': variant}
+    store.put(url, result['text'], variant, method=result['method'],
+              title=result['title'], published_date=result['published_date'])
+    logging.info(f"[Article Extraction] {url} | {result['method']} | length: {result['length']} | "
+                 f"download: {fetched.elapsed * 1000:.0f}ms | extract: {result['seconds'] * 1000:.0f}ms")
+    return snippet(record)
+
+async def _poll_feed(session, url, scheduler, feed_state, seen_key=None):
+    """
+    Conditional GET of a feed. Returns its parsed entries, or None when the server answered 304.
+    Its entries not yet seen under `seen_key` (default `url`) are recorded as pending, so the validators are
+    not used until they have all been delivered.
+    """
+    fetched = await scheduler.fetch(session, url, timeout=15, headers=feed_state.conditional_headers(url))
+    if fetched.status == 304:
+        return None
+    if fetched.status >= 400:
+        raise Exception(f"HTTP {fetched.status}")
+    feed_state.record_response(url, fetched.headers.get('ETag'), fetched.headers.get('Last-Modified'))
+    entries = feedparser.parse(fetched.text).entries
+    feed_state.expect(url, feed_state.new_entries(seen_key or url, entries), seen_key)
+    return entries
+
 
-async def fetch_rss(session, source, max_entries=200):
+def _entry_to_item(source, entry, content):
+    return {
+        'title': entry.title,
+        'summary': getattr(entry, 'summary', ''),
+        'published_date': getattr(entry, 'published', ''),
+        'url': entry.link,
+        'source': source['name'],
+        'company': source.get('company', ''),
+        'type': source['type'],
+        'content': content
+    }
+
+
+async def _new_source_entries(session, source, max_entries, scheduler, feed_state):
+    """
+    Polls a source (paging the arXiv API) and returns up to `max_entries` entries not seen before.
+    Entries are not marked as seen here; callers do that once they have delivered them.
+    """
     import logging
+    url = source['url']
+    # Special handling for arXiv API: paginate to get more than 100 docs
+    if 'arxiv.org/api' in url:
+        new_entries = []
+        batch_size = 200
+        for start in range(0, max_entries, batch_size):
+            paged_url = url.replace('start=0', f'start={start}').replace('max_results=100', f'max_results={batch_size}')
+            entries = await _poll_feed(session, paged_url, scheduler, feed_state, seen_key=url)
+            if entries is None:
+                logging.info(f"arXiv batch {start}-{start+batch_size} not modified, skipping.")
+                continue
+            fresh = feed_state.new_entries(url, entries)[:max_entries - len(new_entries)]
+            logging.info(f"Fetched {len(entries)} entries from arXiv (batch {start}-{start+batch_size}), {len(fresh)} new")
+            new_entries.extend(fresh)
+            if len(new_entries) >= max_entries:
+                break
+        return new_entries
+    # For other RSS feeds
+    entries = await _poll_feed(session, url, scheduler, feed_state)
+    if entries is None:
+        logging.info(f"{source['name']} not modified since last poll, skipping.")
+        return []
+    new_entries = feed_state.new_entries(url, entries)[:max_entries]
+    logging.info(f"Fetched {len(entries)} entries from {source['name']}, {len(new_entries)} new")
+    return new_entries
+
+
+def _settle(feed_state, feed_url, entries, items):
+    """
+    Marks delivered entries as seen. Items whose article could not be extracted are still passed on (with their
+    summary), but their entries stay unseen so a later poll retries the extraction (FeedStateStore.record_failure).
+    """
+    for entry, item in zip(entries, items):
+        if item['content']:
+            feed_state.mark_seen(feed_url, [entry])
+        else:
+            feed_state.record_failure(feed_url, entry)
+
+
+async def fetch_rss(session, source, max_entries=200, scheduler=None, extractor=None, feed_state=None):
+    """
+    Polls one source and returns items for entries not delivered on a previous run.
+    Unchanged feeds (304 Not Modified) are neither parsed nor extracted.
+    """
+    scheduler = scheduler or FetchScheduler()
+    extractor = extractor or get_extraction_pool()
+    feed_state = feed_state or FeedStateStore()
     try:
-        url = source['url']
-        # Special handling for arXiv API: paginate to get more than 100 docs
-        if 'arxiv.org/api' in url:
-            items = []
-            batch_size = 200
-            total_to_fetch = max_entries
-            for start in range(0, total_to_fetch, batch_size):
-                paged_url = url.replace('start=0', f'start={start}').replace('max_results=100', f'max_results={batch_size}')
-                async with session.get(paged_url, timeout=15) as resp:
-                    text = await resp.text()
-                feed = feedparser.parse(text)
-                entries = feed.entries
-                logging.info(f"Fetched {len(entries)} entries from arXiv (batch {start}-{start+batch_size})")
-                tasks = [fetch_article_content(session, entry.link, timeout=12) for entry in entries]
-                contents = await asyncio.gather(*tasks, return_exceptions=True)
-                for entry, content in zip(entries, contents):
-                    if isinstance(content, Exception):
-                        content = ''
-                    items.append({
-                        'title': entry.title,
-                        'summary': getattr(entry, 'summary', ''),
-                        'published_date': getattr(entry, 'published', ''),
-                        'url': entry.link,
-                        'source': source['name'],
-                        'company': source.get('company', ''),
-                        'type': source['type'],
-                        'content': content
-                    })
-                if len(items) >= max_entries:
-                    break
-            return items[:max_entries]
-        # For other RSS feeds
-        async with session.get(url, timeout=15) as resp:
-            text = await resp.text()
-        feed = feedparser.parse(text)
-        items = []
-        entries = feed.entries[:max_entries]
-        logging.info(f"Fetched {len(entries)} entries from {source['name']}")
-        tasks = [fetch_article_content(session, entry.link, timeout=12) for entry in entries]
+        entries = await _new_source_entries(session, source, max_entries, scheduler, feed_state)
+        tasks = [fetch_article_content(session, entry.link, timeout=12, scheduler=scheduler, extractor=extractor) for entry in entries]
         contents = await asyncio.gather(*tasks, return_exceptions=True)
-        for entry, content in zip(entries, contents):
-            if isinstance(content, Exception):
-                content = ''
-            items.append({
-                'title': entry.title,
-                'summary': getattr(entry, 'summary', ''),
-                'published_date': getattr(entry, 'published', ''),
-                'url': entry.link,
-                'source': source['name'],
-                'company': source.get('company', ''),
-                'type': source['type'],
-                'content': content
-            })
+        items = [_entry_to_item(source, entry, '' if isinstance(content, Exception) else content)
+                 for entry, content in zip(entries, contents)]
+        _settle(feed_state, source['url'], entries, items)
         return items
     except Exception as e:
         print(f"Error fetching {source['name']}: {e}")
         return []
 
 
-# NOTE: On low-memory deployments (e.g., Render free tier), keep max_docs low (e.g., 30). Increase for production as needed.
-async def fetch_all_sources(max_docs=30):
+async def iter_all_sources(max_docs=30, sources=None, scheduler=None, extractor=None, feed_state=None, buffer=32):
+    """
+    Streaming variant of fetch_all_sources: an async generator that yields each item (deduplicated by URL)
+    as soon as its article has been extracted, instead of waiting for the whole crawl.
+    At most `buffer` extracted items are held ahead of the consumer; a slow consumer pauses new
+    article downloads (backpressure). Entries are marked as seen only once they have been yielded with their
+    article, so stopping early never loses any and failed extractions are retried (_settle).
+    A `feed_state` passed in belongs to the caller, who saves it once the items are safely stored (and
+    discards it if that fails); without one, a default store is created and saved when the generator ends.
+    """
     import logging
-    async with aiohttp.ClientSession() as session:
-        # Distribute max_docs across sources (e.g., 12 sources × 3 each)
-        per_source = max(3, max_docs // max(1, len(AI_SOURCES)))
-        tasks = [fetch_rss(session, source, max_entries=per_source) for source in AI_SOURCES]
-        all_results = await asyncio.gather(*tasks)
-        # Flatten and deduplicate by URL
-        all_items = {}
-        total = 0
-        for items in all_results:
-            for item in items:
-                if item['url'] not in all_items:
-                    all_items[item['url']] = item
-                    total += 1
-        logging.info(f"Fetched and deduplicated total {total} documents from {len(AI_SOURCES)} sources.")
-        # Limit to max_docs
-        return list(all_items.values())[:max_docs]
+    sources = AI_SOURCES if sources is None else sources
+    scheduler = scheduler or FetchScheduler()
+    extractor = extractor or get_extraction_pool()
+    owns_state = feed_state is None
+    feed_state = feed_state or FeedStateStore()
+    # Distribute max_docs across sources (e.g., 12 sources × 3 each)
+    per_source = max(3, max_docs // max(1, len(sources)))
+    queue = asyncio.Queue()
+    slots = asyncio.Semaphore(max(1, buffer))
+    done = object()
 
+    async def produce(session, source):
+        async def one(entry):
+            await slots.acquire()
+            try:
+                content = await fetch_article_content(session, entry.link, timeout=12, scheduler=scheduler, extractor=extractor)
+            except Exception:
+                content = ''
+            await queue.put((source['url'], entry, _entry_to_item(source, entry, content)))
+        try:
+            entries = await _new_source_entries(session, source, per_source, scheduler, feed_state)
+            await asyncio.gather(*(one(entry) for entry in entries))
+        except Exception as e:
+            print(f"Error fetching {source['name']}: {e}")
+        finally:
+            await queue.put(done)
+
+    yielded = 0
+    seen_urls = set()
+    async with scheduler.session() as session:
+        tasks = [asyncio.create_task(produce(session, source)) for source in sources]
+        try:
+            finished = 0
+            while finished < len(tasks) and yielded < max_docs:
+                message = await queue.get()
+                if message is done:
+                    finished += 1
+                    continue
+                feed_url, entry, item = message
+                slots.release()
+                _settle(feed_state, feed_url, [entry], [item])
+                url_key = canonical_url(item['url'])
+                if url_key in seen_urls:
+                    continue
+                seen_urls.add(url_key)
+                yielded += 1
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if owns_state:
+                feed_state.save()
+            logging.info(f"Streamed {yielded} deduplicated documents from {len(sources)} sources.")
+            scheduler.log_stats()
+            extractor.log_stats()
+
+
+# NOTE: On low-memory deployments (e.g., Render free tier), keep max_docs low (e.g., 30). Increase for production as needed.
+async def fetch_all_sources(max_docs=30, sources=None, scheduler=None, extractor=None, feed_state=None):
+    """
+    Crawls every source concurrently through one FetchScheduler (global + per-host limits,
+    shared keep-alive connector, per-request deadlines) and returns up to `max_docs` items
+    deduplicated by URL. Collects iter_all_sources; use that directly to process items as they arrive.
+    Args:
+        max_docs: Upper bound on returned documents.
+        sources: Source dicts to crawl (defaults to AI_SOURCES; point at a local server for testing).
+        scheduler: Optional preconfigured FetchScheduler.
+        extractor: Optional ExtractionPool (defaults to the process-wide pool).
+        feed_state: Optional FeedStateStore; only entries unseen by it are returned, and it is saved afterwards.
+    """
+    feed_state = feed_state or FeedStateStore()
+    items = [item async for item in iter_all_sources(max_docs=max_docs, sources=sources, scheduler=scheduler,
+                                                     extractor=extractor, feed_state=feed_state,
+                                                     buffer=max(32, max_docs))]
+    feed_state.save()
+    return items
 
 if __name__ == "__main__":
     results = asyncio.run(fetch_all_sources())
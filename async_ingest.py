@@ -2,42 +2,206 @@
 """
 This module provides a function to fetch and ingest async resources into the RAG pipeline's vectorstore.
 Call this from a FastAPI startup event for proper async compatibility.
+
+Ingestion is a streaming pipeline of stages connected by bounded asyncio queues:
+    fetch/extract (iter_all_sources) -> build Document -> split -> embed (micro-batches) -> add to FAISS
+Each queue has a fixed capacity, so a slow stage pauses the ones before it (backpressure) and peak
+memory depends on the batch/queue sizes rather than on max_docs. Chunks are added to the in-memory store
+batch by batch, but the index is saved (or published through `checkpoint`) once, at the end; only then are the
+registry, the near-duplicate index and the feed state committed, so a failed run leaves its entries unseen.
+The split stage consults the index registry, so documents already indexed unchanged are never re-embedded,
+and the near-duplicate index, so mirrored copies of a document are never split or embedded at all.
 """
+import asyncio
 import logging
-from async_data_loader import fetch_all_sources
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+import os
+import time
+from async_data_loader import iter_all_sources
+from feed_state import FeedStateStore
+from index_registry import IndexRegistry, document_key
+from metadata_index import expired
+from near_duplicates import NearDuplicateIndex
+from vector_store import save_vectorstore
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
-import os
 
-async def fetch_and_ingest_async_resources(vectorstore, max_docs=1200):
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "32"))
+_DONE = object()
+
+
+def resource_to_document(res):
+    content = f"Resource Title: {res['title']}\nSource: {res['source']}\nCompany: {res.get('company','')}\nType: {res['type']}\nURL: {res['url']}\nPublished: {res.get('published_date','')}\nSummary: {res.get('summary','')}\n\nFull Content: {res.get('content', '')}"
+    metadata = {
+        "source": res['source'],
+        "title": res['title'],
+        "url": res['url'],
+        "company": res.get('company',''),
+        "type": res['type'],
+        "published_date": res.get('published_date','')
+    }
+    return Document(page_content=content, metadata=metadata)
+
+
+class StageStats:
+    """Per-stage throughput counters: items in/out, busy seconds and the deepest input queue seen."""
+
+    def __init__(self, *names):
+        self.started = time.perf_counter()
+        self.stages = {name: {"in": 0, "out": 0, "busy_seconds": 0.0, "max_queue": 0} for name in names}
+
+    def observe_queue(self, name, queue):
+        stage = self.stages[name]
+        stage["max_queue"] = max(stage["max_queue"], queue.qsize())
+
+    def log(self):
+        elapsed = max(1e-9, time.perf_counter() - self.started)
+        for name, s in self.stages.items():
+            logging.info(f"[Ingest] {name}: in {s['in']} | out {s['out']} ({s['out'] / elapsed:.1f}/s) | "
+                         f"busy {s['busy_seconds']:.1f}s | max queue {s['max_queue']}")
+
+
+async def fetch_and_ingest_async_resources(vectorstore, max_docs=1200, batch_size=INGEST_BATCH_SIZE,
+                                           queue_size=INGEST_QUEUE_SIZE, faiss_index_path="faiss_index", registry=None,
+                                           near_dups=None, checkpoint=None, feed_state=None):
+    """
+    Streams resources from the async sources into `vectorstore` in micro-batches and saves it once at the end.
+    Args:
+        vectorstore: LangChain FAISS store to extend.
+        max_docs: Upper bound on fetched resources.
+        batch_size: Chunks per embedding call / add_embeddings call.
+        queue_size: Capacity of each inter-stage queue (documents before the splitter, batches after it).
+        registry: IndexRegistry for `faiss_index_path` (opened from the index directory by default).
+        near_dups: NearDuplicateIndex for `faiss_index_path` (likewise).
+        checkpoint: Called with the store instead of saving it to `faiss_index_path` (the indexer saves into a
+            staging snapshot and publishes it); runs before the registry commits.
+        feed_state: FeedStateStore of the polled feeds; saved after the commit, discarded if ingestion fails.
+    Returns:
+        StageStats of the run (or None if ingestion failed).
+    """
     logging.info("[Startup] Fetching additional async resources from AI/ML/LLM news/blog/research sources...")
+    stats = StageStats("fetch", "split", "embed", "add")
+    docs_q = asyncio.Queue(maxsize=queue_size)
+    chunks_q = asyncio.Queue(maxsize=batch_size * 2)
+    vectors_q = asyncio.Queue(maxsize=2)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=2500, chunk_overlap=300)
+    registry = registry or IndexRegistry(os.path.join(faiss_index_path, "registry.db"))
+    near_dups = near_dups or NearDuplicateIndex(os.path.join(faiss_index_path, "near_dup.db"))
+    feed_state = feed_state or FeedStateStore()
+    present = set(vectorstore.index_to_docstore_id.values())
+    deletes = []
+
+    async def fetch_stage():
+        try:
+            async for res in iter_all_sources(max_docs=max_docs, feed_state=feed_state, buffer=queue_size):
+                stats.stages["fetch"]["in"] += 1
+                await docs_q.put(resource_to_document(res))
+                stats.stages["fetch"]["out"] += 1
+                stats.observe_queue("split", docs_q)
+        finally:
+            await docs_q.put(_DONE)
+
+    async def split_stage():
+        while True:
+            doc = await docs_q.get()
+            if doc is _DONE:
+                break
+            stats.stages["split"]["in"] += 1
+            key = document_key(doc)
+            if registry.is_suppressed(key) or expired(doc.metadata):
+                continue
+            if near_dups.match(doc, key) is not None:
+                continue
+            if registry.is_unchanged(doc):
+                continue
+            start = time.perf_counter()
+            change = registry.plan(doc, splitter.split_documents([doc]))
+            registry.record(change)
+            deletes.extend(change.delete)
+            stats.stages["split"]["busy_seconds"] += time.perf_counter() - start
+            for vid, chunk in change.add:
+                await chunks_q.put((vid, chunk))
+                stats.stages["split"]["out"] += 1
+            stats.observe_queue("embed", chunks_q)
+        await chunks_q.put(_DONE)
+
+    async def embed_stage():
+        embeddings = vectorstore.embeddings
+
+        async def flush(batch):
+            start = time.perf_counter()
+            texts = [chunk.page_content for _, chunk in batch]
+            # Embedding is CPU-bound; the embedding service runs it on its own executor so fetching continues.
+            vectors = await embeddings.aembed_documents(texts)
+            stats.stages["embed"]["busy_seconds"] += time.perf_counter() - start
+            stats.stages["embed"]["out"] += len(batch)
+            await vectors_q.put((batch, vectors))
+            stats.observe_queue("add", vectors_q)
+
+        batch = []
+        while True:
+            chunk = await chunks_q.get()
+            if chunk is _DONE:
+                break
+            stats.stages["embed"]["in"] += 1
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                await flush(batch)
+                batch = []
+        if batch:
+            await flush(batch)
+        await vectors_q.put(_DONE)
+
+    async def add_stage():
+        while True:
+            item = await vectors_q.get()
+            if item is _DONE:
+                break
+            batch, vectors = item
+            start = time.perf_counter()
+            stats.stages["add"]["in"] += len(batch)
+            ids = [vid for vid, _ in batch]
+            # Vectors left over from a run whose registry update was never committed are replaced.
+            stale = [vid for vid in ids if vid in present]
+            if stale:
+                vectorstore.delete(stale)
+            vectorstore.add_embeddings(list(zip([c.page_content for _, c in batch], vectors)),
+                                       metadatas=[c.metadata for _, c in batch], ids=ids)
+            stats.stages["add"]["busy_seconds"] += time.perf_counter() - start
+            stats.stages["add"]["out"] += len(batch)
+
     try:
-        async_resources = await fetch_all_sources(max_docs=max_docs)
-        logging.info(f"[Startup] Fetched {len(async_resources)} async resources (news/blog/research). Ingesting...")
-        docs = []
-        for res in async_resources:
-            content = f"Resource Title: {res['title']}\nSource: {res['source']}\nCompany: {res.get('company','')}\nType: {res['type']}\nURL: {res['url']}\nPublished: {res.get('published_date','')}\nSummary: {res.get('summary','')}\n\nFull Content: {res.get('content', '')}"
-            metadata = {
-                "source": res['source'],
-                "title": res['title'],
-                "url": res['url'],
-                "company": res.get('company',''),
-                "type": res['type'],
-                "published_date": res.get('published_date','')
-            }
-            docs.append(Document(page_content=content, metadata=metadata))
-        if docs:
-            splitter = RecursiveCharacterTextSplitter(chunk_size=2500, chunk_overlap=300)
-            texts = splitter.split_documents(docs)
-            logging.info(f"[Startup] Split {len(docs)} docs into {len(texts)} chunks. Adding to vectorstore...")
-            # Add to vectorstore and persist
-            vectorstore.add_documents(texts)
-            faiss_index_path = "faiss_index"
-            vectorstore.save_local(faiss_index_path)
-            logging.info(f"[Startup] Async resources ingested and FAISS index updated.")
+        stages = [asyncio.ensure_future(stage()) for stage in (fetch_stage, split_stage, embed_stage, add_stage)]
+        try:
+            await asyncio.gather(*stages)
+        except Exception:
+            # One failed stage would leave the others blocked on their queues.
+            for task in stages:
+                task.cancel()
+            raise
+        stats.log()
+        near_dups.log_stats()
+        deletes.extend(near_dups.retired_vector_ids(registry))
+        deletes = [vid for vid in set(deletes) if vid in present]
+        if deletes:
+            vectorstore.delete(deletes)
+        annotated = near_dups.apply(vectorstore, registry)
+        if stats.stages["add"]["out"] or deletes or annotated:
+            if checkpoint is not None:
+                checkpoint(vectorstore)
+            else:
+                save_vectorstore(vectorstore, faiss_index_path)
+            logging.info(f"[Startup] Ingested {stats.stages['fetch']['out']} async resources as "
+                         f"{stats.stages['add']['out']} chunks; FAISS index updated.")
         else:
             logging.info("[Startup] No async docs to ingest.")
+        registry.commit()
+        near_dups.commit()
+        feed_state.save()
+        return stats
     except Exception as e:
+        registry.rollback()
+        near_dups.rollback()
+        feed_state.discard()
         logging.error(f"[Startup] Error fetching or ingesting async resources: {e}")
+        return None
@@ -0,0 +1,109 @@
+"""
+bulk_embed.py
+- Multi-process embedding for full rebuilds (`python -m indexer build-index --full --workers N`).
+- Chunks are sharded across a pool of worker processes. Each worker loads its own copy of the embedding
+  backend with a pinned thread count (and CPU set, where the OS allows it), so N workers use N x threads cores
+  instead of one process's worth.
+- Shards are submitted in a bounded window and their vectors come back in input order, ready for
+  FAISS.from_embeddings / add_embeddings. Cache lookups stay in the parent, which owns the embedding cache.
+"""
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from embedding_service import EMBEDDING_BACKEND, create_embeddings
+
+BULK_SHARD_SIZE = int(os.getenv("BULK_SHARD_SIZE", "256"))
+
+_worker_embeddings = None
+
+
+def _init_worker(threads, backend, counter):
+    """Pool initializer: pins threads (and cores) before the backend is imported, then loads the model."""
+    global _worker_embeddings
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "ONNX_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    if hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        mine = cores[index * threads:(index + 1) * threads]
+        if len(mine) == threads:
+            os.sched_setaffinity(0, mine)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_embeddings = create_embeddings(backend, cached=False)
+
+
+def _embed_shard(texts):
+    return np.asarray(_worker_embeddings.embed_documents(texts), dtype=np.float32)
+
+
+class ProcessPoolEmbeddings(Embeddings):
+    """Embeddings computed by a pool of worker processes, each with its own model copy."""
+
+    def __init__(self, workers, threads_per_worker=None, shard_size=BULK_SHARD_SIZE, backend=EMBEDDING_BACKEND):
+        self.workers = max(1, int(workers))
+        self.threads = max(1, int(threads_per_worker or (os.cpu_count() or 1) // self.workers))
+        self.shard_size = max(1, int(shard_size))
+        ctx = multiprocessing.get_context("spawn")
+        # spawn: forking a process that already runs tokenizer/BLAS threads can deadlock.
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_init_worker,
+                                             initargs=(self.threads, backend, ctx.Value("i", 0)))
+        self.stats = {"chunks": 0, "seconds": 0.0}
+
+    def iter_vectors(self, texts):
+        """Yields one float32 array per shard of `texts`, in input order, with at most 2 shards per worker in flight."""
+        pending = deque()
+        for start in range(0, len(texts), self.shard_size):
+            pending.append(self._executor.submit(_embed_shard, texts[start:start + self.shard_size]))
+            if len(pending) >= self.workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def embed_documents(self, texts):
+        start = time.perf_counter()
+        vectors = []
+        for shard in self.iter_vectors(list(texts)):
+            vectors.extend(shard.tolist())
+        elapsed = time.perf_counter() - start
+        self.stats["chunks"] += len(vectors)
+        self.stats["seconds"] += elapsed
+        if vectors:
+            logging.info(f"[Bulk Embed] {len(vectors)} chunks in {elapsed:.1f}s ({len(vectors) / max(elapsed, 1e-9):.1f} chunks/s) "
+                         f"on {self.workers} workers x {self.threads} threads")
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def chunks_per_second(self):
+        return self.stats["chunks"] / self.stats["seconds"] if self.stats["seconds"] else 0.0
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def bulk_embeddings(service, workers, threads_per_worker=None):
+    """
+    ProcessPoolEmbeddings behind the same embedding cache as `service`, so cached chunks are never sent to
+    the workers and fresh vectors are cached for later incremental runs.
+    Returns:
+        (embeddings, pool): use `embeddings` for embedding, close `pool` when done.
+    """
+    from embedding_cache import CachedEmbeddings
+    pool = ProcessPoolEmbeddings(workers, threads_per_worker)
+    cached = service.embeddings
+    return CachedEmbeddings(pool, cached.model_name, cache=cached.cache), pool
@@ -1,40 +1,25 @@
 """
 cache_loader.py
-- Loads all .txt files from the cache directory and returns them as LangChain Documents for indexing.
+- Loads every article held in the content store and returns them as LangChain Documents for indexing.
 - Designed for integration into the RAG pipeline and async ingestion.
 """
-import os
 from langchain.schema import Document
+from content_store import get_content_store
 
-CACHE_DIR = "cache"
-
-def load_cached_documents():
+def load_cached_documents(store=None):
     """
-    Loads all .txt files from the cache directory and returns them as LangChain Documents.
+    Streams all live records of the content store into LangChain Documents.
+    Metadata comes from the store's index (no re-parsing of header lines).
     Returns:
         List[Document]: List of LangChain Document objects.
     """
+    store = store or get_content_store()
     docs = []
-    if not os.path.exists(CACHE_DIR):
-        return docs
-    for fname in os.listdir(CACHE_DIR):
-        if fname.endswith(".txt"):
-            fpath = os.path.join(CACHE_DIR, fname)
-            try:
-                with open(fpath, "r", encoding="utf-8") as f:
-                    content = f.read().strip()
-                # Attempt to extract metadata if present (simple heuristics)
-                lines = content.split("\n")
-                title = lines[0].replace("Title:", "").strip() if lines and lines[0].lower().startswith("title:") else ""
-                url = ""
-                published_date = ""
-                for line in lines:
-                    if line.lower().startswith("url:"):
-                        url = line.split(":", 1)[-1].strip()
-                    if line.lower().startswith("published:"):
-                        published_date = line.split(":", 1)[-1].strip()
-                metadata = {"source": "cache", "title": title, "url": url, "published_date": published_date, "filename": fname}
-                docs.append(Document(page_content=content, metadata=metadata))
-            except Exception as e:
-                print(f"[Cache Loader] Failed to load {fname}: {e}")
+    for record in store.iter_records():
+        try:
+            metadata = {"source": "cache", "title": record["title"], "url": record["url"],
+                        "published_date": record["published_date"], "variant": record["variant"]}
+            docs.append(Document(page_content=record["text"].strip(), metadata=metadata))
+        except Exception as e:
+            print(f"[Cache Loader] Failed to load {record.get('url')}: {e}")
     return docs
@@ -0,0 +1,199 @@
+"""
+content_store.py
+- Content-addressed, compressed store for extracted article text (replaces the flat cache/<md5>.txt files).
+- One SQLite file: `blobs` holds zlib-compressed bodies keyed by SHA-256 of the text,
+  `entries` indexes URL -> hash, variant, extraction method, title/date and fetch/access times.
+- Bounded by a byte cap (LRU eviction) and a TTL; `iter_records` streams the whole store in batches.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+CONTENT_DB_PATH = os.path.join("cache", "content.db")
+CONTENT_STORE_MAX_MB = float(os.getenv("CONTENT_STORE_MAX_MB", "512"))
+CONTENT_TTL_DAYS = float(os.getenv("CONTENT_TTL_DAYS", "30"))
+# Characters handed downstream per article; the store always keeps the complete extraction.
+ARTICLE_MAX_CHARS = 2000
+
+# Which text a record holds: the full newspaper3k body, or the composed BeautifulSoup fallback
+# (title/author/date/summary header plus at most ARTICLE_MAX_CHARS of page text).
+VARIANT_FULL = "full"
+VARIANT_FALLBACK = "fallback"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    raw_size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    method TEXT,
+    title TEXT,
+    published_date TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed_at);
+CREATE INDEX IF NOT EXISTS entries_hash ON entries(hash);
+"""
+
+
+def snippet(record):
+    """Text handed downstream for a record: full extractions are cut to ARTICLE_MAX_CHARS, fallbacks as-is."""
+    if record["variant"] == VARIANT_FULL:
+        return record["text"][:ARTICLE_MAX_CHARS]
+    return record["text"]
+
+
+class ContentStore:
+    """SQLite-backed article store with compression, an URL index, LRU/TTL eviction and bulk iteration."""
+
+    def __init__(self, path=CONTENT_DB_PATH, max_bytes=int(CONTENT_STORE_MAX_MB * 1024 * 1024),
+                 ttl_seconds=CONTENT_TTL_DAYS * 86400):
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self.ttl_seconds = float(ttl_seconds)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(stored_size), 0) FROM blobs").fetchone()[0]
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def _expired(self, fetched_at, now):
+        return self.ttl_seconds > 0 and now - fetched_at > self.ttl_seconds
+
+    def get(self, url):
+        """
+        Returns {'url', 'text', 'variant', 'method', 'title', 'published_date', 'fetched_at'} or None
+        when the URL is unknown or older than the TTL.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT e.hash, e.variant, e.method, e.title, e.published_date, e.fetched_at, b.body "
+                "FROM entries e JOIN blobs b ON b.hash = e.hash WHERE e.url = ?", (url,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            if self._expired(row[5], now):
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                self._delete_urls([url])
+                return None
+            self._conn.execute("UPDATE entries SET accessed_at = ? WHERE url = ?", (now, url))
+            self._conn.commit()
+            self.stats["hits"] += 1
+        return {"url": url, "text": zlib.decompress(row[6]).decode("utf-8"), "variant": row[1], "method": row[2],
+                "title": row[3] or "", "published_date": row[4] or "", "fetched_at": row[5]}
+
+    def put(self, url, text, variant, method=None, title="", published_date=""):
+        """Stores `text` for `url` (deduplicated by content hash) and evicts if the byte cap is exceeded."""
+        raw = text.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        now = time.time()
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone() is None:
+                body = zlib.compress(raw, 6)
+                self._conn.execute("INSERT INTO blobs (hash, body, raw_size, stored_size) VALUES (?, ?, ?, ?)",
+                                   (digest, body, len(raw), len(body)))
+                self._total_bytes += len(body)
+            old = self._conn.execute("SELECT hash FROM entries WHERE url = ?", (url,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (url, hash, variant, method, title, published_date, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (url, digest, variant, method, title, published_date, now, now))
+            if old and old[0] != digest:
+                self._drop_orphans([old[0]])
+            self._conn.commit()
+            if self._total_bytes > self.max_bytes:
+                self._evict_locked()
+        return digest
+
+    def _delete_urls(self, urls):
+        hashes = [r[0] for r in self._conn.execute(
+            f"SELECT hash FROM entries WHERE url IN ({','.join('?' * len(urls))})", urls)]
+        self._conn.execute(f"DELETE FROM entries WHERE url IN ({','.join('?' * len(urls))})", urls)
+        self._drop_orphans(hashes)
+        self._conn.commit()
+
+    def _drop_orphans(self, hashes):
+        for digest in set(hashes):
+            if self._conn.execute("SELECT 1 FROM entries WHERE hash = ? LIMIT 1", (digest,)).fetchone():
+                continue
+            row = self._conn.execute("SELECT stored_size FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+                self._total_bytes -= row[0]
+
+    def _evict_locked(self):
+        # Drop expired entries first, then least-recently-used ones until we are 10% under the cap.
+        if self.ttl_seconds > 0:
+            expired = [r[0] for r in self._conn.execute(
+                "SELECT url FROM entries WHERE fetched_at < ?", (time.time() - self.ttl_seconds,))]
+            if expired:
+                self._delete_urls(expired)
+                self.stats["expired"] += len(expired)
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            victims = [r[0] for r in self._conn.execute(
+                "SELECT url FROM entries ORDER BY accessed_at ASC LIMIT 64")]
+            if not victims:
+                break
+            self._delete_urls(victims)
+            self.stats["evicted"] += len(victims)
+        logging.info(f"[Content Store] Evicted down to {self._total_bytes} bytes (cap {self.max_bytes}).")
+
+    def evict(self):
+        """Applies TTL expiry and the byte cap now (normally done lazily on put)."""
+        with self._lock:
+            self._evict_locked()
+
+    def iter_records(self, batch_size=500):
+        """Yields every live record (same shape as get()) in URL order without loading the store at once."""
+        last_url = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT e.url, e.variant, e.method, e.title, e.published_date, e.fetched_at, b.body "
+                    "FROM entries e JOIN blobs b ON b.hash = e.hash WHERE e.url > ? ORDER BY e.url LIMIT ?",
+                    (last_url, batch_size)).fetchall()
+            if not rows:
+                return
+            now = time.time()
+            for url, variant, method, title, published_date, fetched_at, body in rows:
+                if self._expired(fetched_at, now):
+                    continue
+                yield {"url": url, "text": zlib.decompress(body).decode("utf-8"), "variant": variant, "method": method,
+                       "title": title or "", "published_date": published_date or "", "fetched_at": fetched_at}
+            last_url = rows[-1][0]
+
+    def summary(self):
+        with self._lock:
+            entries, raw = self._conn.execute(
+                "SELECT COUNT(*), COALESCE((SELECT SUM(raw_size) FROM blobs), 0) FROM entries").fetchone()
+        return {"entries": entries, "raw_bytes": raw, "stored_bytes": self._total_bytes, "max_bytes": self.max_bytes, **self.stats}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_store = None
+
+
+def get_content_store():
+    """Process-wide ContentStore, opened on first use."""
+    global _store
+    if _store is None:
+        _store = ContentStore()
+    return _store
@@ -1,14 +1,76 @@
 ### data_loader.py
+# Static sources (AI companies, arXiv, PubMed, SSRN). Each fetcher is async and runs on a shared
+# FetchScheduler session with a deadline; fetch_static_sources_async runs them all concurrently.
+# The sync functions (fetch_arxiv, fetch_pubmed, ...) keep their old signatures as thin wrappers.
 
-import requests
+import asyncio
+import json
+import logging
+import os
 from bs4 import BeautifulSoup
 import feedparser
 from datetime import datetime
+from feed_state import FeedStateStore, parse_feed_conditional
+from fetch_scheduler import FetchScheduler
+
+ARXIV_API_URL = "https://export.arxiv.org/api/query"
+# arXiv serves at most 2000 results per call and asks clients to wait 3 seconds between calls.
+ARXIV_PAGE_SIZE = int(os.getenv("ARXIV_PAGE_SIZE", "500"))
+ARXIV_REQUEST_INTERVAL = 3.0
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+# esearch pages IDs (PubMed caps retstart + retmax at 10000); esummary takes up to 200 IDs per GET.
+PUBMED_SEARCH_PAGE = int(os.getenv("PUBMED_SEARCH_PAGE", "5000"))
+PUBMED_SUMMARY_BATCH = int(os.getenv("PUBMED_SUMMARY_BATCH", "200"))
+PUBMED_MAX_RESULTS = 10000
+NCBI_API_KEY = os.getenv("NCBI_API_KEY", "")
+# Wall-clock budget of one static source; paging stops (keeping what it has) when it runs out.
+STATIC_SOURCE_DEADLINE = float(os.getenv("STATIC_SOURCE_DEADLINE", "120"))
+
+
+class RateLimiter:
+    """Spaces request starts at least `interval` seconds apart (per-API politeness limits)."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._next = 0.0
+
+    async def wait(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next = loop.time() + self.interval
+
+
+def _time_left(deadline):
+    """Seconds until `deadline` (event-loop time), or None when there is no deadline."""
+    if deadline is None:
+        return None
+    return deadline - asyncio.get_running_loop().time()
+
+
+async def _get_text(session, scheduler, url, params=None, timeout=30, deadline=None, limiter=None):
+    """GET through the scheduler with a timeout clipped to the deadline; raises on HTTP errors."""
+    if limiter is not None:
+        await limiter.wait()
+    left = _time_left(deadline)
+    if left is not None:
+        if left <= 0:
+            raise asyncio.TimeoutError(f"deadline reached before {url}")
+        timeout = min(timeout, left)
+    fetched = await scheduler.fetch(session, url, timeout=timeout, params=params)
+    if fetched.status >= 400:
+        raise Exception(f"HTTP {fetched.status} from {url}")
+    return fetched.text
+
 
 # --- Enriched AI/ML/LLM Company Info Loader ---
-def fetch_ai_companies():
+def _company_profiles():
     """
-    Returns a list of major AI/ML/LLM companies and labs with enriched metadata for accurate context.
+    Returns the static profiles of major AI/ML/LLM companies and labs (before feed enrichment).
+    A missing or None "latest_blog" is filled from the head entry of the company's own feed.
     """
     # Example static data; in production, you can scrape or use APIs for live updates
     companies = [
@@ -95,8 +157,7 @@ def fetch_ai_companies():
             "valuation": "$80-90B (2023)",
             "funding": "$11.3B+",
             "twitter": "https://twitter.com/openai",
-            # Defensive: only call fetch_openai_blog(1) once and check for result
-            "latest_blog": (lambda blogs: blogs[0] if blogs else {"title": "See OpenAI blog", "url": "https://openai.com/blog"})(fetch_openai_blog(1) if 'fetch_openai_blog' in globals() else [])
+            "latest_blog": None
         },
         {
             "name": "DeepMind",
@@ -258,67 +319,134 @@ def fetch_ai_companies():
         }
     ]
 
-    # Optionally, fetch and enrich with latest blog/news headlines
-    enriched = []
-    for comp in companies:
-        # Try to fetch latest blog title
-        latest_title = ""
+    return companies
+
+
+async def fetch_ai_companies_async(session, scheduler=None, deadline=None, feed_state=None):
+    """
+    Company profiles enriched with the latest headline of each company feed. All feeds are polled
+    concurrently with conditional GETs; an unchanged feed (304) reuses the head entry stored last time.
+    """
+    scheduler = scheduler or FetchScheduler()
+    feed_state = feed_state or FeedStateStore()
+    companies = _company_profiles()
+
+    async def enrich(comp):
+        key = f"company:{comp['rss']}"
         try:
-            feed = feedparser.parse(comp["rss"])
-            if feed.entries:
-                latest_title = feed.entries[0].title
-        except Exception:
-            pass
-        comp["latest_blog_title"] = latest_title
-        enriched.append(comp)
-    return enriched
+            left = _time_left(deadline)
+            timeout = 15 if left is None else min(15, left)
+            fetched = await scheduler.fetch(session, comp["rss"], timeout=timeout,
+                                            headers=feed_state.conditional_headers(key))
+            if fetched.status < 300:
+                feed_state.record_response(key, fetched.headers.get("ETag"), fetched.headers.get("Last-Modified"))
+                feed = await asyncio.to_thread(feedparser.parse, fetched.text)
+                if feed.entries:
+                    feed_state.set_latest(key, feed.entries[0])
+        except Exception as e:
+            logging.warning(f"[Static Sources] Feed of {comp['name']} failed: {e!r}")
+        return feed_state.latest_entry(key)
 
-def fetch_arxiv(keyword="AI", max_results=10):
-    url = f"http://export.arxiv.org/api/query?search_query=all:{keyword}&start=0&max_results={max_results}"
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, "xml")
-    entries = soup.find_all("entry")
+    polled = [comp for comp in companies if comp["rss"]]
+    latest = dict(zip((comp["name"] for comp in polled), await asyncio.gather(*(enrich(c) for c in polled))))
+    for comp in companies:
+        head = latest.get(comp["name"])
+        comp["latest_blog_title"] = head["title"] if head else ""
+        if comp.get("latest_blog") is None:
+            comp["latest_blog"] = head or {"title": f"See {comp['name']} blog", "url": f"{comp['website']}/blog"}
+    feed_state.save()
+    return companies
+
+
+def _parse_arxiv(xml):
+    soup = BeautifulSoup(xml, "xml")
     papers = []
-    for entry in entries:
+    for entry in soup.find_all("entry"):
         papers.append({
             "title": entry.title.text.strip(),
             "summary": entry.summary.text.strip(),
+            "published_date": entry.published.text.strip() if entry.published else "",
+            "url": entry.id.text.strip() if entry.id else "",
             "source": "arxiv"
         })
     return papers
 
-def fetch_pubmed(keyword="AI", max_results=10):
-    search_url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
-    search_params = {
-        "db": "pubmed",
-        "term": keyword,
-        "retmax": max_results,
-        "retmode": "json"
-    }
-    search_res = requests.get(search_url, params=search_params).json()
-    ids = ",".join(search_res["esearchresult"]["idlist"])
-
-    fetch_url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
-    fetch_params = {
-        "db": "pubmed",
-        "id": ids,
-        "retmode": "json"
-    }
-    fetch_res = requests.get(fetch_url, params=fetch_params).json()
+
+async def fetch_arxiv_async(session, keyword="AI", max_results=10, scheduler=None, deadline=None,
+                            page_size=ARXIV_PAGE_SIZE):
+    """
+    Pages through the arXiv API with start/max_results (newest first) until `max_results` papers,
+    the end of the result set or the deadline. Pages are spaced ARXIV_REQUEST_INTERVAL apart.
+    """
+    scheduler = scheduler or FetchScheduler()
+    limiter = RateLimiter(ARXIV_REQUEST_INTERVAL)
     papers = []
-    for uid in fetch_res["result"]["uids"]:
-        doc = fetch_res["result"][uid]
-        papers.append({
-            "title": doc.get("title", ""),
-            "summary": doc.get("source", ""),
-            "source": "pubmed"
-        })
-    return papers
+    while len(papers) < max_results:
+        size = min(page_size, max_results - len(papers))
+        params = {"search_query": f"all:{keyword}", "start": len(papers), "max_results": size,
+                  "sortBy": "submittedDate", "sortOrder": "descending"}
+        try:
+            xml = await _get_text(session, scheduler, ARXIV_API_URL, params, timeout=60, deadline=deadline, limiter=limiter)
+        except Exception as e:
+            logging.warning(f"[Static Sources] arXiv page at {len(papers)} failed, keeping {len(papers)} papers: {e!r}")
+            break
+        page = await asyncio.to_thread(_parse_arxiv, xml)
+        papers.extend(page)
+        if len(page) < size:
+            break
+    return papers[:max_results]
 
-def fetch_ssrn(keyword="AI"):
-    search_url = f"https://papers.ssrn.com/sol3/results.cfm?txtKey_Words={keyword}"
-    res = requests.get(search_url)
-    soup = BeautifulSoup(res.text, "html.parser")
+
+async def fetch_pubmed_async(session, keyword="AI", max_results=10, scheduler=None, deadline=None,
+                             search_page=PUBMED_SEARCH_PAGE, summary_batch=PUBMED_SUMMARY_BATCH):
+    """
+    PubMed search: esearch pages the matching IDs (retstart/retmax), then esummary fetches them in
+    batches of `summary_batch` IDs, concurrently within NCBI's rate limit (3 req/s, 10 with NCBI_API_KEY).
+    """
+    scheduler = scheduler or FetchScheduler()
+    limiter = RateLimiter(0.1 if NCBI_API_KEY else 0.34)
+    auth = {"api_key": NCBI_API_KEY} if NCBI_API_KEY else {}
+    max_results = min(max_results, PUBMED_MAX_RESULTS)
+    ids = []
+    while len(ids) < max_results:
+        size = min(search_page, max_results - len(ids))
+        params = {"db": "pubmed", "term": keyword, "retstart": len(ids), "retmax": size, "retmode": "json", **auth}
+        try:
+            text = await _get_text(session, scheduler, f"{EUTILS_URL}/esearch.fcgi", params, deadline=deadline, limiter=limiter)
+            page = json.loads(text)["esearchresult"]["idlist"]
+        except Exception as e:
+            logging.warning(f"[Static Sources] PubMed esearch at {len(ids)} failed, keeping {len(ids)} IDs: {e!r}")
+            break
+        ids.extend(page)
+        if len(page) < size:
+            break
+
+    async def summarize(batch):
+        params = {"db": "pubmed", "id": ",".join(batch), "retmode": "json", **auth}
+        try:
+            text = await _get_text(session, scheduler, f"{EUTILS_URL}/esummary.fcgi", params, deadline=deadline, limiter=limiter)
+            result = json.loads(text)["result"]
+        except Exception as e:
+            logging.warning(f"[Static Sources] PubMed esummary of {len(batch)} IDs failed: {e!r}")
+            return []
+        papers = []
+        for uid in result.get("uids", []):
+            doc = result[uid]
+            papers.append({
+                "title": doc.get("title", ""),
+                "summary": doc.get("source", ""),
+                "published_date": doc.get("sortpubdate") or doc.get("pubdate", ""),
+                "url": f"https://pubmed.ncbi.nlm.nih.gov/{uid}/",
+                "source": "pubmed"
+            })
+        return papers
+
+    batches = [ids[i:i + summary_batch] for i in range(0, len(ids), summary_batch)]
+    return [paper for papers in await asyncio.gather(*(summarize(b) for b in batches)) for paper in papers]
+
+
+def _parse_ssrn(html):
+    soup = BeautifulSoup(html, "html.parser")
     papers = []
     for div in soup.select(".title")[:10]:
         papers.append({
@@ -328,32 +456,111 @@ def fetch_ssrn(keyword="AI"):
         })
     return papers
 
-def fetch_openai_blog(max_results=200):
-    """Fetch latest posts from OpenAI blog RSS feed."""
-    feed_url = "https://openai.com/blog/rss.xml"
-    feed = feedparser.parse(feed_url)
+
+async def fetch_ssrn_async(session, keyword="AI", scheduler=None, deadline=None):
+    scheduler = scheduler or FetchScheduler()
+    try:
+        html = await _get_text(session, scheduler, "https://papers.ssrn.com/sol3/results.cfm",
+                               {"txtKey_Words": keyword}, deadline=deadline)
+    except Exception as e:
+        logging.warning(f"[Static Sources] SSRN search failed: {e!r}")
+        return []
+    return await asyncio.to_thread(_parse_ssrn, html)
+
+
+async def fetch_static_sources_async(keyword="AI", arxiv_max=10, pubmed_max=10, deadline=STATIC_SOURCE_DEADLINE):
+    """
+    Fetches every static source concurrently on one scheduler session.
+    A source that fails or overruns `deadline` seconds contributes what it had (or nothing) instead of
+    holding up the others.
+    Returns:
+        {"arxiv": [...], "pubmed": [...], "ssrn": [...], "ai_companies": [...]}
+    """
+    scheduler = FetchScheduler()
+    async with scheduler.session() as session:
+        end = asyncio.get_running_loop().time() + deadline
+        fetchers = {
+            "arxiv": fetch_arxiv_async(session, keyword, arxiv_max, scheduler=scheduler, deadline=end),
+            "pubmed": fetch_pubmed_async(session, keyword, pubmed_max, scheduler=scheduler, deadline=end),
+            "ssrn": fetch_ssrn_async(session, keyword, scheduler=scheduler, deadline=end),
+            "ai_companies": fetch_ai_companies_async(session, scheduler=scheduler, deadline=end),
+        }
+        # Hard stop a little after the soft deadline, for a fetcher stuck outside a request.
+        results = await asyncio.gather(*(asyncio.wait_for(f, deadline + 10) for f in fetchers.values()),
+                                       return_exceptions=True)
+    sources = {}
+    for name, result in zip(fetchers, results):
+        if isinstance(result, BaseException):
+            logging.warning(f"[Static Sources] {name} failed: {result!r}")
+            result = []
+        sources[name] = result
+    logging.info("[Static Sources] " + " | ".join(f"{name}: {len(items)}" for name, items in sources.items()))
+    scheduler.log_stats("Static Sources")
+    return sources
+
+
+def _run_fetcher(fetcher, *args, **kwargs):
+    """Runs one async fetcher to completion on its own scheduler/session (for the sync API)."""
+    async def runner():
+        scheduler = FetchScheduler()
+        async with scheduler.session() as session:
+            return await fetcher(session, *args, scheduler=scheduler, **kwargs)
+    return asyncio.run(runner())
+
+
+def fetch_ai_companies():
+    """
+    Returns a list of major AI/ML/LLM companies and labs with enriched metadata for accurate context.
+    """
+    return _run_fetcher(fetch_ai_companies_async)
+
+def fetch_arxiv(keyword="AI", max_results=10):
+    return _run_fetcher(fetch_arxiv_async, keyword, max_results)
+
+def fetch_pubmed(keyword="AI", max_results=10):
+    return _run_fetcher(fetch_pubmed_async, keyword, max_results)
+
+def fetch_ssrn(keyword="AI"):
+    return _run_fetcher(fetch_ssrn_async, keyword)
+
+def _fetch_feed_posts(feed_url, source, max_results, new_only):
+    """
+    Conditional poll of an RSS feed shared by the blog/newsletter helpers.
+    With new_only, only entries not returned by an earlier call are included; on 304 Not Modified
+    nothing is parsed and new_only callers get [], others get the head entry stored on the last poll.
+    """
+    feed_state = FeedStateStore()
+    key = f"{source}:{feed_url}"
+    feed = parse_feed_conditional(feed_url, feed_state, key=key)
+    if feed is None:
+        latest = feed_state.latest_entry(key)
+        if new_only or not latest:
+            return []
+        return [{**latest, "source": source}][:max_results]
+    entries = feed_state.new_entries(key, feed.entries) if new_only else feed.entries
+    if new_only:
+        feed_state.expect(key, entries)
+    entries = entries[:max_results]
     posts = []
-    for entry in feed.entries[:max_results]:
+    for entry in entries:
         posts.append({
             "title": entry.title,
             "summary": entry.summary if hasattr(entry, 'summary') else '',
             "published_date": entry.published if hasattr(entry, 'published') else '',
-            "source": "openai_blog",
+            "source": source,
             "url": entry.link
         })
+    if new_only:
+        feed_state.mark_seen(key, entries)
+    elif feed.entries:
+        feed_state.set_latest(key, feed.entries[0])
+    feed_state.save()
     return posts
 
-def fetch_the_batch_newsletter(max_results=200):
-    """Fetch latest posts from The Batch (deeplearning.ai) newsletter RSS feed."""
-    feed_url = "https://www.deeplearning.ai/the-batch/feed/rss/"
-    feed = feedparser.parse(feed_url)
-    posts = []
-    for entry in feed.entries[:max_results]:
-        posts.append({
-            "title": entry.title,
-            "summary": entry.summary if hasattr(entry, 'summary') else '',
-            "published_date": entry.published if hasattr(entry, 'published') else '',
-            "source": "the_batch_newsletter",
-            "url": entry.link
-        })
-    return posts
\ No newline at end of file
+def fetch_openai_blog(max_results=200, new_only=True):
+    """Fetch posts from OpenAI blog RSS feed (only unseen ones unless new_only=False)."""
+    return _fetch_feed_posts("https://openai.com/blog/rss.xml", "openai_blog", max_results, new_only)
+
+def fetch_the_batch_newsletter(max_results=200, new_only=True):
+    """Fetch posts from The Batch (deeplearning.ai) newsletter RSS feed (only unseen ones unless new_only=False)."""
+    return _fetch_feed_posts("https://www.deeplearning.ai/the-batch/feed/rss/", "the_batch_newsletter", max_results, new_only)
@@ -19,8 +19,13 @@ AI_SOURCES = [
     # Newsletters
     {"name": "The Batch (deeplearning.ai)", "url": "https://www.deeplearning.ai/the-batch/feed/rss/", "type": "newsletter", "company": "deeplearning.ai"},
     {"name": "The Gradient", "url": "https://thegradient.pub/rss/", "type": "newsletter", "company": "The Gradient"},
-    {"name": "VentureBeat AI", "url": "https://venturebeat.com/category/ai/feed/", "type": "news", "company": "VentureBeat"},
+    {"name": "VentureBeat AI", "url": "https://venturebeat.com/category/ai/feed/", "type": "news", "company": "VentureBeat", "retention_days": 180},
     # Research
     {"name": "arXiv AI", "url": "http://export.arxiv.org/api/query?search_query=cat:cs.AI&start=0&max_results=100", "type": "research", "company": "arXiv"},
     # Add more sources as needed
 ]
+
+# Retention (lifecycle.py): days after its published_date a chunk expires from the index, by source name or by
+# document type; a "retention_days" key on an AI_SOURCES entry overrides both. Chunks without a known
+# publication date, and sources and types not listed, are kept.
+RETENTION_DAYS = {"news": 365}
@@ -0,0 +1,196 @@
+"""
+embedding_cache.py
+- Persistent embedding cache wrapping a LangChain Embeddings object (cache/embeddings/<model>/).
+- Vectors are float32 rows of one memory-mapped file; a SQLite index maps the SHA-1 of the normalized
+  chunk text to its row and last use. One directory per model, so keys are (model name, text hash).
+- Company/resource documents are regenerated verbatim on every build, so a rebuild only pays for text
+  that was never embedded before. Bounded by EMBED_CACHE_MAX_MB with least-recently-used eviction.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+EMBED_CACHE_DIR = os.path.join("cache", "embeddings")
+EMBED_CACHE_MAX_MB = float(os.getenv("EMBED_CACHE_MAX_MB", "1024"))
+_INITIAL_ROWS = 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS vectors (
+    key TEXT PRIMARY KEY,
+    slot INTEGER NOT NULL UNIQUE,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS vectors_used ON vectors(used_at);
+"""
+
+
+def normalize_text(text):
+    """NFC-normalized text with whitespace runs collapsed (what the cache key is computed from)."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def text_key(text):
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Memory-mapped float32 vector store for one model, keyed by text hash, with LRU eviction."""
+
+    def __init__(self, model_name, root=EMBED_CACHE_DIR, max_bytes=int(EMBED_CACHE_MAX_MB * 1024 * 1024)):
+        self.model_name = model_name
+        self.dir = os.path.join(root, re.sub(r"[^\w.-]+", "__", model_name))
+        self.max_bytes = int(max_bytes)
+        os.makedirs(self.dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.dir, "index.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._vectors_path = os.path.join(self.dir, "vectors.f32")
+        self._mmap = None
+        self.dim = None
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        if row:
+            self._open(int(row[0]))
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def _open(self, dim):
+        self.dim = dim
+        self.max_rows = max(1, self.max_bytes // (dim * 4))
+        existing = os.path.getsize(self._vectors_path) // (dim * 4) if os.path.exists(self._vectors_path) else 0
+        rows = max(min(_INITIAL_ROWS, self.max_rows), existing)
+        self._map_rows(rows)
+        used = {r[0] for r in self._conn.execute("SELECT slot FROM vectors")}
+        self._free = [slot for slot in range(self._rows - 1, -1, -1) if slot not in used]
+
+    def _map_rows(self, rows):
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap = None
+        with open(self._vectors_path, "ab") as f:
+            if f.tell() < rows * self.dim * 4:
+                f.truncate(rows * self.dim * 4)
+        self._rows = rows
+        self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+
+    def _allocate(self, count):
+        """Returns `count` free rows, growing the file (up to the byte cap) and evicting LRU rows if needed."""
+        if len(self._free) < count and self._rows < self.max_rows:
+            grown = min(self.max_rows, max(self._rows * 2, self._rows + count))
+            self._free.extend(range(grown - 1, self._rows - 1, -1))
+            self._map_rows(grown)
+        if len(self._free) < count:
+            # Evict down to 90% of capacity so we do not evict on every insert once full.
+            victims = self._conn.execute("SELECT key, slot FROM vectors ORDER BY used_at ASC LIMIT ?",
+                                         (count - len(self._free) + self.max_rows // 10,)).fetchall()
+            self._conn.executemany("DELETE FROM vectors WHERE key = ?", [(key,) for key, _ in victims])
+            self._free.extend(slot for _, slot in victims)
+            self.stats["evicted"] += len(victims)
+        return [self._free.pop() for _ in range(min(count, len(self._free)))]
+
+    def get_many(self, keys):
+        """Returns {key: float32 vector} for the cached keys among `keys`."""
+        if self.dim is None or not keys:
+            return {}
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                for key, slot in self._conn.execute(
+                        f"SELECT key, slot FROM vectors WHERE key IN ({','.join('?' * len(part))})", part):
+                    found[key] = np.array(self._mmap[slot])
+            if found:
+                self._conn.executemany("UPDATE vectors SET used_at = ? WHERE key = ?",
+                                       [(time.time(), key) for key in found])
+                self._conn.commit()
+        return found
+
+    def put_many(self, items):
+        """Stores [(key, vector)]; vectors of a different dimension than the cache's are rejected."""
+        if not items:
+            return
+        with self._lock:
+            if self.dim is None:
+                dim = len(items[0][1])
+                self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dim', ?)", (str(dim),))
+                self._open(dim)
+            slots = self._allocate(len(items))
+            now = time.time()
+            rows = []
+            for (key, vector), slot in zip(items, slots):
+                vector = np.asarray(vector, dtype=np.float32)
+                if vector.shape != (self.dim,):
+                    raise ValueError(f"Embedding dimension {vector.shape} does not match cache dimension {self.dim}")
+                self._mmap[slot] = vector
+                rows.append((key, slot, now))
+            self._mmap.flush()
+            self._conn.executemany("INSERT OR REPLACE INTO vectors (key, slot, used_at) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def summary(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {"model": self.model_name, "entries": entries, "dim": self.dim,
+                "max_bytes": self.max_bytes, "hit_rate": self.stats["hits"] / lookups if lookups else 0.0, **self.stats}
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.flush()
+                self._mmap = None
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves embed_documents from an EmbeddingCache and embeds only the misses
+    (each distinct text once per call). Queries are passed through uncached.
+    """
+
+    def __init__(self, embeddings, model_name, cache=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self._cache = cache
+
+    @property
+    def cache(self):
+        # Opened on first document embedding, so processes that only embed queries never touch the files.
+        if self._cache is None:
+            self._cache = EmbeddingCache(self.model_name)
+        return self._cache
+
+    def embed_documents(self, texts):
+        keys = [text_key(text) for text in texts]
+        found = self.cache.get_many(set(keys))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.cache.stats["hits"] += len(keys) - sum(1 for key in keys if key in missing)
+        self.cache.stats["misses"] += len(missing)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing, vectors))
+            self.cache.put_many(list(fresh.items()))
+            found.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in fresh.items())
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def log_stats(self):
+        if self._cache is not None:
+            logging.info(f"[Embedding Cache] {self.cache.summary()}")
@@ -0,0 +1,117 @@
+"""
+embedding_service.py
+- The process-wide embedding model. Every embedding call (index builds, streaming ingest, FAISS loads and
+  query embedding in the API) goes through get_embedding_service(), so the model weights are loaded once.
+- The backend (torch or int8 ONNX, see EMBEDDING_BACKEND) sits behind the persistent chunk embedding cache.
+- Sync batch API: embed_documents / embed_query. Async API: aembed_documents / aembed_query run on a
+  dedicated executor, so encoding never blocks the event loop or competes with the default executor.
+- warmup() runs one encode so the first real query does not pay for lazy initialisation.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.embeddings.base import Embeddings
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# "torch" (HuggingFaceEmbeddings) or "onnx" (int8 ONNX Runtime export, see onnx_embeddings.py).
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBED_EXECUTOR_WORKERS = int(os.getenv("EMBED_EXECUTOR_WORKERS", "2"))
+
+
+def create_embeddings(backend=EMBEDDING_BACKEND, model_name=EMBEDDING_MODEL_NAME, cached=True):
+    """
+    Builds the configured backend, behind the chunk embedding cache (embedding_cache.py) unless
+    `cached` is False. Falls back to torch when the ONNX export is missing. Use get_embedding_service()
+    instead of calling this directly; it is separate for worker processes that need their own model copy.
+    """
+    from embedding_cache import CachedEmbeddings
+    if backend == "onnx":
+        try:
+            from onnx_embeddings import OnnxEmbeddings
+            embeddings = OnnxEmbeddings()
+            # Quantized vectors differ slightly from torch ones, so they get their own cache namespace.
+            return CachedEmbeddings(embeddings, f"{model_name}@onnx-int8") if cached else embeddings
+        except Exception as e:
+            logging.warning(f"ONNX embedding backend unavailable ({e}); using torch. "
+                            f"Run `python -m onnx_embeddings export` to create it.")
+    from langchain_huggingface import HuggingFaceEmbeddings
+    embeddings = HuggingFaceEmbeddings(model_name=model_name)
+    return CachedEmbeddings(embeddings, model_name) if cached else embeddings
+
+
+class EmbeddingService(Embeddings):
+    """Shared embedding model with sync and executor-backed async APIs plus call statistics."""
+
+    def __init__(self, embeddings, workers=EMBED_EXECUTOR_WORKERS):
+        self.embeddings = embeddings
+        self.workers = max(1, int(workers))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embed")
+        self._stats_lock = threading.Lock()
+        self.stats = {"document_calls": 0, "documents": 0, "queries": 0, "seconds": 0.0, "warmup_seconds": None}
+
+    def _record(self, key, count, elapsed):
+        with self._stats_lock:
+            self.stats[key] += count
+            self.stats["seconds"] += elapsed
+
+    def embed_documents(self, texts):
+        start = time.perf_counter()
+        vectors = self.embeddings.embed_documents(texts)
+        self._record("documents", len(texts), time.perf_counter() - start)
+        with self._stats_lock:
+            self.stats["document_calls"] += 1
+        return vectors
+
+    def embed_query(self, text):
+        start = time.perf_counter()
+        vector = self.embeddings.embed_query(text)
+        self._record("queries", 1, time.perf_counter() - start)
+        return vector
+
+    async def aembed_documents(self, texts):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.embed_documents, texts)
+
+    async def aembed_query(self, text):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.embed_query, text)
+
+    def warmup(self):
+        """Loads the model fully and runs one encode; returns the seconds it took."""
+        start = time.perf_counter()
+        self.embeddings.embed_query("warmup")
+        self.stats["warmup_seconds"] = round(time.perf_counter() - start, 3)
+        logging.info(f"[Embedding Service] Warmed up in {self.stats['warmup_seconds']}s.")
+        return self.stats["warmup_seconds"]
+
+    def summary(self):
+        out = dict(self.stats)
+        cache = getattr(self.embeddings, "_cache", None)
+        if cache is not None:
+            out["cache"] = cache.summary()
+        return out
+
+    def log_stats(self):
+        logging.info(f"[Embedding Service] {self.stats}")
+        if hasattr(self.embeddings, "log_stats"):
+            self.embeddings.log_stats()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service():
+    """Process-wide EmbeddingService, created on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                logging.info(f"[Embedding Service] Loading {EMBEDDING_MODEL_NAME} ({EMBEDDING_BACKEND} backend)...")
+                _service = EmbeddingService(create_embeddings())
+    return _service
@@ -0,0 +1,329 @@
+"""
+faiss_index_types.py
+- Approximate search indexes (HNSW, IVF, IVF-PQ) built from the exact flat index the builder maintains.
+- index.faiss stays the flat authoring index: incremental adds/deletes, exact vectors and the
+  recall baseline. After each build, a search index of the selected type is written to
+  search.faiss and its parameters to index_params.json, in the same snapshot directory. The API loads it in place of
+  the flat index when it is in sync (same vectors in the same order), so the docstore mapping is unchanged.
+- read_index_mmap() opens index files memory-mapped and read-only for the API (see vector_store.py).
+- "auto" picks the type from the vector count and FAISS_MEMORY_BUDGET_MB. nprobe / efSearch persist with the
+  index and can be overridden at query time with FAISS_NPROBE / FAISS_EF_SEARCH. The requested type and
+  settings persist too, and rebuilds of the base (later builds, compaction) reuse them unless overridden.
+- recall_report() measures recall@k and latency of each type/setting against the flat baseline
+  (`python -m indexer index-report`).
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+INDEX_TYPES = ("auto", "flat", "hnsw", "ivf", "ivfpq")
+SEARCH_INDEX_FILE = "search.faiss"
+INDEX_PARAMS_FILE = "index_params.json"
+# Below this many vectors exact search takes about a millisecond; an approximate index is not worth it.
+AUTO_FLAT_MAX_VECTORS = int(os.getenv("FAISS_AUTO_FLAT_MAX", "20000"))
+FAISS_MEMORY_BUDGET_MB = float(os.getenv("FAISS_MEMORY_BUDGET_MB", "2048"))
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+DEFAULT_EF_SEARCH = 64
+DEFAULT_NPROBE = 16
+PQ_NBITS = 8
+# PQ codebooks train 2^pq_nbits centroids from at least as many points; below 2^_MIN_PQ_NBITS vectors IVF-PQ
+# falls back to IVF-flat.
+_MIN_PQ_NBITS = 4
+# FAISS wants at least 39 training points per IVF list; train on up to 256 per list.
+_MIN_POINTS_PER_LIST = 39
+_TRAIN_POINTS_PER_LIST = 256
+
+
+def estimate_bytes(index_type, n, dim, nlist=None, pq_m=None):
+    """Rough resident size of an index of `n` vectors."""
+    if index_type == "hnsw":
+        return n * (dim * 4 + HNSW_M * 2 * 4 * 1.1)
+    if index_type == "ivf":
+        return n * (dim * 4 + 8) + (nlist or 0) * dim * 4
+    if index_type == "ivfpq":
+        return n * ((pq_m or dim // 8) * PQ_NBITS / 8 + 8) + (nlist or 0) * dim * 4
+    return n * dim * 4
+
+
+def default_nlist(n):
+    nlist = int(4 * math.sqrt(max(n, 1)))
+    return max(1, min(nlist, n // _MIN_POINTS_PER_LIST or 1))
+
+
+def default_pq_m(dim):
+    """Number of PQ sub-quantizers: 8 dimensions per code byte, and it must divide dim."""
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def choose_params(n, dim, index_type="auto", memory_budget_mb=FAISS_MEMORY_BUDGET_MB, nprobe=None, ef_search=None):
+    """
+    Resolves the index type (auto-selecting by corpus size and memory budget) and its parameters. IVF-PQ code
+    sizes shrink to what `n` vectors can train (2^pq_nbits <= n), down to IVF-flat for tiny corpora.
+    Returns:
+        dict with 'type' and the build/search parameters of that type.
+    """
+    budget = memory_budget_mb * 1024 * 1024
+    nlist, pq_m = default_nlist(n), default_pq_m(dim)
+    if index_type == "auto":
+        if n <= AUTO_FLAT_MAX_VECTORS:
+            index_type = "flat"
+        elif estimate_bytes("hnsw", n, dim) <= budget:
+            index_type = "hnsw"
+        elif estimate_bytes("ivf", n, dim, nlist) <= budget:
+            index_type = "ivf"
+        else:
+            index_type = "ivfpq"
+    params = {"type": index_type, "dim": dim, "ntotal": n}
+    if index_type == "hnsw":
+        params.update(hnsw_m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=ef_search or DEFAULT_EF_SEARCH)
+    elif index_type in ("ivf", "ivfpq"):
+        params.update(nlist=nlist, nprobe=min(nprobe or DEFAULT_NPROBE, nlist))
+        if index_type == "ivfpq" and n < 2 ** _MIN_PQ_NBITS:
+            logging.info(f"[FAISS Index] {n} vectors are too few to train IVF-PQ; using IVF-flat.")
+            params["type"] = index_type = "ivf"
+        if index_type == "ivfpq":
+            params.update(pq_m=pq_m, pq_nbits=min(PQ_NBITS, int(math.log2(n))))
+    params["estimated_mb"] = round(estimate_bytes(index_type, n, dim, params.get("nlist"), params.get("pq_m")) / 2**20, 1)
+    return params
+
+
+def mapping_fingerprint(index_to_docstore_id):
+    """Identifies the vectors (and their order) of a LangChain FAISS store by its position -> docstore id map."""
+    ids = (index_to_docstore_id[i] for i in range(len(index_to_docstore_id)))
+    return hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()
+
+
+def flat_vectors(index):
+    """All vectors of a flat index as a float32 (ntotal, dim) array, in index order."""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build_search_index(vectors, params, metric=None):
+    """Builds (and trains, on a random sample) an index of params['type'] holding `vectors` in order."""
+    import faiss
+    metric = faiss.METRIC_L2 if metric is None else metric
+    n, dim = vectors.shape
+    kind = params["type"]
+    if kind == "flat":
+        index = faiss.IndexFlat(dim, metric)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["hnsw_m"], metric)
+        index.hnsw.efConstruction = params["ef_construction"]
+    elif kind == "ivf":
+        index = faiss.IndexIVFFlat(faiss.IndexFlat(dim, metric), dim, params["nlist"], metric)
+    elif kind == "ivfpq":
+        index = faiss.IndexIVFPQ(faiss.IndexFlat(dim, metric), dim, params["nlist"], params["pq_m"],
+                                 params["pq_nbits"], metric)
+    else:
+        raise ValueError(f"Unknown FAISS index type: {kind}")
+    if not index.is_trained:
+        sample_size = min(n, params["nlist"] * _TRAIN_POINTS_PER_LIST)
+        sample = vectors[np.random.RandomState(0).choice(n, sample_size, replace=False)] if sample_size < n else vectors
+        start = time.perf_counter()
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+        logging.info(f"[FAISS Index] Trained {kind} on {sample_size} vectors in {time.perf_counter() - start:.1f}s.")
+    index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    apply_search_params(index, params)
+    return index
+
+
+def apply_search_params(index, params):
+    """Sets nprobe / efSearch on `index` from params."""
+    import faiss
+    if params["type"] in ("ivf", "ivfpq"):
+        faiss.extract_index_ivf(index).nprobe = int(params["nprobe"])
+    elif params["type"] == "hnsw":
+        index.hnsw.efSearch = int(params["ef_search"])
+
+
+def _query_time_params(params):
+    """params with the FAISS_NPROBE / FAISS_EF_SEARCH overrides of the serving process applied."""
+    params = dict(params)
+    if params["type"] in ("ivf", "ivfpq") and os.getenv("FAISS_NPROBE"):
+        params["nprobe"] = int(os.environ["FAISS_NPROBE"])
+    elif params["type"] == "hnsw" and os.getenv("FAISS_EF_SEARCH"):
+        params["ef_search"] = int(os.environ["FAISS_EF_SEARCH"])
+    return params
+
+
+def write_search_index(faiss_index_path, vectorstore, index_type="auto", memory_budget_mb=FAISS_MEMORY_BUDGET_MB,
+                       nprobe=None, ef_search=None, force=False):
+    """
+    Builds the search index for `vectorstore` (the flat store saved at `faiss_index_path`) and persists it with
+    its parameters (temp file + rename, parameters last). A "flat" choice removes any old search index.
+    Skipped when the persisted index already matches the vectors and the requested parameters. The requested
+    settings themselves are kept too (see search_settings), so later rebuilds of the base reuse them.
+    Returns:
+        The parameters of the current search index.
+    """
+    import faiss
+    flat_index = vectorstore.index
+    params = choose_params(flat_index.ntotal, flat_index.d, index_type, memory_budget_mb, nprobe, ef_search)
+    params["fingerprint"] = mapping_fingerprint(vectorstore.index_to_docstore_id)
+    requested = _requested(index_type, memory_budget_mb, nprobe, ef_search)
+    current = read_params(faiss_index_path)
+    search_path = os.path.join(faiss_index_path, SEARCH_INDEX_FILE)
+    if not force and current and all(current.get(key) == value for key, value in params.items()) \
+            and (params["type"] == "flat" or os.path.exists(search_path)):
+        logging.info(f"[FAISS Index] {params['type']} search index is up to date.")
+        if current.get("requested") != requested:
+            current["requested"] = requested
+            _write_params(faiss_index_path, current)
+        return current
+    if params["type"] == "flat":
+        if os.path.exists(search_path):
+            os.remove(search_path)
+    else:
+        start = time.perf_counter()
+        index = build_search_index(flat_vectors(flat_index), params, flat_index.metric_type)
+        params["build_seconds"] = round(time.perf_counter() - start, 2)
+        faiss.write_index(index, search_path + ".tmp")
+        os.replace(search_path + ".tmp", search_path)
+    params["built_at"] = time.time()
+    params["requested"] = requested
+    _write_params(faiss_index_path, params)
+    logging.info(f"[FAISS Index] Wrote {params['type']} search index for {params['ntotal']} vectors "
+                 f"(~{params['estimated_mb']} MB).")
+    return params
+
+
+def record_requested(faiss_index_path, index_type="auto", memory_budget_mb=FAISS_MEMORY_BUDGET_MB, nprobe=None,
+                     ef_search=None):
+    """
+    Stores the requested search index settings without rebuilding (builds that only appended delta segments);
+    the next rebuild of the base (compaction) applies them.
+    """
+    params = read_params(faiss_index_path)
+    if params is None:
+        return
+    requested = _requested(index_type, memory_budget_mb, nprobe, ef_search)
+    if params.get("requested") != requested:
+        params["requested"] = requested
+        _write_params(faiss_index_path, params)
+
+
+def search_settings(faiss_index_path, index_type=None, memory_budget_mb=None, nprobe=None, ef_search=None):
+    """
+    Keyword arguments of write_search_index for the index at `faiss_index_path`: each setting given here, else
+    the one it was last requested with (index_params.json), else the default. A build or compaction without
+    flags therefore keeps the --index-type / --nprobe / --ef-search of the build that set them.
+    """
+    requested = (read_params(faiss_index_path) or {}).get("requested", {}) if faiss_index_path else {}
+    return _requested(index_type or requested.get("index_type") or "auto",
+                      memory_budget_mb or requested.get("memory_budget_mb") or FAISS_MEMORY_BUDGET_MB,
+                      nprobe or requested.get("nprobe"), ef_search or requested.get("ef_search"))
+
+
+def _requested(index_type, memory_budget_mb, nprobe, ef_search):
+    return {"index_type": index_type, "memory_budget_mb": memory_budget_mb, "nprobe": nprobe, "ef_search": ef_search}
+
+
+def _write_params(faiss_index_path, params):
+    params_path = os.path.join(faiss_index_path, INDEX_PARAMS_FILE)
+    with open(params_path + ".tmp", "w") as f:
+        json.dump(params, f, indent=2)
+    os.replace(params_path + ".tmp", params_path)
+
+
+def read_params(faiss_index_path):
+    try:
+        with open(os.path.join(faiss_index_path, INDEX_PARAMS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_index_mmap(path, index_type="flat"):
+    """
+    Opens a FAISS index file memory-mapped and read-only: flat and HNSW vectors are used in place from the
+    mapping (IO_FLAG_MMAP_IFC), IVF inverted lists are mapped with IO_FLAG_MMAP. Falls back to a normal read
+    on FAISS builds without mmap support.
+    """
+    import faiss
+    if index_type in ("ivf", "ivfpq"):
+        flags = getattr(faiss, "IO_FLAG_MMAP", 0)
+    else:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError as e:
+        logging.warning(f"[FAISS Index] mmap read of {path} failed ({e}); reading it into memory.")
+        return faiss.read_index(path)
+
+
+def load_search_index(faiss_index_path, fingerprint):
+    """
+    The persisted search index (memory-mapped) with its search parameters applied, or None when the index is
+    flat, missing, or was built from other vectors than those with `fingerprint` (flat search is used then).
+    """
+    params = read_params(faiss_index_path)
+    search_path = os.path.join(faiss_index_path, SEARCH_INDEX_FILE)
+    if not params or params["type"] == "flat" or not os.path.exists(search_path):
+        return None
+    if params.get("fingerprint") != fingerprint:
+        logging.warning(f"[FAISS Index] {search_path} is out of sync with the flat index; using flat search.")
+        return None
+    index = read_index_mmap(search_path, params["type"])
+    apply_search_params(index, _query_time_params(params))
+    logging.info(f"[FAISS Index] Using {params['type']} search index ({index.ntotal} vectors).")
+    return index
+
+
+def _timed_search(index, queries, k):
+    start = time.perf_counter()
+    latencies = []
+    results = []
+    for q in queries:
+        t = time.perf_counter()
+        results.append(index.search(q[None, :], k)[1][0])
+        latencies.append((time.perf_counter() - t) * 1000)
+    return np.array(results), {"p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                               "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+                               "total_s": round(time.perf_counter() - start, 3)}
+
+
+def recall_report(flat_index, k=10, queries=200, memory_budget_mb=FAISS_MEMORY_BUDGET_MB):
+    """
+    Recall@k and per-query latency of HNSW / IVF / IVF-PQ at several efSearch / nprobe settings against the
+    exact flat index (types the corpus is too small for are left out). Queries are stored vectors with a little
+    noise (so they are not exact hits). FAISS_NPROBE / FAISS_EF_SEARCH do not apply here.
+    Returns:
+        list of rows {'type', 'setting', 'recall', 'p50_ms', 'p95_ms', 'build_s'}; the first row is flat.
+    """
+    vectors = flat_vectors(flat_index)
+    n, dim = vectors.shape
+    rng = np.random.RandomState(0)
+    picks = vectors[rng.choice(n, min(queries, n), replace=False)]
+    noise = rng.normal(scale=float(np.std(vectors)) * 0.1, size=picks.shape).astype(np.float32)
+    q = np.ascontiguousarray(picks + noise, dtype=np.float32)
+    k = min(k, n)
+    truth, timing = _timed_search(flat_index, q, k)
+    rows = [{"type": "flat", "setting": "-", "recall": 1.0, **timing, "build_s": 0.0}]
+    sweeps = {"hnsw": ("ef_search", [16, 32, 64, 128, 256]), "ivf": ("nprobe", [1, 4, 16, 64]),
+              "ivfpq": ("nprobe", [1, 4, 16, 64])}
+    for kind, (knob, values) in sweeps.items():
+        params = choose_params(n, dim, kind, memory_budget_mb)
+        if params["type"] != kind:
+            continue
+        start = time.perf_counter()
+        index = build_search_index(vectors, params, flat_index.metric_type)
+        build_s = round(time.perf_counter() - start, 2)
+        for value in values:
+            if knob == "nprobe" and value > params["nlist"]:
+                continue
+            params[knob] = value
+            apply_search_params(index, params)
+            found, timing = _timed_search(index, q, k)
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+            rows.append({"type": kind, "setting": f"{knob}={value}", "recall": round(float(recall), 4),
+                         **timing, "build_s": build_s})
+    return rows
@@ -0,0 +1,183 @@
+"""
+feed_state.py
+- Small on-disk store of per-feed polling state: ETag, Last-Modified and the IDs of entries already seen.
+- Lets the RSS loaders send conditional GETs (If-None-Match / If-Modified-Since), skip parsing on 304,
+  and pass only unseen entries downstream.
+- The new entries of a 200 response stay pending until they are marked seen. While any are pending, the feed is
+  polled without validators, so entries a caller did not take this time (per-source caps, max_docs) are not
+  hidden behind a 304.
+- Entries whose delivery failed (their article could not be extracted) are not marked seen, so later polls retry
+  them, up to MAX_DELIVERY_ATTEMPTS times.
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+
+import feedparser
+
+FEED_STATE_PATH = os.path.join("cache", "feed_state.json")
+# Per-feed cap on remembered entry IDs; feeds only ever show their latest few hundred entries.
+MAX_SEEN_IDS = 5000
+# Failed deliveries of an entry after which it is marked seen anyway (a dead link should not pin a feed to
+# unconditional polls).
+MAX_DELIVERY_ATTEMPTS = 3
+
+
+def entry_id(entry):
+    """Stable identifier for a feedparser entry (guid, then link, then title)."""
+    return entry.get("id") or entry.get("link") or entry.get("title", "")
+
+
+class FeedStateStore:
+    """
+    JSON-backed map of feed key -> {etag, last_modified, seen, pending, failures, latest_entry, checked_at}.
+    The key is the feed URL; consumers that poll the same URL with their own notion of
+    "seen" namespace it (e.g. "openai_blog:<url>") so they don't consume each other's entries.
+    """
+
+    def __init__(self, path=FEED_STATE_PATH):
+        self.path = path
+        self.discard()
+
+    def discard(self):
+        """Drops unsaved changes by re-reading the state file."""
+        self._state = {}
+        self._dirty = False
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._state = json.load(f)
+            except Exception as e:
+                logging.warning(f"[Feed State] Could not read {self.path}, starting fresh: {e}")
+
+    def get(self, url):
+        return self._state.get(url, {})
+
+    def conditional_headers(self, url):
+        """
+        Headers for a conditional GET of `url` (empty on first poll, and while entries of the last response
+        are still pending: a 304 would hide them until the feed changes).
+        """
+        state = self.get(url)
+        headers = {}
+        if self.has_pending(url):
+            return headers
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+        return headers
+
+    def record_response(self, url, etag=None, last_modified=None):
+        """Remembers the validators of a 200 response (and the poll time); clears the previous pending entries."""
+        state = self._state.setdefault(url, {})
+        state.pop("pending", None)
+        state.pop("seen_key", None)
+        if etag:
+            state["etag"] = etag
+        if last_modified:
+            state["last_modified"] = last_modified
+        state["checked_at"] = time.time()
+        self._dirty = True
+
+    def new_entries(self, url, entries):
+        """Entries of `url` whose IDs were not seen on a previous poll, in feed order."""
+        seen = set(self.get(url).get("seen", []))
+        return [entry for entry in entries if entry_id(entry) not in seen]
+
+    def expect(self, url, entries, seen_key=None):
+        """
+        Records the new entries of the last response of `url` that callers still have to deliver, i.e. mark as
+        seen under `seen_key` (default `url`). Until they all are, polls of `url` are unconditional.
+        """
+        state = self._state.setdefault(url, {})
+        state["pending"] = [eid for eid in (entry_id(entry) for entry in entries) if eid]
+        if seen_key and seen_key != url:
+            state["seen_key"] = seen_key
+        self._dirty = True
+
+    def has_pending(self, url):
+        """Whether entries of the last response of `url` have not been delivered yet."""
+        state = self.get(url)
+        if not state.get("pending"):
+            return False
+        seen = set(self.get(state.get("seen_key", url)).get("seen", []))
+        return any(eid not in seen for eid in state["pending"])
+
+    def mark_seen(self, url, entries):
+        """Records entries as delivered downstream; also keeps the feed's head entry for 304 polls."""
+        entries = list(entries)
+        if not entries:
+            return
+        state = self._state.setdefault(url, {})
+        seen = state.get("seen", [])
+        known = set(seen)
+        failures = state.get("failures", {})
+        for entry in entries:
+            eid = entry_id(entry)
+            failures.pop(eid, None)
+            if eid and eid not in known:
+                seen.append(eid)
+                known.add(eid)
+        state["seen"] = seen[-MAX_SEEN_IDS:]
+        self.set_latest(url, entries[0])
+
+    def record_failure(self, url, entry):
+        """
+        Counts a failed delivery of an entry of `url`. The entry stays unseen, so the next poll offers it again,
+        until it has failed MAX_DELIVERY_ATTEMPTS times; then it is marked seen. Returns True in that case.
+        """
+        failures = self._state.setdefault(url, {}).setdefault("failures", {})
+        eid = entry_id(entry)
+        failures[eid] = failures.get(eid, 0) + 1
+        self._dirty = True
+        if failures[eid] < MAX_DELIVERY_ATTEMPTS:
+            return False
+        self.mark_seen(url, [entry])
+        return True
+
+    def set_latest(self, url, entry):
+        """Stores the feed's head entry so a later 304 poll can still report it."""
+        self._state.setdefault(url, {})["latest_entry"] = {
+            "title": entry.get("title", ""),
+            "url": entry.get("link", ""),
+            "summary": entry.get("summary", ""),
+            "published_date": entry.get("published", ""),
+        }
+        self._dirty = True
+
+    def latest_entry(self, url):
+        """Head entry recorded on the last successful poll, or None."""
+        return self.get(url).get("latest_entry")
+
+    def save(self):
+        """Atomically rewrites the state file if anything changed."""
+        if not self._dirty:
+            return
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".feed_state.", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def parse_feed_conditional(url, store, key=None):
+    """
+    Synchronous conditional poll of `url` via feedparser's built-in ETag/Last-Modified support.
+    Args:
+        key: State key (defaults to `url`).
+    Returns:
+        The parsed feed, or None when the server answered 304 Not Modified.
+    """
+    key = key or url
+    headers = store.conditional_headers(key)
+    feed = feedparser.parse(url, etag=headers.get("If-None-Match"), modified=headers.get("If-Modified-Since"))
+    if getattr(feed, "status", None) == 304:
+        logging.info(f"[Feed State] {url} not modified (304), skipping parse.")
+        return None
+    store.record_response(key, feed.get("etag"), feed.get("modified"))
+    return feed
@@ -0,0 +1,104 @@
+"""
+fetch_scheduler.py
+- Bounded, host-aware HTTP fetching for the async loaders.
+- A global in-flight cap plus per-host semaphores keep us from hammering the few hosts
+  (medium.com, arxiv.org, ...) that most of AI_SOURCES resolve to.
+- All requests share one tuned aiohttp connector (keep-alive, DNS cache, per-host limits)
+  and carry a per-request deadline, so a crawl takes a predictable amount of time.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import aiohttp
+
+# Defaults can be overridden per deployment through environment variables.
+FETCH_MAX_IN_FLIGHT = int(os.getenv("FETCH_MAX_IN_FLIGHT", "32"))
+FETCH_PER_HOST_LIMIT = int(os.getenv("FETCH_PER_HOST_LIMIT", "4"))
+FETCH_REQUEST_TIMEOUT = float(os.getenv("FETCH_REQUEST_TIMEOUT", "12"))
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "5"))
+FETCH_DNS_CACHE_TTL = int(os.getenv("FETCH_DNS_CACHE_TTL", "300"))
+FETCH_KEEPALIVE_TIMEOUT = float(os.getenv("FETCH_KEEPALIVE_TIMEOUT", "30"))
+FETCH_USER_AGENT = os.getenv("FETCH_USER_AGENT", "Mozilla/5.0 (compatible; BARTOZ-AI/1.0; +https://github.com/Chirag-S-Kotian/BARTOZ-AI)")
+
+FetchResult = namedtuple("FetchResult", ["url", "status", "text", "headers", "elapsed"])
+
+
+class FetchScheduler:
+    """
+    Schedules GET requests under a global in-flight cap and a per-host cap.
+    Create one per crawl and open a session with `scheduler.session()`.
+    """
+
+    def __init__(self, max_in_flight=FETCH_MAX_IN_FLIGHT, per_host_limit=FETCH_PER_HOST_LIMIT,
+                 request_timeout=FETCH_REQUEST_TIMEOUT, connect_timeout=FETCH_CONNECT_TIMEOUT):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.per_host_limit = max(1, int(per_host_limit))
+        self.request_timeout = float(request_timeout)
+        self.connect_timeout = float(connect_timeout)
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._hosts = {}
+        self.stats = {"requests": 0, "errors": 0, "timeouts": 0, "bytes": 0, "seconds": 0.0}
+
+    def _host_semaphore(self, url):
+        host = urlsplit(url).netloc.lower()
+        sem = self._hosts.get(host)
+        if sem is None:
+            sem = self._hosts[host] = asyncio.Semaphore(self.per_host_limit)
+        return sem
+
+    def make_connector(self):
+        """TCP connector shared by every request of the crawl."""
+        return aiohttp.TCPConnector(
+            limit=self.max_in_flight,
+            limit_per_host=self.per_host_limit,
+            ttl_dns_cache=FETCH_DNS_CACHE_TTL,
+            keepalive_timeout=FETCH_KEEPALIVE_TIMEOUT,
+        )
+
+    def session(self):
+        """Opens an aiohttp session wired to this scheduler's connector and timeouts."""
+        timeout = aiohttp.ClientTimeout(total=None, connect=self.connect_timeout, sock_read=self.request_timeout)
+        return aiohttp.ClientSession(connector=self.make_connector(), timeout=timeout,
+                                     headers={"User-Agent": FETCH_USER_AGENT})
+
+    async def fetch(self, session, url, timeout=None, headers=None, params=None):
+        """
+        GETs `url` once a host slot and a global slot are free.
+        The deadline (`timeout`, default `request_timeout`) covers the request itself, not the wait
+        for a slot. Raises asyncio.TimeoutError / aiohttp.ClientError like a plain session.get.
+        Returns:
+            FetchResult(url, status, text, headers, elapsed)
+        """
+        deadline = self.request_timeout if timeout is None else timeout
+        # Take the host slot first so a task queued behind a busy host never holds a global slot.
+        async with self._host_semaphore(url):
+            async with self._in_flight:
+                start = time.perf_counter()
+                self.stats["requests"] += 1
+                try:
+                    async with session.get(url, headers=headers, params=params, timeout=aiohttp.ClientTimeout(total=deadline)) as resp:
+                        text = await resp.text(errors="replace")
+                        result = FetchResult(url, resp.status, text, resp.headers, time.perf_counter() - start)
+                except asyncio.TimeoutError:
+                    self.stats["timeouts"] += 1
+                    raise
+                except Exception:
+                    self.stats["errors"] += 1
+                    raise
+                finally:
+                    self.stats["seconds"] += time.perf_counter() - start
+        self.stats["bytes"] += len(result.text)
+        return result
+
+    async def get_text(self, session, url, timeout=None, headers=None, params=None):
+        """Convenience wrapper returning only the response body."""
+        return (await self.fetch(session, url, timeout=timeout, headers=headers, params=params)).text
+
+    def log_stats(self, label="Fetch"):
+        s = self.stats
+        logging.info(f"[{label}] requests: {s['requests']} | timeouts: {s['timeouts']} | errors: {s['errors']} | "
+                     f"bytes: {s['bytes']} | hosts: {len(self._hosts)} | request-seconds: {s['seconds']:.1f}")
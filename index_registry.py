@@ -0,0 +1,303 @@
+"""
+index_registry.py
+- Persistent fingerprint registry for incremental FAISS indexing (faiss_index/registry.db).
+- Records a content hash per document and, per chunk, its content hash and the FAISS vector ID it maps to.
+- Re-ingesting the same documents then skips unchanged ones, embeds only new/changed chunks and deletes
+  the vectors of chunks that disappeared, so warm re-ingest cost is proportional to the change set.
+- Documents removed by the index lifecycle (lifecycle.py) are suppressed: forgotten, and skipped when a source
+  serves them again. Documents past their retention (metadata_index.expired) are skipped as well.
+- A document belongs to the source that indexed it first. When another source serves the same document (the
+  static arXiv API and the arXiv RSS feed list the same papers, under abs/ or pdf/ and versioned links), it is
+  skipped instead of re-embedded in that source's layout, so the two do not overwrite each other every build.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+from metadata_index import expired
+from near_duplicates import canonical_url
+
+REGISTRY_PATH = os.path.join("faiss_index", "registry.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_key TEXT PRIMARY KEY,
+    content_hash TEXT,
+    updated_at REAL NOT NULL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    vector_id TEXT PRIMARY KEY,
+    doc_key TEXT NOT NULL,
+    chunk_hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_doc ON chunks(doc_key);
+CREATE TABLE IF NOT EXISTS suppressed (
+    doc_key TEXT PRIMARY KEY,
+    reason TEXT NOT NULL,
+    suppressed_at REAL NOT NULL
+);
+"""
+
+# add: [(vector_id, chunk)] to embed and insert; delete: [vector_id] whose chunks no longer exist.
+ChangeSet = namedtuple("ChangeSet", ["doc_key", "doc_hash", "add", "delete", "kept", "source"])
+
+
+def _sha1(*parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _fingerprint(doc):
+    return _sha1(doc.page_content, json.dumps(doc.metadata, sort_keys=True, default=str))
+
+
+def _is_arxiv(url):
+    return "arxiv.org/" in url
+
+
+def document_key(doc):
+    """
+    Identity of a source document across runs: its URL (arXiv links folded into arxiv.org/abs/<id>, whatever
+    their form and version), else source + title.
+    """
+    url = doc.metadata.get("url")
+    if url and url != "N/A":
+        return canonical_url(url) if _is_arxiv(url) else url
+    return "title:" + _sha1(str(doc.metadata.get("source", "")), str(doc.metadata.get("title", "")))
+
+
+def document_hash(doc):
+    """Content + metadata fingerprint of a document (or chunk)."""
+    return _fingerprint(doc)
+
+
+def _source(doc):
+    return str(doc.metadata.get("source", ""))
+
+
+def vector_id(doc_key, chunk_hash):
+    return _sha1(doc_key, chunk_hash)
+
+
+class IndexRegistry:
+    """
+    SQLite registry of document/chunk fingerprints. Changes are recorded in an open transaction;
+    call commit() after the vectorstore has been saved, or rollback() if that failed.
+    """
+
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Upgrades registries written before document sources were kept and arXiv keys were folded."""
+        if "source" not in {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}:
+            self._conn.execute("ALTER TABLE documents ADD COLUMN source TEXT")
+        renames = [(key, canonical_url(key)) for (key,) in self._conn.execute(
+            "SELECT doc_key FROM documents WHERE doc_key LIKE '%arxiv.org/%'") if canonical_url(key) != key]
+        for old, new in renames:
+            # Versions of a paper merge into one document; clearing its hash makes the next ingest re-diff it
+            # chunk by chunk, which drops the chunks of the other versions.
+            self._conn.execute("UPDATE chunks SET doc_key = ? WHERE doc_key = ?", (new, old))
+            self._conn.execute("INSERT OR IGNORE INTO documents (doc_key, content_hash, updated_at) "
+                               "SELECT ?, NULL, updated_at FROM documents WHERE doc_key = ?", (new, old))
+            self._conn.execute("UPDATE documents SET content_hash = NULL WHERE doc_key = ?", (new,))
+            self._conn.execute("DELETE FROM documents WHERE doc_key = ?", (old,))
+        suppressed = self._conn.execute("SELECT doc_key FROM suppressed WHERE doc_key LIKE '%arxiv.org/%'").fetchall()
+        for (key,) in suppressed:
+            if canonical_url(key) != key:
+                self._conn.execute("UPDATE OR REPLACE suppressed SET doc_key = ? WHERE doc_key = ?",
+                                   (canonical_url(key), key))
+        if renames:
+            logging.info(f"[Index Registry] Folded {len(renames)} arXiv document keys.")
+        self._conn.commit()
+
+    def is_empty(self):
+        return self._conn.execute("SELECT 1 FROM chunks LIMIT 1").fetchone() is None
+
+    def doc_hash(self, doc_key):
+        row = self._conn.execute("SELECT content_hash FROM documents WHERE doc_key = ?", (doc_key,)).fetchone()
+        return row[0] if row else None
+
+    def is_unchanged(self, doc, key=None):
+        """
+        Cheap pre-split check: True when the document's fingerprint matches the registry, or when another source
+        holds the document (it keeps it; see the module docstring).
+        """
+        row = self._conn.execute("SELECT content_hash, source FROM documents WHERE doc_key = ?",
+                                 (key or document_key(doc),)).fetchone()
+        if row is None:
+            return False
+        content_hash, source = row
+        return content_hash == document_hash(doc) or source not in (None, _source(doc))
+
+    def plan(self, doc, chunks, key=None):
+        """Diffs the chunks of `doc` against what the registry holds for it (by chunk content hash)."""
+        key, doc_hash = key or document_key(doc), document_hash(doc)
+        old, delete = {}, []
+        for vid, chunk_hash in self._conn.execute("SELECT vector_id, chunk_hash FROM chunks WHERE doc_key = ?", (key,)):
+            # Equal chunks of merged document versions: keep one vector.
+            if chunk_hash in old:
+                delete.append(vid)
+            else:
+                old[chunk_hash] = vid
+        new = {}
+        for chunk in chunks:
+            new.setdefault(_fingerprint(chunk), chunk)
+        add = [(vector_id(key, chunk_hash), chunk) for chunk_hash, chunk in new.items() if chunk_hash not in old]
+        delete += [vid for chunk_hash, vid in old.items() if chunk_hash not in new]
+        kept = len(new) - len(add)
+        return ChangeSet(key, doc_hash, add, delete, kept, _source(doc))
+
+    def vector_ids(self, doc_key):
+        return [r[0] for r in self._conn.execute("SELECT vector_id FROM chunks WHERE doc_key = ?", (doc_key,))]
+
+    def forget(self, doc_key):
+        """Removes a document and its chunks from the registry (uncommitted); returns their vector IDs."""
+        vids = self.vector_ids(doc_key)
+        self._conn.execute("DELETE FROM chunks WHERE doc_key = ?", (doc_key,))
+        self._conn.execute("DELETE FROM documents WHERE doc_key = ?", (doc_key,))
+        return vids
+
+    def suppress(self, vector_ids, reason):
+        """
+        Forgets the documents the given vectors belong to and marks them suppressed (uncommitted).
+        Returns (suppressed doc keys, every vector ID of those documents).
+        """
+        vector_ids = list(vector_ids)
+        keys = set()
+        for start in range(0, len(vector_ids), 500):
+            batch = vector_ids[start:start + 500]
+            keys.update(r[0] for r in self._conn.execute(
+                f"SELECT DISTINCT doc_key FROM chunks WHERE vector_id IN ({','.join('?' * len(batch))})", batch))
+        vids = set(vector_ids)
+        for key in keys:
+            vids.update(self.forget(key))
+            self._conn.execute("INSERT OR REPLACE INTO suppressed (doc_key, reason, suppressed_at) VALUES (?, ?, ?)",
+                               (key, reason, time.time()))
+        return sorted(keys), sorted(vids)
+
+    def is_suppressed(self, doc_key):
+        return self._conn.execute("SELECT 1 FROM suppressed WHERE doc_key = ?", (doc_key,)).fetchone() is not None
+
+    def record(self, change):
+        """Applies a ChangeSet to the registry (uncommitted)."""
+        if change.delete:
+            self._conn.executemany("DELETE FROM chunks WHERE vector_id = ?", [(vid,) for vid in change.delete])
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chunks (vector_id, doc_key, chunk_hash) VALUES (?, ?, ?)",
+            [(vid, change.doc_key, _fingerprint(chunk)) for vid, chunk in change.add])
+        self._conn.execute("INSERT OR REPLACE INTO documents (doc_key, content_hash, updated_at, source) "
+                           "VALUES (?, ?, ?, ?)", (change.doc_key, change.doc_hash, time.time(), change.source))
+
+    def adopt(self, vectorstore):
+        """
+        Registers the chunks of an index built before the registry existed, keyed by their metadata,
+        and returns the vector IDs of exact duplicates (same document, same chunk) to delete.
+        Documents are left without a hash so their next ingest re-diffs them chunk by chunk.
+        """
+        duplicates = []
+        seen = set()
+        for vid, chunk in vectorstore.docstore._dict.items():
+            key, chunk_hash = document_key(chunk), _fingerprint(chunk)
+            if (key, chunk_hash) in seen:
+                duplicates.append(vid)
+                continue
+            seen.add((key, chunk_hash))
+            self._conn.execute("INSERT OR REPLACE INTO chunks (vector_id, doc_key, chunk_hash) VALUES (?, ?, ?)",
+                               (vid, key, chunk_hash))
+            self._conn.execute("INSERT OR IGNORE INTO documents (doc_key, content_hash, updated_at) VALUES (?, NULL, ?)",
+                               (key, time.time()))
+        logging.info(f"[Index Registry] Adopted {len(seen)} existing chunks; {len(duplicates)} duplicate vectors to drop.")
+        return duplicates
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def sync_documents(vectorstore, docs, splitter, embeddings, registry, near_dups=None, embed_with=None):
+    """
+    Brings `vectorstore` in line with `docs`: unchanged documents are skipped without splitting,
+    changed ones are re-split and only their new chunks embedded, and vectors of vanished chunks deleted.
+    With a NearDuplicateIndex, mirrors of another document are skipped before splitting (and their old
+    vectors deleted). Suppressed and expired documents are skipped. Creates the vectorstore when it is None.
+    The caller saves it and then commits the registry (and near_dups). New chunks are embedded with
+    `embed_with` (e.g. the multi-process bulk embedder) when given, else with `embeddings`, which a newly
+    created store keeps.
+    Returns:
+        (vectorstore, stats) where stats counts docs skipped/mirrored/changed/dropped and chunks
+        added/deleted/kept.
+    """
+    from langchain_community.vectorstores import FAISS
+    stats = {"docs_unchanged": 0, "docs_mirrored": 0, "docs_changed": 0, "docs_dropped": 0, "chunks_added": 0, "chunks_deleted": 0, "chunks_kept": 0}
+    deletes = []
+    if vectorstore is not None and registry.is_empty() and vectorstore.index.ntotal:
+        deletes.extend(registry.adopt(vectorstore))
+    add_ids, add_chunks = [], []
+    planned = set()
+    occurrences = {}
+    for doc in docs:
+        # Documents without a URL can share source + title (e.g. company profiles); number repeats in input order.
+        key = document_key(doc)
+        occurrences[key] = occurrences.get(key, 0) + 1
+        if occurrences[key] > 1:
+            key = f"{key}#{occurrences[key]}"
+        if registry.is_suppressed(key) or expired(doc.metadata):
+            stats["docs_dropped"] += 1
+            continue
+        if near_dups is not None and near_dups.match(doc, key) is not None:
+            stats["docs_mirrored"] += 1
+            continue
+        if registry.is_unchanged(doc, key):
+            stats["docs_unchanged"] += 1
+            continue
+        change = registry.plan(doc, splitter.split_documents([doc]), key)
+        registry.record(change)
+        stats["docs_changed"] += 1
+        stats["chunks_kept"] += change.kept
+        deletes.extend(change.delete)
+        for vid, chunk in change.add:
+            if vid not in planned:
+                planned.add(vid)
+                add_ids.append(vid)
+                add_chunks.append(chunk)
+    if near_dups is not None:
+        deletes.extend(near_dups.retired_vector_ids(registry))
+    if vectorstore is not None:
+        present = set(vectorstore.index_to_docstore_id.values())
+        # Vectors left over from a run whose registry update was never committed are replaced.
+        deletes.extend(vid for vid in add_ids if vid in present)
+        deletes = sorted({vid for vid in deletes if vid in present})
+        if deletes:
+            vectorstore.delete(deletes)
+    stats["chunks_deleted"] = len(deletes)
+    stats["chunks_added"] = len(add_ids)
+    if add_chunks:
+        texts = [chunk.page_content for chunk in add_chunks]
+        vectors = (embed_with or embeddings).embed_documents(texts)
+        metadatas = [chunk.metadata for chunk in add_chunks]
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadatas=metadatas, ids=add_ids)
+        else:
+            vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=add_ids)
+    if near_dups is not None and vectorstore is not None:
+        stats["chunks_annotated"] = near_dups.apply(vectorstore, registry)
+    logging.info(f"[Index Registry] {stats}")
+    return vectorstore, stats
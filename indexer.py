@@ -0,0 +1,371 @@
+"""
+indexer.py
+- Builds and updates the FAISS index. This is the only place that fetches sources, splits, embeds and writes
+  faiss_index/; each build publishes a new snapshot (snapshots.py) and the API process (main.py) hot-swaps to it.
+- Usage:
+    python -m indexer build-index [--async-docs N] [--no-async] [--index-path faiss_index]
+                                  [--arxiv-max N] [--pubmed-max N] [--full] [--workers N]
+                                  [--index-type auto|flat|hnsw|ivf|ivfpq] [--nprobe N] [--ef-search N]
+                                  [--memory-budget-mb MB]
+    python -m indexer index-report [--index-path faiss_index] [--k 10] [--queries 200]
+    python -m indexer snapshots [--index-path faiss_index] [--gc]
+    python -m indexer compact [--index-path faiss_index] [--force] [--index-type ...] [--memory-budget-mb MB]
+    python -m indexer delete [--url URL ...] [--source NAME ...] [--published-before DATE] [--dry-run] [--compact]
+    python -m indexer expire [--dry-run] [--compact]
+  --full discards the existing index and rebuilds it; --workers N embeds new chunks in N processes.
+  --index-type picks the search index built from the flat index (faiss_index_types.py); index-report prints
+  recall@k and latency of each type against exact search.
+  Incremental builds append delta segments (segments.py); compact folds them into the base when the
+  compaction policy says so (or with --force), which also applies a changed --index-type.
+  delete / expire remove content by URL, source or date, or by retention (lifecycle.py).
+  scheduler.py runs build-index, expire and compact on its schedule.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from cache_loader import load_cached_documents
+from data_loader import fetch_static_sources_async
+from index_registry import IndexRegistry, sync_documents
+from lifecycle import delete_documents, expire_documents
+from near_duplicates import NearDuplicateIndex, canonical_url
+from embedding_service import get_embedding_service
+from faiss_index_types import (FAISS_MEMORY_BUDGET_MB, INDEX_TYPES, recall_report, record_requested, search_settings,
+                               write_search_index)
+from rag_pipeline import FAISS_INDEX_PATH
+from segments import DeltaWriter, compact, load_store, segment_dirs, segment_stats
+from snapshots import SnapshotManager
+
+# Resources pulled from AI_SOURCES per build (the old startup-ingest default).
+DEFAULT_ASYNC_DOCS = 1200
+# Papers per build from the arXiv / PubMed APIs (both page through large result sets).
+DEFAULT_ARXIV_MAX = int(os.getenv("INDEX_ARXIV_MAX", "10"))
+DEFAULT_PUBMED_MAX = int(os.getenv("INDEX_PUBMED_MAX", "10"))
+
+
+def collect_documents(arxiv_max=DEFAULT_ARXIV_MAX, pubmed_max=DEFAULT_PUBMED_MAX):
+    """
+    Loads cached articles and fetches the static sources (arXiv, PubMed, SSRN, AI companies).
+    Returns:
+        (all_docs, deduped_docs): every Document built, and the same deduplicated by URL.
+    """
+    all_docs = []
+    # --- Load cached documents ---
+    cached_docs = load_cached_documents()
+    logging.info(f"Loaded {len(cached_docs)} cached documents from cache directory.")
+    all_docs.extend(cached_docs)
+
+    # --- Fetch new data from sources ---
+    logging.info("Fetching data from sources...")
+    sources = asyncio.run(fetch_static_sources_async(arxiv_max=arxiv_max, pubmed_max=pubmed_max))
+    logging.info("Data fetching complete.")
+
+    logging.info("Creating Langchain Documents from fetched sources...")
+    for source_name, papers in sources.items():
+        for paper in papers:
+            # Ensure paper has 'title', 'summary', and ideally 'published_date', 'url' keys
+            title = paper.get('title', 'No Title')
+            summary = paper.get('summary', 'No Summary')
+            published_date = paper.get('published_date')
+            url = paper.get('url')
+
+            if source_name == 'ai_companies':
+                # For companies, include all enriched fields and lists
+                fields = [
+                    f"Name: {paper.get('name', '')}",
+                    f"Category: {paper.get('category', '')}",
+                    f"Description: {paper.get('description', '')}",
+                    f"Founded: {paper.get('founded', '')}",
+                    f"Founders: {', '.join(paper.get('founders', []))}",
+                    f"Headquarters: {paper.get('headquarters', '')}",
+                    f"CEO: {paper.get('ceo', '')}",
+                    f"Valuation: {paper.get('valuation', '')}",
+                    f"Funding: {paper.get('funding', '')}",
+                    f"Twitter: {paper.get('twitter', '')}",
+                    f"Website: {paper.get('website', '')}",
+                    f"Active Years: {paper.get('active_years', '')}",
+                    f"Top AI Agent in Years: {', '.join(str(y) for y in paper.get('top_in_year', []))}",
+                    f"Latest Blog: {paper.get('latest_blog', {}).get('title', '')} ({paper.get('latest_blog', {}).get('url', '')})",
+                ]
+                # Add products
+                products = paper.get('products', [])
+                if products:
+                    fields.append(f"Products: {', '.join(products)}")
+                # Add notable projects
+                notable_projects = paper.get('notable_projects', [])
+                if notable_projects:
+                    fields.append(f"Notable Projects: {', '.join(notable_projects)}")
+                # Add resources (news, research, etc.)
+                resources = paper.get('resources', [])[:200]
+                if resources:
+                    fields.append("Resources:")
+                    for res in resources:
+                        res_title = res.get('title', '')
+                        res_url = res.get('url', '')
+                        res_summary = res.get('summary', '') if 'summary' in res else ''
+                        # Add a detailed, dedicated Document for each resource
+                        resource_content = f"Resource Title: {res_title}\nResource URL: {res_url}\nParent: {paper.get('name', '')}\nCategory: {paper.get('category', '')}"
+                        if res_summary:
+                            resource_content += f"\nSummary: {res_summary}"
+                        resource_metadata = {
+                            "source": source_name,
+                            "title": res_title,
+                            "url": res_url,
+                            "parent": paper.get('name', ''),
+                            "company": paper.get('name', ''),
+                            "category": paper.get('category', '')
+                        }
+                        all_docs.append(Document(page_content=resource_content, metadata=resource_metadata))
+                        # Also include in the parent chunk
+                        if res_summary:
+                            fields.append(f"- {res_title} ({res_url})\n  Summary: {res_summary}")
+                        else:
+                            fields.append(f"- {res_title} ({res_url})")
+                content = "\n".join([f for f in fields if f and f != '()'])
+            else:
+                content = f"Title: {title}\n\nSummary: {summary}"
+
+            metadata = {"source": source_name, "title": title}
+            if source_name == 'ai_companies':
+                metadata['company'] = paper.get('name', '')
+            if published_date:
+                metadata['published_date'] = published_date
+            if url:
+                metadata['url'] = url
+
+            doc = Document(page_content=content, metadata=metadata)
+            all_docs.append(doc)
+
+    # Deduplicate all_docs by URL (prefer most recent); near-duplicates are collapsed later, at sync time
+    seen_urls = set()
+    deduped_docs = []
+    for doc in all_docs:
+        url = canonical_url(doc.metadata.get("url", ""))
+        if url and url not in seen_urls:
+            deduped_docs.append(doc)
+            seen_urls.add(url)
+        elif not url:
+            deduped_docs.append(doc)  # Always include docs with no URL (e.g., static or malformed)
+    logging.info(f"Deduplicated to {len(deduped_docs)} unique documents (by URL).")
+    return all_docs, deduped_docs
+
+
+def build_index(faiss_index_path=FAISS_INDEX_PATH, async_docs=DEFAULT_ASYNC_DOCS, include_async=True,
+                arxiv_max=DEFAULT_ARXIV_MAX, pubmed_max=DEFAULT_PUBMED_MAX, full=False, workers=1,
+                index_type=None, memory_budget_mb=None, nprobe=None, ef_search=None):
+    """
+    Syncs the static sources into the index, then streams the async sources (AI_SOURCES) into it.
+    Both steps go through the index registry, so only new or changed content is embedded.
+    The index is written to a staging snapshot; after each step the changes are appended to it as a delta
+    segment (segments.py) and the snapshot is published (snapshots.py) before the registry commits, so the
+    registry never gets ahead of what the API serves. The search index of `index_type` ("auto" picks by size and
+    memory budget) is brought up to date whenever the base is written (first and full builds, compaction).
+    Settings left as None keep those the live index was last built with (faiss_index_types.search_settings).
+    With `full`, the index, registry and near-duplicate index are rebuilt from scratch: the fresh registry and
+    near-duplicate index are filled beside the staging snapshot and replace the live ones only once the rebuilt
+    index is published, so a failed rebuild leaves the live index and its state as they were.
+    With `workers` > 1, the static sync embeds its chunks on a pool of that many processes (bulk_embed.py).
+    Returns:
+        The updated FAISS vectorstore (None if there was nothing to index).
+    """
+    os.makedirs(faiss_index_path, exist_ok=True)
+    _, deduped_docs = collect_documents(arxiv_max, pubmed_max)
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=2500, chunk_overlap=300)
+    embeddings = get_embedding_service()
+    vectorstore = None
+    snapshots = SnapshotManager(faiss_index_path)
+    with snapshots.build_lock(blocking=True):
+        settings = search_settings(snapshots.current()[1], index_type, memory_budget_mb, nprobe, ef_search)
+        build = snapshots.begin(empty=full)
+        state_dir = faiss_index_path
+        if full:
+            logging.info("Full rebuild: starting from an empty snapshot, registry and near-duplicate index.")
+            # Left-over .staging-* directories of crashed builds are collected with the snapshots.
+            state_dir = tempfile.mkdtemp(prefix=".staging-state-", dir=snapshots.snapshots_dir)
+        if os.path.exists(os.path.join(build.path, "index.faiss")):
+            logging.info("Loading existing FAISS index...")
+            vectorstore = load_store(build.path, embeddings)
+            logging.info(f"FAISS index loaded ({len(segment_dirs(build.path))} delta segments).")
+        writer = DeltaWriter(vectorstore)
+
+        def checkpoint(store, dirty=True):
+            """Saves the changes to `store` (if `dirty`) into the staging snapshot, and publishes it."""
+            if dirty:
+                writer.save(store, build.path)
+            segments = len(segment_dirs(build.path))
+            if not segments:
+                # The base holds every vector: keep its search index in step (and its type / parameters).
+                write_search_index(build.path, store, **settings)
+            else:
+                # Applied when compaction next rebuilds the base.
+                record_requested(build.path, **settings)
+            return build.publish({"vectors": store.index.ntotal, "segments": segments})
+
+        registry = IndexRegistry(os.path.join(state_dir, "registry.db"))
+        near_dups = NearDuplicateIndex(os.path.join(state_dir, "near_dup.db"))
+        bulk, pool = None, None
+        if workers > 1:
+            from bulk_embed import bulk_embeddings
+            bulk, pool = bulk_embeddings(embeddings, workers)
+        logging.info("Syncing documents into the FAISS index...")
+        try:
+            vectorstore, sync_stats = sync_documents(vectorstore, deduped_docs, splitter, embeddings, registry,
+                                                     near_dups, embed_with=bulk)
+            near_dups.log_stats()
+            if vectorstore is not None:
+                # Also publishes when only the search index type or parameters changed.
+                checkpoint(vectorstore, dirty=bool(sync_stats["chunks_added"] or sync_stats["chunks_deleted"]
+                                                   or sync_stats.get("chunks_annotated")))
+            registry.commit()
+            near_dups.commit()
+        except Exception:
+            registry.rollback()
+            near_dups.rollback()
+            build.close()
+            if full:
+                registry.close()
+                near_dups.close()
+                shutil.rmtree(state_dir, ignore_errors=True)
+            raise
+        finally:
+            if pool is not None:
+                logging.info(f"[Bulk Embed] {pool.stats['chunks']} chunks at {pool.chunks_per_second():.1f} chunks/s "
+                             f"with {pool.workers} workers.")
+                pool.close()
+        if full:
+            # The rebuilt index is live (or nothing was published): swap in its registry and near-duplicate index.
+            registry.close()
+            near_dups.close()
+            if build.published:
+                for name in ("registry.db", "near_dup.db"):
+                    os.replace(os.path.join(state_dir, name), os.path.join(faiss_index_path, name))
+            shutil.rmtree(state_dir, ignore_errors=True)
+            registry = IndexRegistry(os.path.join(faiss_index_path, "registry.db"))
+            near_dups = NearDuplicateIndex(os.path.join(faiss_index_path, "near_dup.db"))
+        # Per-chunk metadata lives in each snapshot's metadata table (metadata_index.py); drop the old dump.
+        legacy_metadata = os.path.join(faiss_index_path, "metadata.json")
+        if os.path.exists(legacy_metadata):
+            os.remove(legacy_metadata)
+
+        if include_async and vectorstore is not None:
+            from async_ingest import fetch_and_ingest_async_resources
+            asyncio.run(fetch_and_ingest_async_resources(vectorstore, max_docs=async_docs,
+                                                         faiss_index_path=build.path, registry=registry,
+                                                         near_dups=near_dups, checkpoint=checkpoint))
+        build.close()
+        logging.info(f"[Snapshots] Published {build.published or 'nothing'}; live version {snapshots.current_version()}.")
+    registry.close()
+    near_dups.close()
+    embeddings.log_stats()
+    return vectorstore
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m indexer", description="BARTOZ-AI index maintenance.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build-index", help="Fetch sources and update the FAISS index.")
+    build.add_argument("--index-path", default=FAISS_INDEX_PATH)
+    build.add_argument("--async-docs", type=int, default=DEFAULT_ASYNC_DOCS,
+                       help="Max resources to pull from the async news/blog/research sources.")
+    build.add_argument("--no-async", action="store_true", help="Only index the static sources.")
+    build.add_argument("--arxiv-max", type=int, default=DEFAULT_ARXIV_MAX, help="Papers to page in from arXiv.")
+    build.add_argument("--pubmed-max", type=int, default=DEFAULT_PUBMED_MAX, help="Papers to page in from PubMed.")
+    build.add_argument("--full", action="store_true", help="Discard the existing index and rebuild it from scratch.")
+    build.add_argument("--workers", type=int, default=1,
+                       help="Embedding worker processes for the static sync (use with --full on many-core boxes).")
+    report = commands.add_parser("index-report", help="Recall@k and latency of each index type vs flat search.")
+    report.add_argument("--index-path", default=FAISS_INDEX_PATH)
+    report.add_argument("--k", type=int, default=10)
+    report.add_argument("--queries", type=int, default=200)
+    report.add_argument("--memory-budget-mb", type=float, default=FAISS_MEMORY_BUDGET_MB)
+    snapshot_cmd = commands.add_parser("snapshots", help="List index snapshots; --gc removes superseded ones.")
+    snapshot_cmd.add_argument("--index-path", default=FAISS_INDEX_PATH)
+    snapshot_cmd.add_argument("--gc", action="store_true")
+    compact_cmd = commands.add_parser("compact", help="Fold delta segments into the base index when due.")
+    compact_cmd.add_argument("--index-path", default=FAISS_INDEX_PATH)
+    compact_cmd.add_argument("--force", action="store_true", help="Compact even if the policy does not call for it.")
+    compact_cmd.add_argument("--wait", action="store_true", help="Wait for a running build instead of skipping.")
+    # Search index settings: unset ones keep what the index was last built with (then auto / the defaults).
+    for cmd in (build, compact_cmd):
+        cmd.add_argument("--index-type", choices=INDEX_TYPES, default=os.getenv("FAISS_INDEX_TYPE"),
+                         help="Search index type; auto picks by vector count and memory budget.")
+        cmd.add_argument("--memory-budget-mb", type=float, default=None,
+                         help="Memory the search index may use (auto selection).")
+        cmd.add_argument("--nprobe", type=int, default=None, help="IVF lists probed per query.")
+        cmd.add_argument("--ef-search", type=int, default=None, help="HNSW candidate list size per query.")
+    delete_cmd = commands.add_parser("delete", help="Remove documents by URL, source or publication date.")
+    delete_cmd.add_argument("--index-path", default=FAISS_INDEX_PATH)
+    delete_cmd.add_argument("--url", action="append", default=[], help="Document URL (repeatable).")
+    delete_cmd.add_argument("--source", action="append", default=[], help="Source name (repeatable).")
+    delete_cmd.add_argument("--published-before", default=None, help="Delete documents published before this date.")
+    expire_cmd = commands.add_parser("expire", help="Remove documents past their source's retention.")
+    expire_cmd.add_argument("--index-path", default=FAISS_INDEX_PATH)
+    for lifecycle_cmd in (delete_cmd, expire_cmd):
+        lifecycle_cmd.add_argument("--dry-run", action="store_true", help="Only count the matching chunks.")
+        lifecycle_cmd.add_argument("--compact", action="store_true", help="Compact the index right after.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "build-index":
+        try:
+            build_index(args.index_path, async_docs=args.async_docs, include_async=not args.no_async,
+                        arxiv_max=args.arxiv_max, pubmed_max=args.pubmed_max, full=args.full, workers=args.workers,
+                        index_type=args.index_type, memory_budget_mb=args.memory_budget_mb, nprobe=args.nprobe,
+                        ef_search=args.ef_search)
+        except Exception as e:
+            logging.error(f"Error during indexing process: {e}", exc_info=True)
+            print("Indexing failed!")
+            return 1
+        print("Indexing complete!")
+    elif args.command == "index-report":
+        import faiss
+        _, live_path = SnapshotManager(args.index_path).current()
+        if live_path is None:
+            print("No index has been built yet.")
+            return 1
+        flat = faiss.read_index(os.path.join(live_path, "index.faiss"))
+        print(f"{flat.ntotal} vectors, dim {flat.d}, recall@{args.k} over {args.queries} queries vs flat search")
+        print(f"{'type':<7} {'setting':<14} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8}")
+        for row in recall_report(flat, args.k, args.queries, args.memory_budget_mb):
+            print(f"{row['type']:<7} {row['setting']:<14} {row['recall']:>7.4f} {row['p50_ms']:>8.3f} "
+                  f"{row['p95_ms']:>8.3f} {row['build_s']:>8.2f}")
+    elif args.command == "snapshots":
+        snapshots = SnapshotManager(args.index_path)
+        if args.gc:
+            snapshots.collect_garbage()
+        summary = snapshots.summary()
+        _, live_path = snapshots.current()
+        if live_path is not None:
+            summary["segments"] = segment_stats(live_path)
+        print(json.dumps(summary, indent=2))
+    elif args.command == "compact":
+        version = compact(args.index_path, force=args.force, index_type=args.index_type,
+                          memory_budget_mb=args.memory_budget_mb, nprobe=args.nprobe, ef_search=args.ef_search,
+                          wait=args.wait)
+        print(f"Compacted into {version}." if version else "Nothing compacted.")
+    elif args.command in ("delete", "expire"):
+        try:
+            if args.command == "delete":
+                result = delete_documents(args.index_path, urls=args.url, sources=args.source,
+                                          published_before=args.published_before, dry_run=args.dry_run,
+                                          compact_after=args.compact)
+            else:
+                result = expire_documents(args.index_path, dry_run=args.dry_run, compact_after=args.compact)
+        except ValueError as e:
+            print(e)
+            return 1
+        print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+lexical_index.py
+- Persistent BM25 index of every chunk in the FAISS index: an SQLite FTS5 table (porter-stemmed unicode61
+  tokens, postings and BM25 statistics maintained by SQLite) in lexical.db of the base and of each delta segment.
+- Kept in step with the vector index incrementally: save_vectorstore() calls write_lexical_index(), which copies
+  the previous lexical.db and sync()s the copy, so only chunks that were added (or retitled) are tokenized and
+  the file the API has open is never modified.
+- search() ranks chunk ids by BM25 (title weighted over body); rag_pipeline fuses them with the vector hits by
+  reciprocal rank fusion, so exact terms (model names, paper IDs) are found without a bigger k.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+LEXICAL_INDEX_FILE = "lexical.db"
+# Reciprocal rank fusion constant: score = sum(1 / (RRF_K + rank)) over the fused rankings.
+RRF_K = 60
+# BM25 column weights for (title, body).
+_TITLE_WEIGHT = 2.0
+_BODY_WEIGHT = 1.0
+# Query words dropped before matching; BM25 would weight them near zero anyway.
+_STOPWORDS = {"a", "an", "and", "are", "about", "by", "did", "do", "does", "for", "from", "how", "in", "is", "it",
+              "latest", "me", "new", "of", "on", "or", "tell", "the", "to", "was", "what", "when", "which", "who",
+              "why", "with"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    rowid INTEGER PRIMARY KEY,
+    doc_id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    title, body, tokenize='porter unicode61 remove_diacritics 2'
+);
+"""
+
+
+def match_expression(query):
+    """
+    FTS5 MATCH expression for a free-text query: each remaining word as a quoted phrase, OR-ed, so
+    "GPT-4o" or "2401.12345" must appear as consecutive tokens while BM25 ranks documents matching more words.
+    """
+    words = [w.strip(".,;:!?()[]{}'\"") for w in query.split()]
+    words = [w for w in words if w and w.lower() not in _STOPWORDS and re.search(r"\w", w)]
+    return " OR ".join('"{}"'.format(w.replace('"', '""')) for w in words)
+
+
+def reciprocal_rank_fusion(rankings, key, limit=None):
+    """
+    Merges ranked lists of items into one, scoring each item sum(1 / (RRF_K + rank)) over the lists it is in.
+    `key` maps an item to its identity across lists; the first occurrence of an item is kept.
+    """
+    scores, items = {}, {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            item_key = key(item)
+            scores[item_key] = scores.get(item_key, 0.0) + 1.0 / (RRF_K + rank)
+            items.setdefault(item_key, item)
+    fused = sorted(scores, key=scores.get, reverse=True)
+    return [items[k] for k in fused[:limit]]
+
+
+class LexicalIndex:
+    """SQLite FTS5 BM25 index keyed by docstore id; writable for the builder, read-only for the API."""
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        if read_only:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def sync(self, vectorstore):
+        """
+        Brings the index in line with `vectorstore` (LangChain FAISS with an in-memory docstore): adds chunks
+        that are new or retitled, removes chunks that are gone. Returns {'added': n, 'removed': n}.
+        """
+        docs = vectorstore.docstore._dict
+        current = {vid: str(doc.metadata.get("title", "")) for vid, doc in docs.items()}
+        with self._lock:
+            indexed = dict(self._conn.execute("SELECT doc_id, title FROM chunks"))
+            stale = [vid for vid, title in indexed.items() if current.get(vid) != title]
+            fresh = [vid for vid, title in current.items() if indexed.get(vid) != title]
+            with self._conn:
+                for start in range(0, len(stale), 500):
+                    batch = stale[start:start + 500]
+                    marks = ",".join("?" * len(batch))
+                    self._conn.execute(f"DELETE FROM chunks_fts WHERE rowid IN (SELECT rowid FROM chunks "
+                                       f"WHERE doc_id IN ({marks}))", batch)
+                    self._conn.execute(f"DELETE FROM chunks WHERE doc_id IN ({marks})", batch)
+                for vid in fresh:
+                    rowid = self._conn.execute("INSERT INTO chunks (doc_id, title) VALUES (?, ?)",
+                                               (vid, current[vid])).lastrowid
+                    self._conn.execute("INSERT INTO chunks_fts (rowid, title, body) VALUES (?, ?, ?)",
+                                       (rowid, current[vid], docs[vid].page_content))
+        stats = {"added": len(fresh), "removed": len(stale)}
+        logging.info(f"[Lexical Index] {stats}")
+        return stats
+
+    def search(self, query, limit=20, with_scores=False):
+        """
+        Docstore ids of the best BM25 matches for `query`, best first; with `with_scores`, (id, bm25) pairs
+        (SQLite's bm25(): lower is better) for merging the hits of several indexes.
+        """
+        expression = match_expression(query)
+        if not expression:
+            return []
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT chunks.doc_id, bm25(chunks_fts, ?, ?) AS score FROM chunks_fts "
+                    "JOIN chunks ON chunks.rowid = chunks_fts.rowid WHERE chunks_fts MATCH ? ORDER BY score LIMIT ?",
+                    (_TITLE_WEIGHT, _BODY_WEIGHT, expression, int(limit))).fetchall()
+        except sqlite3.OperationalError as e:
+            logging.warning(f"[Lexical Index] Query {expression!r} failed: {e}")
+            return []
+        return [tuple(row) for row in rows] if with_scores else [row[0] for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def write_lexical_index(vectorstore, faiss_index_path):
+    """
+    Brings lexical.db in `faiss_index_path` in line with `vectorstore` (called from save_vectorstore): the current
+    file is copied, the copy synced and renamed over it, so a snapshot sharing the old file is left untouched.
+    """
+    path = os.path.join(faiss_index_path, LEXICAL_INDEX_FILE)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    if os.path.exists(path):
+        _copy_database(path, tmp_path)
+    index = LexicalIndex(tmp_path)
+    try:
+        stats = index.sync(vectorstore)
+    finally:
+        index.close()
+    os.replace(tmp_path, path)
+    return stats
+
+
+def _copy_database(src, dst):
+    """Consistent copy of an SQLite database (backup API), safe while another process reads it."""
+    source = sqlite3.connect(f"file:{src}?mode=ro", uri=True)
+    target = sqlite3.connect(dst)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
@@ -0,0 +1,106 @@
+"""
+lifecycle.py
+- Removes content from the index: by URL, source or published-before date (delete_documents), and by retention
+  (expire_documents: chunks past the RETENTION_DAYS of their source or type, see metadata_index.expired).
+- Deletions never rewrite the index: the matching chunks are tombstoned in a new delta segment (segments.py),
+  published as a snapshot like any build, so queries stop returning them at once; compaction (segments.compact,
+  run by scheduler.py or with --compact) later rebuilds the vectors without them.
+- The documents they belong to are suppressed in the index registry, so later builds do not ingest them again,
+  and dropped from the near-duplicate index; copies of them held back as mirrors are admitted on their own again.
+- Usage:
+    python -m indexer delete [--url URL ...] [--source NAME ...] [--published-before DATE] [--dry-run] [--compact]
+    python -m indexer expire [--dry-run] [--compact]
+"""
+import logging
+import math
+import os
+
+from index_registry import IndexRegistry
+from metadata_index import expired, parse_timestamp
+from near_duplicates import NearDuplicateIndex, canonical_url
+from segments import compact, iter_live_chunks, write_segment
+from snapshots import SnapshotManager
+
+
+def deletion_filter(urls=None, sources=None, published_before=None):
+    """
+    Predicate over chunk metadata matching any of the criteria: the URL (compared canonically), the source
+    (case-insensitive), or a publication date before `published_before` (undated chunks never match).
+    """
+    urls = {canonical_url(url) for url in urls or ()}
+    sources = {source.strip().lower() for source in sources or ()}
+    cutoff = parse_timestamp(published_before) if published_before else None
+    if published_before and math.isnan(cutoff):
+        raise ValueError(f"Unrecognized date: {published_before!r}")
+
+    def match(metadata):
+        if urls and canonical_url(metadata.get("url")) in urls:
+            return True
+        if sources and str(metadata.get("source", "")).lower() in sources:
+            return True
+        return cutoff is not None and parse_timestamp(metadata.get("published_date")) < cutoff
+    return match
+
+
+def remove_matching(faiss_index_path, match, reason, dry_run=False, compact_after=False):
+    """
+    Tombstones every live chunk of the index whose metadata satisfies `match`, suppresses their documents in the
+    registry, drops them (and releases their mirrors) in the near-duplicate index and publishes the result.
+    Holds the build lock (waits for a running build).
+    Returns:
+        dict with the matched 'chunks', suppressed 'documents', released 'mirrors' and the published 'version'
+        (None on a dry run or when nothing matched).
+    """
+    snapshots = SnapshotManager(faiss_index_path)
+    result = {"reason": reason, "chunks": 0, "documents": 0, "mirrors": 0, "version": None}
+    with snapshots.build_lock(blocking=True):
+        build = snapshots.begin()
+        try:
+            live, ids = set(), []
+            for vid, metadata in iter_live_chunks(build.path):
+                live.add(vid)
+                if match(metadata):
+                    ids.append(vid)
+            result["chunks"] = len(ids)
+            if ids and not dry_run:
+                registry = IndexRegistry(os.path.join(faiss_index_path, "registry.db"))
+                near_dups = NearDuplicateIndex(os.path.join(faiss_index_path, "near_dup.db"))
+                try:
+                    keys, vids = registry.suppress(ids, reason)
+                    result["documents"] = len(keys)
+                    result["mirrors"] = near_dups.remove(keys)
+                    # Every chunk of a suppressed document goes, also those the criteria did not match.
+                    write_segment(None, build.path, [], sorted({vid for vid in vids if vid in live} | set(ids)))
+                    result["version"] = build.publish({"deleted": len(ids), "reason": reason})
+                    registry.commit()
+                    near_dups.commit()
+                except Exception:
+                    registry.rollback()
+                    near_dups.rollback()
+                    raise
+                finally:
+                    registry.close()
+                    near_dups.close()
+        finally:
+            build.close()
+    logging.info(f"[Lifecycle] {result}")
+    if compact_after and result["version"]:
+        compact(faiss_index_path, force=True, wait=True)
+    return result
+
+
+def delete_documents(faiss_index_path, urls=None, sources=None, published_before=None, dry_run=False,
+                     compact_after=False):
+    """Deletes the chunks matching any of the given URLs, sources or published-before date (see remove_matching)."""
+    if not (urls or sources or published_before):
+        raise ValueError("Give at least one URL, source or published-before date.")
+    criteria = ([f"url={url}" for url in urls or ()] + [f"source={source}" for source in sources or ()]
+                + ([f"published_before={published_before}"] if published_before else []))
+    reason = "deleted " + " ".join(criteria)
+    return remove_matching(faiss_index_path, deletion_filter(urls, sources, published_before), reason, dry_run,
+                           compact_after)
+
+
+def expire_documents(faiss_index_path, dry_run=False, compact_after=False):
+    """Deletes the chunks past their source's retention (see remove_matching)."""
+    return remove_matching(faiss_index_path, expired, "expired", dry_run, compact_after)
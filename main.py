@@ -1,30 +1,37 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from rag_pipeline import get_research_answer, vectorstore
+from typing import List, Optional
+from rag_pipeline import get_research_answer, get_vectorstore, live_index
+from embedding_service import get_embedding_service
+from query_cache import get_query_cache
+from reranker import get_reranker
+from segments import parse_cursor
 from data_sources_config import AI_SOURCES
+import asyncio
 import os
 from openrouter_client import openrouter_query
 from gemini_client import gemini_query
 
 app = FastAPI()
 
-# --- Async ingestion at startup ---
+# --- Index ---
+# The API never builds or writes the index: run `python -m indexer build-index` (or scheduler.py).
+# rag_pipeline.get_vectorstore() opens the prebuilt index lazily, on the first request that needs it.
+
+# --- Embedding Model ---
+# One shared embedding service for the whole app (embedding_service.py). Load it and run a warmup encode
+# at startup so the first query does not pay for loading the model weights (likewise the optional reranker).
 @app.on_event("startup")
-async def ingest_async_resources():
-    from langchain_huggingface import HuggingFaceEmbeddings
-    from langchain_community.vectorstores import FAISS
-    import os
-    from async_ingest import fetch_and_ingest_async_resources
-    global vectorstore
-    faiss_index_path = "faiss_index"
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    # Load or create vectorstore
-    if os.path.exists(faiss_index_path):
-        vectorstore = FAISS.load_local(faiss_index_path, embeddings, allow_dangerous_deserialization=True)
-    else:
-        vectorstore = FAISS.from_documents([], embeddings)
-    await fetch_and_ingest_async_resources(vectorstore)
+async def warm_up_embeddings():
+    await asyncio.to_thread(lambda: get_embedding_service().warmup())
+    reranker = await asyncio.to_thread(get_reranker)
+    if reranker is not None:
+        await asyncio.to_thread(reranker.warmup)
+
+@app.on_event("shutdown")
+def stop_embeddings():
+    get_embedding_service().shutdown()
 
 # --- Health Endpoint ---
 @app.get("/health")
@@ -68,17 +75,9 @@ def sources():
 @app.get("/db_size")
 def db_size():
     try:
-        # Always reload vectorstore if not loaded
-        global vectorstore
-        if vectorstore is None:
-            from langchain_community.embeddings import HuggingFaceEmbeddings
-            from langchain_community.vectorstores import FAISS
-            embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-            faiss_index_path = "faiss_index"
-            if os.path.exists(faiss_index_path):
-                vectorstore = FAISS.load_local(faiss_index_path, embeddings, allow_dangerous_deserialization=True)
+        vectorstore = get_vectorstore()
         if vectorstore is not None:
-            return {"size": len(vectorstore.docstore._dict)}
+            return {"size": vectorstore.count()}
         else:
             return {"size": 0}
     except Exception as e:
@@ -87,34 +86,53 @@ def db_size():
 
 # --- Docs Preview Endpoint ---
 @app.get("/docs_preview")
-def docs_preview():
+def docs_preview(cursor: Optional[str] = None, limit: int = 10):
+    # One page of chunk metadata from the columnar metadata table; pass next_cursor back for the next page
     try:
-        global vectorstore
-        if vectorstore is None:
-            from langchain_community.embeddings import HuggingFaceEmbeddings
-            from langchain_community.vectorstores import FAISS
-            embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-            faiss_index_path = "faiss_index"
-            if os.path.exists(faiss_index_path):
-                vectorstore = FAISS.load_local(faiss_index_path, embeddings, allow_dangerous_deserialization=True)
+        parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        version, vectorstore = live_index()
         if vectorstore is not None:
-            docs = list(vectorstore.docstore._dict.values())[:10]
+            rows, next_cursor = vectorstore.page(cursor, max(1, min(limit, 100)))
             preview = []
-            for doc in docs:
+            for row in rows:
                 preview.append({
-                    "title": doc.metadata.get("title", "N/A"),
-                    "summary": doc.page_content[:200],
-                    "source": doc.metadata.get("source", "N/A"),
-                    "published_date": doc.metadata.get("published_date", "N/A"),
-                    "url": doc.metadata.get("url", "N/A")
+                    "title": row["title"] or "N/A",
+                    "summary": row["snippet"],
+                    "source": row["source"] or "N/A",
+                    "published_date": row["published_date"] or "N/A",
+                    "url": row["url"] or "N/A"
                 })
-            return {"preview": preview}
+            return {"preview": preview, "next_cursor": next_cursor, "index_version": version}
         else:
             return {"preview": []}
     except Exception as e:
         print(f"Error in /docs_preview: {e}")
         return {"preview": []}
 
+# --- Filters Endpoint ---
+@app.get("/filters")
+def filters():
+    # Values accepted by the /query filters, with chunk counts, and the range of publication dates
+    try:
+        vectorstore = get_vectorstore()
+        if vectorstore is not None:
+            return vectorstore.filter_summary()
+        return {}
+    except Exception as e:
+        print(f"Error in /filters: {e}")
+        return {}
+
+# --- Cache Stats Endpoint ---
+@app.get("/cache_stats")
+def cache_stats():
+    # Hit rates of the query embedding / query result caches, the embedding service and reranker counters
+    reranker = get_reranker()
+    return {"query_cache": get_query_cache().summary(), "embeddings": get_embedding_service().summary(),
+            "reranker": reranker.summary() if reranker is not None else None}
+
 # Allow frontend to talk to backend
 app.add_middleware(
     CORSMiddleware,
@@ -132,11 +150,19 @@ if __name__ == "__main__":
 class QueryRequest(BaseModel):
     query: str
     model: str
+    # Optional retrieval filters, applied inside the vector search (see metadata_index.py)
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    sources: Optional[List[str]] = None
+    companies: Optional[List[str]] = None
+    types: Optional[List[str]] = None
 
 @app.post("/query")
 async def query_route(request: QueryRequest):
     try:
-        response = await get_research_answer(request.query, request.model)
+        response = await get_research_answer(request.query, request.model, date_from=request.date_from,
+                                             date_to=request.date_to, sources=request.sources,
+                                             companies=request.companies, types=request.types)
         return {"response": response}
     except Exception as e:
         # Log the exact error (optional for debug)
@@ -0,0 +1,323 @@
+"""
+metadata_index.py
+- Typed columnar metadata table of every vector of the index, in index order: the chunk id, parsed
+  publication time (UTC epoch seconds, NaN when unknown), source / company / type as integer codes into small
+  interned vocabularies, and title / url / published_date / a short text snippet as Arrow-style string columns
+  (one UTF-8 buffer plus offsets).
+- Built from the chunks at save time (vector_store.save_vectorstore) into metadata_index.npz. Rows are looked
+  up by position or, through a hash map, by chunk id, so previews, stats and filters never decode chunk text.
+- mask() turns query filters (date_from / date_to / sources / companies / types) into a boolean vector mask;
+  the API hands it to FAISS as an IDSelectorBitmap, so filtering happens inside the search and a filtered
+  query still gets a full k instead of whatever survives a post-filter.
+- Also the per-chunk ranking features (chunk_features(): AI-topic flag, lowercased title tokens, text length,
+  plus the timestamp above), computed once here so the query path (ranking.py) scores candidates with numpy
+  instead of re-lowercasing and re-parsing every chunk per query.
+- retention_days() / expired(): per-source retention (data_sources_config.RETENTION_DAYS) used by the index
+  lifecycle (lifecycle.py) and by ingestion, which skips documents that are already past it.
+"""
+import email.utils
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from data_sources_config import AI_SOURCES, RETENTION_DAYS
+
+METADATA_INDEX_FILE = "metadata_index.npz"
+# Characters of chunk text kept per row for previews.
+SNIPPET_CHARS = 200
+
+# Document type for chunks whose metadata has no 'type' (the static sources and the article cache).
+_SOURCE_TYPES = {"arxiv": "paper", "pubmed": "paper", "ssrn": "paper", "ai_companies": "company", "cache": "article"}
+_SOURCE_RETENTION = {src["name"]: src["retention_days"] for src in AI_SOURCES if "retention_days" in src}
+# A chunk is AI-related when its text or title contains any of these (substring match, lowercased).
+AI_KEYWORDS = ("ai", "artificial intelligence", "machine learning", "llm", "agent", "agents", "company", "companies")
+_TOKEN_RE = re.compile(r"\w+")
+_MONTHS = {m: i for i, m in enumerate(("jan", "feb", "mar", "apr", "may", "jun",
+                                        "jul", "aug", "sep", "oct", "nov", "dec"), 1)}
+
+
+def parse_timestamp(value):
+    """
+    UTC epoch seconds of a published_date string in any of the formats our sources use (ISO 8601,
+    RFC 822 feed dates, PubMed's "2024 Jan 5", bare years), or NaN.
+    """
+    if not value or not isinstance(value, str):
+        return float("nan")
+    value = value.strip()
+    date = None
+    try:
+        date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            m = re.match(r"(\d{4})(?:[-/ ](\d{1,2}|[A-Za-z]{3})[A-Za-z]*(?:[-/ ](\d{1,2}))?)?", value)
+            if m:
+                month = m.group(2) or "1"
+                month = int(month) if month.isdigit() else _MONTHS.get(month.lower(), 1)
+                try:
+                    date = datetime(int(m.group(1)), month, int(m.group(3) or 1))
+                except ValueError:
+                    date = None
+    if date is None:
+        return float("nan")
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+def _date_bounds(date_from, date_to):
+    """Epoch bounds of a date filter; a bare YYYY-MM-DD upper bound includes that whole day."""
+    low = parse_timestamp(date_from) if date_from else -np.inf
+    high = parse_timestamp(date_to) if date_to else np.inf
+    if date_to and re.fullmatch(r"\d{4}-\d{2}-\d{2}", date_to.strip()):
+        high += 86400 - 1e-3
+    return low, high
+
+
+def doc_type(metadata):
+    if metadata.get("type"):
+        return metadata["type"]
+    if metadata.get("source") == "ai_companies" and metadata.get("parent"):
+        return "resource"
+    return _SOURCE_TYPES.get(metadata.get("source", ""), "other")
+
+
+def doc_company(metadata):
+    return metadata.get("company") or metadata.get("parent") or ""
+
+
+def retention_days(metadata):
+    """Retention of a chunk in days: its source's, else its type's, else None (kept forever)."""
+    source = metadata.get("source", "")
+    for days in (_SOURCE_RETENTION.get(source), RETENTION_DAYS.get(source), RETENTION_DAYS.get(doc_type(metadata))):
+        if days is not None:
+            return days
+    return None
+
+
+def expired(metadata, now=None):
+    """Whether a chunk is past its retention (never for chunks without a known publication date)."""
+    days = retention_days(metadata)
+    if days is None:
+        return False
+    published = parse_timestamp(metadata.get("published_date"))
+    return published < (time.time() if now is None else now) - days * 86400
+
+
+def matches(metadata, date_from=None, date_to=None, sources=None, companies=None, types=None):
+    """MetadataIndex.mask() semantics for a single chunk (post-filtering when there is no metadata index)."""
+    if date_from or date_to:
+        low, high = _date_bounds(date_from, date_to)
+        if not low <= parse_timestamp(metadata.get("published_date")) <= high:
+            return False
+    for value, wanted in ((metadata.get("source", ""), sources), (doc_company(metadata), companies),
+                          (doc_type(metadata), types)):
+        if wanted and value.lower() not in {w.strip().lower() for w in wanted}:
+            return False
+    return True
+
+
+def is_ai_related(text):
+    text = str(text).lower()
+    return any(kw in text for kw in AI_KEYWORDS)
+
+
+def tokens(text):
+    """Lowercased word tokens of `text`, space-separated."""
+    return " ".join(_TOKEN_RE.findall(str(text).lower()))
+
+
+def chunk_features(metadata, text):
+    """Ranking features of one chunk: timestamp, ai_topic, title_tokens and length (see MetadataIndex.features)."""
+    title = metadata.get("title", "")
+    return {"timestamp": parse_timestamp(metadata.get("published_date")),
+            "ai_topic": is_ai_related(text) or is_ai_related(title), "title_tokens": tokens(title),
+            "length": len(text)}
+
+
+def document_row(doc):
+    """A MetadataIndex.row() for a Document (for stores without a metadata table)."""
+    metadata = doc.metadata
+    return {"id": doc.id, "title": str(metadata.get("title", "")), "url": str(metadata.get("url", "")),
+            "published_date": str(metadata.get("published_date", "")), "snippet": doc.page_content[:SNIPPET_CHARS],
+            "source": metadata.get("source", ""), "company": doc_company(metadata), "type": doc_type(metadata),
+            "timestamp": parse_timestamp(metadata.get("published_date"))}
+
+
+class StringColumn:
+    """Variable-length strings stored Arrow-style: one UTF-8 byte buffer and int64 offsets into it."""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def build(cls, values):
+        encoded = [str(v).encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return self.data[self.offsets[position]:self.offsets[position + 1]].tobytes().decode("utf-8")
+
+
+class MetadataIndex:
+    """
+    Per-vector columns and the filter masks built from them. `ids` and `strings` are None for tables written
+    before they existed (filters and stats still work; rows do not), `ai_topic` and `lengths` likewise for the
+    ranking features.
+    """
+
+    COLUMNS = ("source", "company", "type")
+    STRING_COLUMNS = ("title", "url", "published_date", "snippet")
+
+    def __init__(self, timestamps, codes, vocab, ids=None, strings=None, ai_topic=None, lengths=None):
+        self.timestamps = timestamps
+        self.codes = codes
+        self.vocab = vocab
+        self.ids = ids
+        self.strings = strings
+        self.ai_topic = ai_topic
+        self.lengths = lengths
+        self._positions = None
+
+    @classmethod
+    def build(cls, metadatas, ids=None, texts=None):
+        """
+        From chunk metadata dicts in index order, with the chunks' ids and texts for the row columns and the
+        ranking features.
+        """
+        metadatas = list(metadatas)
+        values = {"source": [m.get("source", "") for m in metadatas],
+                  "company": [doc_company(m) for m in metadatas],
+                  "type": [doc_type(m) for m in metadatas]}
+        codes, vocab = {}, {}
+        for column, column_values in values.items():
+            vocab[column] = sorted(set(column_values))
+            lookup = {v: i for i, v in enumerate(vocab[column])}
+            codes[column] = np.array([lookup[v] for v in column_values], dtype=np.int32)
+        timestamps = np.array([parse_timestamp(m.get("published_date")) for m in metadatas], dtype=np.float64)
+        if ids is None or texts is None:
+            return cls(timestamps, codes, vocab)
+        strings = {column: StringColumn.build(m.get(column, "") for m in metadatas)
+                   for column in ("title", "url", "published_date")}
+        texts = list(texts)
+        strings["snippet"] = StringColumn.build(text[:SNIPPET_CHARS] for text in texts)
+        strings["title_tokens"] = StringColumn.build(tokens(m.get("title", "")) for m in metadatas)
+        ai_topic = np.array([is_ai_related(text) or is_ai_related(m.get("title", ""))
+                             for m, text in zip(metadatas, texts)], dtype=bool)
+        lengths = np.array([len(text) for text in texts], dtype=np.int32)
+        return cls(timestamps, codes, vocab, np.array(list(ids), dtype=str), strings, ai_topic, lengths)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def has_rows(self):
+        return self.strings is not None
+
+    @property
+    def has_features(self):
+        return self.ai_topic is not None
+
+    def save(self, path):
+        """Writes the .npz under a temporary name and renames it into place."""
+        arrays = {"timestamps": self.timestamps}
+        for column in self.COLUMNS:
+            arrays[f"{column}_codes"] = self.codes[column]
+            arrays[f"{column}_vocab"] = np.array(self.vocab[column], dtype=str)
+        if self.has_rows:
+            arrays["ids"] = self.ids
+            for column, values in self.strings.items():
+                arrays[f"{column}_offsets"] = values.offsets
+                arrays[f"{column}_data"] = values.data
+        if self.has_features:
+            arrays["ai_topic"] = self.ai_topic
+            arrays["lengths"] = self.lengths
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            ids, strings, ai_topic, lengths = None, None, None, None
+            if "ids" in data.files:
+                ids = data["ids"]
+                strings = {name[:-len("_offsets")]: StringColumn(data[name], data[name[:-len("_offsets")] + "_data"])
+                           for name in data.files if name.endswith("_offsets")}
+            if "ai_topic" in data.files:
+                ai_topic, lengths = data["ai_topic"], data["lengths"]
+            return cls(data["timestamps"], {c: data[f"{c}_codes"] for c in cls.COLUMNS},
+                       {c: data[f"{c}_vocab"].tolist() for c in cls.COLUMNS}, ids, strings, ai_topic, lengths)
+
+    def position(self, vector_id):
+        """Index position of a chunk id (None if absent), through a hash map built on first use."""
+        if self.ids is None:
+            return None
+        if self._positions is None:
+            self._positions = {vid: pos for pos, vid in enumerate(self.ids.tolist())}
+        return self._positions.get(vector_id)
+
+    def row(self, position):
+        """
+        Metadata of the chunk at `position`: id, title, url, published_date, snippet, source, company, type and
+        the parsed timestamp.
+        """
+        out = {"id": str(self.ids[position])}
+        out.update((column, self.strings[column][position]) for column in self.STRING_COLUMNS)
+        out.update((column, self.vocab[column][self.codes[column][position]]) for column in self.COLUMNS)
+        out["timestamp"] = float(self.timestamps[position])
+        return out
+
+    def features(self, positions):
+        """Ranking features of the chunks at `positions`, as arrays (see chunk_features)."""
+        positions = np.asarray(positions, dtype=np.int64)
+        title_tokens = self.strings["title_tokens"]
+        return {"timestamp": self.timestamps[positions], "ai_topic": self.ai_topic[positions],
+                "title_tokens": np.array([title_tokens[pos] for pos in positions.tolist()], dtype=object),
+                "length": self.lengths[positions]}
+
+    def _column_mask(self, column, wanted):
+        wanted = {w.strip().lower() for w in wanted}
+        hits = [i for i, v in enumerate(self.vocab[column]) if v.lower() in wanted]
+        return np.isin(self.codes[column], hits)
+
+    def mask(self, date_from=None, date_to=None, sources=None, companies=None, types=None):
+        """
+        Boolean mask of the vectors matching every given filter (None when no filter is given).
+        A date bound only matches chunks with a known publication date. Value filters are case-insensitive.
+        """
+        if not (date_from or date_to or sources or companies or types):
+            return None
+        mask = np.ones(len(self), dtype=bool)
+        if date_from or date_to:
+            low, high = _date_bounds(date_from, date_to)
+            mask &= (self.timestamps >= low) & (self.timestamps <= high)
+        for column, wanted in (("source", sources), ("company", companies), ("type", types)):
+            if wanted:
+                mask &= self._column_mask(column, wanted)
+        return mask
+
+    def summary(self, alive=None):
+        """Distinct filter values with their vector counts, plus the dated range (of the `alive` vectors only)."""
+        out = {}
+        for column in self.COLUMNS:
+            codes = self.codes[column] if alive is None else self.codes[column][alive]
+            counts = np.bincount(codes, minlength=len(self.vocab[column]))
+            out[column] = {v: int(n) for v, n in zip(self.vocab[column], counts) if v and n}
+        timestamps = self.timestamps if alive is None else self.timestamps[alive]
+        dated = timestamps[~np.isnan(timestamps)]
+        out["dated"] = int(len(dated))
+        if len(dated):
+            out["date_range"] = [datetime.fromtimestamp(dated.min(), timezone.utc).date().isoformat(),
+                                 datetime.fromtimestamp(dated.max(), timezone.utc).date().isoformat()]
+        return out
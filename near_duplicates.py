@@ -0,0 +1,261 @@
+"""
+near_duplicates.py
+- Near-duplicate detection at ingest time: MinHash signatures over word shingles of normalized text,
+  banded into a persistent LSH index (faiss_index/near_dup.db).
+- The same announcement is often published on several feeds (OpenAI Blog / Medium / Substack) and
+  arXiv links come as abs/ and pdf/ variants. The first document seen stays canonical; later copies are
+  recorded as its mirrors and never split or embedded. The canonical's chunks carry the merged
+  `mirror_sources` / `mirror_urls` metadata, and mirrors indexed before this stage existed are removed.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+NEAR_DUP_PATH = os.path.join("faiss_index", "near_dup.db")
+# Estimated Jaccard similarity of shingle sets above which two documents are the same content.
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))
+SHINGLE_SIZE = 5
+# Shorter texts (titles, one-line summaries) are too small to compare reliably and are never collapsed.
+MIN_SHINGLES = 20
+MAX_TOKENS = 20000
+NUM_PERM = 128
+# 16 bands x 8 rows: pairs around 0.8 Jaccard share a bucket with ~90% probability, pairs below 0.5 rarely do.
+LSH_BANDS = 16
+_PRIME = (1 << 31) - 1
+# Header lines of our own Document layouts; they differ between mirrors (source, URL) and are not content.
+_HEADER_LINE = re.compile(r"^(Source|URL|Resource URL|Company|Type|Published|Parent|Category):.*$", re.MULTILINE)
+_ARXIV_PATH = re.compile(r"^/(?:abs|pdf)/(.+?)(?:v\d+)?(?:\.pdf)?$")
+_TRACKING_PARAMS = {"source", "ref", "ref_src", "sk", "gi"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS canonicals (
+    doc_key TEXT PRIMARY KEY,
+    url TEXT,
+    signature BLOB
+);
+CREATE INDEX IF NOT EXISTS canonicals_url ON canonicals(url);
+CREATE TABLE IF NOT EXISTS lsh_bands (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    doc_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lsh_bucket ON lsh_bands(band, bucket);
+CREATE INDEX IF NOT EXISTS lsh_doc ON lsh_bands(doc_key);
+CREATE TABLE IF NOT EXISTS mirrors (
+    doc_key TEXT PRIMARY KEY,
+    canonical_key TEXT NOT NULL,
+    source TEXT,
+    url TEXT
+);
+CREATE INDEX IF NOT EXISTS mirrors_canonical ON mirrors(canonical_key);
+"""
+
+
+def canonical_url(url):
+    """
+    Normalizes a URL for identity checks: https, no www., no trailing slash/fragment/tracking parameters,
+    and arXiv pdf/versioned links folded into arxiv.org/abs/<id>.
+    """
+    if not url or url == "N/A":
+        return ""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    if host.endswith("arxiv.org"):
+        match = _ARXIV_PATH.match(path)
+        if match:
+            host, path = "arxiv.org", f"/abs/{match.group(1)}"
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query)
+                       if not k.startswith("utm_") and k not in _TRACKING_PARAMS])
+    return urlunsplit(("https", host, path, query, ""))
+
+
+def normalize_text(text):
+    """Lower-cased words of `text` without our header lines, URLs and punctuation."""
+    text = _HEADER_LINE.sub(" ", text)
+    text = re.sub(r"https?://\S+", " ", text.lower())
+    return " ".join(re.findall(r"\w+", text))
+
+
+class NearDuplicateIndex:
+    """
+    Persistent MinHash-LSH index of canonical documents plus the mirrors collapsed into them.
+    Like the index registry, changes stay in an open transaction until commit().
+    """
+
+    def __init__(self, path=NEAR_DUP_PATH, threshold=NEAR_DUP_THRESHOLD, num_perm=NUM_PERM, bands=LSH_BANDS):
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.RandomState(1)
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        # Canonicals that gained mirrors (or were re-indexed) this run, and mirrors that had their own vectors.
+        self._touched = set()
+        self._retired = set()
+        self.stats = {"checked": 0, "mirrors": 0, "url_matches": 0, "lsh_matches": 0}
+
+    def _migrate(self):
+        """Folds arXiv document keys like index_registry.document_key does (indexes written before it did)."""
+        for table, column in (("canonicals", "doc_key"), ("lsh_bands", "doc_key"), ("mirrors", "doc_key"),
+                              ("mirrors", "canonical_key")):
+            keys = self._conn.execute(f"SELECT DISTINCT {column} FROM {table} WHERE {column} LIKE '%arxiv.org/%'")
+            for (key,) in keys.fetchall():
+                if canonical_url(key) != key:
+                    self._conn.execute(f"UPDATE OR REPLACE {table} SET {column} = ? WHERE {column} = ?",
+                                       (canonical_url(key), key))
+        # A paper recorded as a mirror of another version of itself is the canonical now.
+        self._conn.execute("DELETE FROM mirrors WHERE doc_key = canonical_key")
+        self._conn.commit()
+
+    def signature(self, text):
+        """MinHash signature (uint32[num_perm]) of the text's word shingles, or None if it is too short."""
+        tokens = normalize_text(text).split()[:MAX_TOKENS]
+        if len(tokens) < SHINGLE_SIZE + MIN_SHINGLES - 1:
+            return None
+        hashes = np.unique(np.fromiter(
+            (zlib.crc32(" ".join(tokens[i:i + SHINGLE_SIZE]).encode("utf-8"))
+             for i in range(len(tokens) - SHINGLE_SIZE + 1)), dtype=np.uint64)) % _PRIME
+        return ((self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+    def _buckets(self, sig):
+        for band in range(self.bands):
+            digest = hashlib.blake2b(sig[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).digest()
+            yield band, int.from_bytes(digest, "big", signed=True)
+
+    def _lsh_match(self, sig, key):
+        candidates = set()
+        for band, bucket in self._buckets(sig):
+            candidates.update(r[0] for r in self._conn.execute(
+                "SELECT doc_key FROM lsh_bands WHERE band = ? AND bucket = ?", (band, bucket)))
+        candidates.discard(key)
+        best, best_sim = None, self.threshold
+        for cand in candidates:
+            row = self._conn.execute("SELECT signature FROM canonicals WHERE doc_key = ?", (cand,)).fetchone()
+            if row is None or row[0] is None:
+                continue
+            sim = float(np.mean(np.frombuffer(row[0], dtype=np.uint32) == sig))
+            if sim >= best_sim:
+                best, best_sim = cand, sim
+        return best
+
+    def _register(self, key, url, sig):
+        self._conn.execute("DELETE FROM lsh_bands WHERE doc_key = ?", (key,))
+        self._conn.execute("INSERT OR REPLACE INTO canonicals (doc_key, url, signature) VALUES (?, ?, ?)",
+                           (key, url, sig.tobytes() if sig is not None else None))
+        if sig is not None:
+            self._conn.executemany("INSERT INTO lsh_bands (band, bucket, doc_key) VALUES (?, ?, ?)",
+                                   [(band, bucket, key) for band, bucket in self._buckets(sig)])
+
+    def match(self, doc, key):
+        """
+        Checks `doc` (registry key `key`) against the index. Returns the key of the canonical document it
+        mirrors, or None after registering it as canonical itself.
+        """
+        self.stats["checked"] += 1
+        row = self._conn.execute("SELECT canonical_key FROM mirrors WHERE doc_key = ?", (key,)).fetchone()
+        if row:
+            self.stats["mirrors"] += 1
+            return row[0]
+        url = canonical_url(doc.metadata.get("url", ""))
+        canonical = None
+        if url:
+            row = self._conn.execute("SELECT doc_key FROM canonicals WHERE url = ? AND doc_key != ? LIMIT 1",
+                                     (url, key)).fetchone()
+            if row:
+                canonical = row[0]
+                self.stats["url_matches"] += 1
+        sig = self.signature(doc.page_content)
+        if canonical is None and sig is not None:
+            canonical = self._lsh_match(sig, key)
+            if canonical is not None:
+                self.stats["lsh_matches"] += 1
+        if canonical is None:
+            self._register(key, url, sig)
+            if self._conn.execute("SELECT 1 FROM mirrors WHERE canonical_key = ? LIMIT 1", (key,)).fetchone():
+                self._touched.add(key)
+            return None
+        self._conn.execute("INSERT OR REPLACE INTO mirrors (doc_key, canonical_key, source, url) VALUES (?, ?, ?, ?)",
+                           (key, canonical, doc.metadata.get("source", ""), doc.metadata.get("url", "")))
+        self._touched.add(canonical)
+        self._retired.add(key)
+        self.stats["mirrors"] += 1
+        return canonical
+
+    def mirror_metadata(self, canonical_key):
+        """Merged source metadata of a canonical document's mirrors."""
+        rows = self._conn.execute("SELECT source, url FROM mirrors WHERE canonical_key = ? ORDER BY doc_key",
+                                  (canonical_key,)).fetchall()
+        sources, urls = [], []
+        for source, url in rows:
+            if source and source not in sources:
+                sources.append(source)
+            if url and url not in urls:
+                urls.append(url)
+        return {"mirror_sources": sources, "mirror_urls": urls}
+
+    def retired_vector_ids(self, registry):
+        """Drops documents that turned out to be mirrors from the registry and returns their vector IDs."""
+        vids = []
+        for key in self._retired:
+            vids.extend(registry.forget(key))
+        self._retired.clear()
+        return vids
+
+    def apply(self, vectorstore, registry):
+        """
+        Writes merged mirror metadata onto the indexed chunks of every canonical touched this run.
+        Returns the number of chunks whose metadata changed (the index needs saving if > 0).
+        """
+        patched = 0
+        for key in self._touched:
+            meta = self.mirror_metadata(key)
+            for vid in registry.vector_ids(key):
+                doc = vectorstore.docstore._dict.get(vid)
+                if doc is not None and any(doc.metadata.get(k) != v for k, v in meta.items()):
+                    doc.metadata.update(meta)
+                    patched += 1
+        self._touched.clear()
+        return patched
+
+    def remove(self, keys):
+        """
+        Drops documents removed from the index (lifecycle.py) along with the mirrors collapsed into them, which
+        are then admitted on their own the next time a source serves them (uncommitted).
+        Returns the number of mirrors released.
+        """
+        released = 0
+        for key in keys:
+            self._conn.execute("DELETE FROM canonicals WHERE doc_key = ?", (key,))
+            self._conn.execute("DELETE FROM lsh_bands WHERE doc_key = ?", (key,))
+            self._conn.execute("DELETE FROM mirrors WHERE doc_key = ?", (key,))
+            released += self._conn.execute("DELETE FROM mirrors WHERE canonical_key = ?", (key,)).rowcount
+            self._touched.discard(key)
+        return released
+
+    def log_stats(self):
+        logging.info(f"[Near Duplicates] {self.stats}")
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+        self._touched.clear()
+        self._retired.clear()
+
+    def close(self):
+        self._conn.close()
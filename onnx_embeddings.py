@@ -0,0 +1,201 @@
+"""
+onnx_embeddings.py
+- ONNX Runtime CPU backend for the sentence-transformer embedder: the same all-MiniLM-L6-v2 weights,
+  exported to ONNX and int8-quantized (dynamic quantization), run without PyTorch.
+- Texts are embedded in length-sorted batches padded only to the longest text of each batch (dynamic
+  batching), with mean pooling + L2 normalization exactly like the sentence-transformers pipeline.
+- Select it with EMBEDDING_BACKEND=onnx after exporting the model once:
+    python -m onnx_embeddings export            # writes models/all-MiniLM-L6-v2-onnx/
+    python -m onnx_embeddings parity            # cosine agreement with the torch model
+    python -m onnx_embeddings bench             # texts/second, torch vs onnx
+  Needs `onnxruntime` and `tokenizers` at runtime; `torch`, `transformers` and `onnx` only to export.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join("models", "all-MiniLM-L6-v2-onnx"))
+ONNX_MODEL_FILE = "model.int8.onnx"
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", str(os.cpu_count() or 1)))
+ONNX_BATCH_SIZE = int(os.getenv("ONNX_BATCH_SIZE", "32"))
+# all-MiniLM-L6-v2 was trained with 256 word pieces; sentence-transformers truncates there too.
+ONNX_MAX_LENGTH = 256
+# Mean cosine similarity to the torch model below which `parity` fails.
+PARITY_MIN_COSINE = 0.99
+
+_SAMPLE_TEXTS = [
+    "OpenAI released a new reasoning model with improved tool use.",
+    "DeepMind's AlphaFold predicts protein structures from amino-acid sequences.",
+    "Retrieval-augmented generation grounds language model answers in retrieved documents.",
+    "The Batch covers weekly news about machine learning research and industry.",
+    "Quantization reduces model size by storing weights as 8-bit integers.",
+    "FAISS performs efficient similarity search over dense vectors.",
+    "Anthropic published research on constitutional AI and model interpretability.",
+    "Hugging Face hosts open-source transformer models and datasets.",
+]
+
+
+def export_model(model_name, out_dir=ONNX_MODEL_DIR, quantize=True):
+    """Exports `model_name` (transformer body only; pooling is done here) to ONNX and int8-quantizes it."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    axes = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model, (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]), fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"], output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "token_type_ids": axes, "last_hidden_state": axes},
+            opset_version=14)
+    tokenizer.save_pretrained(out_dir)
+    if quantize:
+        quantize_dynamic(fp32_path, os.path.join(out_dir, ONNX_MODEL_FILE), weight_type=QuantType.QInt8)
+    logging.info(f"[ONNX Embeddings] Exported {model_name} to {out_dir} (quantized: {quantize}).")
+    return out_dir
+
+
+class OnnxEmbeddings(Embeddings):
+    """LangChain Embeddings backed by an ONNX Runtime session of an exported sentence-transformer."""
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, threads=ONNX_THREADS, batch_size=ONNX_BATCH_SIZE,
+                 max_length=ONNX_MAX_LENGTH, model_file=ONNX_MODEL_FILE):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_dir = model_dir
+        self.batch_size = max(1, int(batch_size))
+        self.threads = max(1, int(threads))
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(os.path.join(model_dir, model_file), options,
+                                             providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self._session.get_inputs()}
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length)
+        self._tokenizer.no_padding()
+
+    def _embed_batch(self, encodings):
+        width = max(len(e.ids) for e in encodings)
+        ids = np.zeros((len(encodings), width), dtype=np.int64)
+        mask = np.zeros_like(ids)
+        for row, enc in enumerate(encodings):
+            ids[row, :len(enc.ids)] = enc.ids
+            mask[row, :len(enc.ids)] = 1
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._inputs:
+            feeds["token_type_ids"] = np.zeros_like(ids)
+        hidden = self._session.run(None, feeds)[0]
+        weights = mask[..., None].astype(np.float32)
+        pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_array(self, texts):
+        """Embeds `texts` into a float32 (n, dim) array, in input order."""
+        encodings = self._tokenizer.encode_batch(list(texts))
+        # Sort by token length so each batch pads to similar lengths, then restore input order.
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i].ids))
+        out = None
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            vectors = self._embed_batch([encodings[i] for i in idx])
+            if out is None:
+                out = np.empty((len(encodings), vectors.shape[1]), dtype=np.float32)
+            out[idx] = vectors
+        return out if out is not None else np.empty((0, 0), dtype=np.float32)
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_array([text])[0].tolist()
+
+
+def _sample_texts(limit):
+    """Parity/benchmark corpus: cached article snippets when there are any, else built-in sentences."""
+    texts = []
+    try:
+        from content_store import get_content_store, snippet
+        for record in get_content_store().iter_records():
+            texts.append(snippet(record))
+            if len(texts) >= limit:
+                break
+    except Exception as e:
+        logging.warning(f"[ONNX Embeddings] Content store unavailable, using built-in samples: {e}")
+    while len(texts) < limit:
+        texts.extend(_SAMPLE_TEXTS)
+    return texts[:limit]
+
+
+def _torch_embeddings(model_name):
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+def parity_check(model_name, model_dir=ONNX_MODEL_DIR, samples=64):
+    """Cosine similarity between torch and ONNX vectors of the same texts: {'mean', 'min', 'passed'}."""
+    texts = _sample_texts(samples)
+    reference = np.asarray(_torch_embeddings(model_name).embed_documents(texts), dtype=np.float32)
+    candidate = OnnxEmbeddings(model_dir).embed_array(texts)
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+    cosine = (reference * candidate).sum(axis=1)
+    return {"samples": len(texts), "mean": float(cosine.mean()), "min": float(cosine.min()),
+            "passed": bool(cosine.mean() >= PARITY_MIN_COSINE)}
+
+
+def benchmark(model_name, model_dir=ONNX_MODEL_DIR, samples=512, threads=ONNX_THREADS, batch_size=ONNX_BATCH_SIZE):
+    """Texts/second of the torch and ONNX backends on the same corpus (after one warmup call each)."""
+    texts = _sample_texts(samples)
+    results = {}
+    for name, backend in (("torch", _torch_embeddings(model_name)),
+                          ("onnx-int8", OnnxEmbeddings(model_dir, threads=threads, batch_size=batch_size))):
+        backend.embed_documents(texts[:8])
+        start = time.perf_counter()
+        backend.embed_documents(texts)
+        elapsed = time.perf_counter() - start
+        results[name] = {"seconds": round(elapsed, 3), "texts_per_second": round(len(texts) / elapsed, 1)}
+    results["speedup"] = round(results["onnx-int8"]["texts_per_second"] / results["torch"]["texts_per_second"], 2)
+    return results
+
+
+def main(argv=None):
+    from embedding_service import EMBEDDING_MODEL_NAME
+    parser = argparse.ArgumentParser(prog="python -m onnx_embeddings", description="ONNX embedding backend tools.")
+    parser.add_argument("--model-dir", default=ONNX_MODEL_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Export and quantize the embedding model.")
+    export.add_argument("--no-quantize", action="store_true")
+    parity = commands.add_parser("parity", help="Cosine agreement with the torch model.")
+    parity.add_argument("--samples", type=int, default=64)
+    bench = commands.add_parser("bench", help="Throughput of torch vs ONNX.")
+    bench.add_argument("--samples", type=int, default=512)
+    bench.add_argument("--threads", type=int, default=ONNX_THREADS)
+    bench.add_argument("--batch-size", type=int, default=ONNX_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "export":
+        export_model(EMBEDDING_MODEL_NAME, args.model_dir, quantize=not args.no_quantize)
+        return 0
+    if args.command == "parity":
+        result = parity_check(EMBEDDING_MODEL_NAME, args.model_dir, args.samples)
+        print(result)
+        return 0 if result["passed"] else 1
+    print(benchmark(EMBEDDING_MODEL_NAME, args.model_dir, args.samples, args.threads, args.batch_size))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
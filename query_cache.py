@@ -0,0 +1,124 @@
+"""
+query_cache.py
+- In-process, two-level cache for the query path:
+    1. query text -> query embedding (skips the embedding model for repeated questions)
+    2. (normalized query, k, metadata filters, diversify flag, index version) -> selected documents
+       (skips search + filter/dedup/diversify/boost in retrieve_context)
+- Both levels are bounded LRUs with a TTL. Result keys carry the index version, and results of an older
+  version are dropped as soon as a newer one is seen, so a rebuilt index never serves stale context.
+- Hit rates are exposed by the API at /cache_stats.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+QUERY_RESULT_CACHE_SIZE = int(os.getenv("QUERY_RESULT_CACHE_SIZE", "1024"))
+QUERY_RESULT_CACHE_TTL = float(os.getenv("QUERY_RESULT_CACHE_TTL", "600"))
+
+_MISSING = object()
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a query, used for result keys."""
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class TTLCache:
+    """Thread-safe LRU mapping with a per-entry time-to-live and hit/miss/eviction counters."""
+
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max(1, int(max_size))
+        self.ttl_seconds = float(ttl_seconds)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def _lookup(self, key, count):
+        entry = self._data.get(key, _MISSING)
+        if entry is not _MISSING and self.ttl_seconds > 0 and time.monotonic() - entry[1] > self.ttl_seconds:
+            del self._data[key]
+            if count:
+                self.stats["expired"] += 1
+            entry = _MISSING
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key, True)
+            if entry is _MISSING:
+                self.stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        """Membership test that does not count as a lookup."""
+        with self._lock:
+            return self._lookup(key, False) is not _MISSING
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def summary(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {"size": len(self._data), "max_size": self.max_size, "ttl_seconds": self.ttl_seconds,
+                    "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0, **self.stats}
+
+
+class QueryCache:
+    """The query embedding and query result levels, with index-version invalidation of results."""
+
+    def __init__(self):
+        self.embeddings = TTLCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+        self.results = TTLCache(QUERY_RESULT_CACHE_SIZE, QUERY_RESULT_CACHE_TTL)
+        self._version = None
+        self._lock = threading.Lock()
+        self.invalidations = 0
+
+    def result_key(self, query, k, diversify_sources, date_from, date_to, index_version, sources=None,
+                   companies=None, types=None):
+        """Builds the result key; a new index version drops every cached result first."""
+        with self._lock:
+            if index_version != self._version:
+                if self._version is not None:
+                    self.results.clear()
+                    self.invalidations += 1
+                self._version = index_version
+        values = tuple(tuple(sorted({v.strip().lower() for v in f})) if f else () for f in (sources, companies, types))
+        return (normalize_query(query), k, bool(diversify_sources), date_from or "", date_to or "", index_version) + values
+
+    def embedding_key(self, query):
+        return re.sub(r"\s+", " ", query).strip()
+
+    def summary(self):
+        return {"query_embeddings": self.embeddings.summary(), "query_results": self.results.summary(),
+                "index_version": self._version, "invalidations": self.invalidations}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache():
+    """Process-wide QueryCache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = QueryCache()
+    return _cache
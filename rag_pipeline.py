@@ -1,13 +1,7 @@
 # Assuming necessary imports for your RAG pipeline components
 # Ensure these libraries are installed:
 # pip install langchain-community faiss-cpu sentence-transformers
-from data_loader import fetch_arxiv, fetch_pubmed, fetch_ssrn, fetch_ai_companies
-from cache_loader import load_cached_documents
-import asyncio
-from async_data_loader import fetch_all_sources
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 
 # Import the async gemini_query function from your updated gemini_client.py
@@ -18,298 +12,216 @@ from gemini_client import gemini_query # This should now be async def
 # If your DeepSeek function is async, you'll need to await it below.
 # from openrouter_client import openrouter_query # Assuming synchronous function
 
+import asyncio
 import os
-import json
 import logging
-from typing import List # Import List for type hinting
+import threading
+from typing import List, Tuple # Import List/Tuple for type hinting
+
+import numpy as np
+
+from embedding_service import get_embedding_service
+from faiss_index_types import load_search_index
+from lexical_index import reciprocal_rank_fusion
+from metadata_index import matches as metadata_matches
+from segments import SegmentedIndex, open_segments
+from snapshots import SnapshotManager
+from vector_store import open_vectorstore, store_fingerprint
+from query_cache import get_query_cache
+from ranking import mmr, rank
+from reranker import get_reranker
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# --- Indexing Part ---
-# This part runs when the script is imported, typically on startup.
-# It loads data, splits it, creates embeddings, and builds/loads the FAISS index.
-# Ensure your data_loader functions (fetch_arxiv, fetch_pubmed, fetch_ssrn) are synchronous
-# and return data in the expected format, including relevant metadata like 'published_date' and 'url'.
-try:
-    os.makedirs("faiss_index", exist_ok=True)
-
-    all_docs = []
-    # --- Load cached documents ---
-    cached_docs = load_cached_documents()
-    logging.info(f"Loaded {len(cached_docs)} cached documents from cache directory.")
-    all_docs.extend(cached_docs)
-
-    # --- Fetch new data from sources ---
-    logging.info("Fetching data from sources...")
-    sources = {
-        "arxiv": fetch_arxiv(),
-        "pubmed": fetch_pubmed(),
-        "ssrn": fetch_ssrn(),
-        "ai_companies": fetch_ai_companies()
-    }
-    logging.info("Data fetching complete.")
-
-    logging.info("Creating Langchain Documents from fetched sources...")
-    for source_name, papers in sources.items():
-        for paper in papers:
-            # Ensure paper has 'title', 'summary', and ideally 'published_date', 'url' keys
-            title = paper.get('title', 'No Title')
-            summary = paper.get('summary', 'No Summary')
-            published_date = paper.get('published_date')
-            url = paper.get('url')
-
-            if source_name == 'ai_companies':
-                # For companies, include all enriched fields and lists
-                fields = [
-                    f"Name: {paper.get('name', '')}",
-                    f"Category: {paper.get('category', '')}",
-                    f"Description: {paper.get('description', '')}",
-                    f"Founded: {paper.get('founded', '')}",
-                    f"Founders: {', '.join(paper.get('founders', []))}",
-                    f"Headquarters: {paper.get('headquarters', '')}",
-                    f"CEO: {paper.get('ceo', '')}",
-                    f"Valuation: {paper.get('valuation', '')}",
-                    f"Funding: {paper.get('funding', '')}",
-                    f"Twitter: {paper.get('twitter', '')}",
-                    f"Website: {paper.get('website', '')}",
-                    f"Active Years: {paper.get('active_years', '')}",
-                    f"Top AI Agent in Years: {', '.join(str(y) for y in paper.get('top_in_year', []))}",
-                    f"Latest Blog: {paper.get('latest_blog', {}).get('title', '')} ({paper.get('latest_blog', {}).get('url', '')})",
-                ]
-                # Add products
-                products = paper.get('products', [])
-                if products:
-                    fields.append(f"Products: {', '.join(products)}")
-                # Add notable projects
-                notable_projects = paper.get('notable_projects', [])
-                if notable_projects:
-                    fields.append(f"Notable Projects: {', '.join(notable_projects)}")
-                # Add resources (news, research, etc.)
-                resources = paper.get('resources', [])[:200]
-                if resources:
-                    fields.append("Resources:")
-                    for res in resources:
-                        res_title = res.get('title', '')
-                        res_url = res.get('url', '')
-                        res_summary = res.get('summary', '') if 'summary' in res else ''
-                        # Add a detailed, dedicated Document for each resource
-                        resource_content = f"Resource Title: {res_title}\nResource URL: {res_url}\nParent: {paper.get('name', '')}\nCategory: {paper.get('category', '')}"
-                        if res_summary:
-                            resource_content += f"\nSummary: {res_summary}"
-                        resource_metadata = {
-                            "source": source_name,
-                            "title": res_title,
-                            "url": res_url,
-                            "parent": paper.get('name', ''),
-                            "category": paper.get('category', '')
-                        }
-                        all_docs.append(Document(page_content=resource_content, metadata=resource_metadata))
-                        # Also include in the parent chunk
-                        if res_summary:
-                            fields.append(f"- {res_title} ({res_url})\n  Summary: {res_summary}")
-                        else:
-                            fields.append(f"- {res_title} ({res_url})")
-                content = "\n".join([f for f in fields if f and f != '()'])
-            else:
-                content = f"Title: {title}\n\nSummary: {summary}"
-
-            metadata = {"source": source_name, "title": title}
-            if published_date:
-                metadata['published_date'] = published_date
-            if url:
-                metadata['url'] = url
-
-            doc = Document(page_content=content, metadata=metadata)
-            all_docs.append(doc)
-
-    # Fetch and add async resources from additional sources
-    # To increase document count, raise max_docs below (e.g., 2000, 5000)
-    # Async fetch moved to FastAPI startup event. See main.py for ingestion.
-    pass
-
-    # Deduplicate all_docs by URL (prefer most recent)
-    seen_urls = set()
-    deduped_docs = []
-    for doc in all_docs:
-        url = doc.metadata.get("url", "")
-        if url and url not in seen_urls:
-            deduped_docs.append(doc)
-            seen_urls.add(url)
-        elif not url:
-            deduped_docs.append(doc)  # Always include docs with no URL (e.g., static or malformed)
-    logging.info(f"Deduplicated to {len(deduped_docs)} unique documents (by URL).")
-
-    logging.info("Splitting documents...")
-    splitter = RecursiveCharacterTextSplitter(chunk_size=2500, chunk_overlap=300)
-    texts = splitter.split_documents(deduped_docs)
-    logging.info(f"Split into {len(texts)} chunks.")
-
-    # Define the path for the FAISS index
-    faiss_index_path = "faiss_index"
-
-    # Check if index already exists to avoid re-indexing every time
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    if os.path.exists(faiss_index_path):
-        logging.info("Loading existing FAISS index...")
+# --- Index Access ---
+# Indexing lives in indexer.py (`python -m indexer build-index`); importing this module has no side effects.
+# The API only opens the prebuilt index, lazily on first use and read-only.
+FAISS_INDEX_PATH = "faiss_index"
+
+# Each build publishes an immutable snapshot and flips faiss_index/CURRENT (snapshots.py). The query path only
+# stats CURRENT; when it changes, one caller opens the new snapshot while the others keep answering from the
+# current one, then the (version, store) pair is replaced in a single assignment. Requests take the pair once
+# (live_index) and finish on the store they started with, keyed by its own version.
+_snapshots = SnapshotManager(FAISS_INDEX_PATH)
+_live = (None, None)  # (snapshot version, vectorstore)
+_live_stamp = None
+_reload_lock = threading.Lock()
+
+
+def _open_snapshot(path):
+    # Memory-mapped index + on-disk docstore (vector_store.py); indexes built before docstore.db
+    # existed are unpickled as before until the next build writes it.
+    vectorstore = open_vectorstore(path, get_embedding_service())
+    if vectorstore is None:
         # allow_dangerous_deserialization is needed for loading FAISS indexes
-        vectorstore = FAISS.load_local(faiss_index_path, embeddings, allow_dangerous_deserialization=True)
-        logging.info("FAISS index loaded.")
-    else:
-        logging.info("Creating new FAISS index...")
-        vectorstore = FAISS.from_documents(texts, embeddings)
-        vectorstore.save_local(faiss_index_path)
-        logging.info("FAISS index created and saved.")
-
-    # Save metadata (optional, but good for tracking sources)
-    metadata_list = [{"title": doc.metadata.get("title", "N/A"),
-                      "source": doc.metadata.get("source", "N/A"),
-                      "published_date": doc.metadata.get("published_date", "N/A"),
-                      "url": doc.metadata.get("url", "N/A")} for doc in all_docs]
-    metadata_path = "faiss_index/metadata.json"
-    with open(metadata_path, "w") as f:
-        json.dump(metadata_list, f, indent=2)
-    logging.info(f"Metadata saved to {metadata_path}")
-
-    print("Indexing complete!")
-
-except Exception as e:
-    logging.error(f"Error during indexing process: {e}", exc_info=True)
-    # Handle the error appropriately, maybe exit or set a flag
-    vectorstore = None # Ensure vectorstore is None if indexing fails
-    print("Indexing failed!")
+        vectorstore = FAISS.load_local(path, get_embedding_service(), allow_dangerous_deserialization=True)
+    # Search through the HNSW / IVF index built for these vectors, if there is one (faiss_index_types.py).
+    search_index = load_search_index(path, store_fingerprint(vectorstore))
+    if search_index is not None:
+        vectorstore.index = search_index
+    # The base plus the delta segments appended since it was written, searched as one index (segments.py).
+    return open_segments(vectorstore, path, get_embedding_service())
+
+
+def _reload(stamp):
+    global _live, _live_stamp
+    version, path = _snapshots.current()
+    if version is not None and version != _live[0] and os.path.exists(os.path.join(path, "index.faiss")):
+        logging.info(f"Loading FAISS index snapshot {version}...")
+        try:
+            _live = (version, _open_snapshot(path))
+            logging.info(f"FAISS index snapshot {version} loaded.")
+        except Exception as e:
+            # The stamp stays behind, so the next call tries the snapshot again.
+            logging.error(f"Failed to open index snapshot {version}; still serving {_live[0]}: {e}", exc_info=True)
+            return
+    _live_stamp = stamp
+
+
+def live_index():
+    """
+    Returns the live (snapshot version, FAISS index snapshot) pair, opening it on first call and swapping to newer
+    snapshots as they are published. Never blocks once a snapshot is loaded. Returns (None, None) (and retries
+    on the next call) when no index has been built yet. Take it once per request: the version keys the query
+    result cache for that store.
+    """
+    stamp = _snapshots.pointer_stamp()
+    if stamp is not None and stamp != _live_stamp:
+        # Only the first load waits; afterwards, callers that lose the race keep using the current snapshot.
+        if _reload_lock.acquire(blocking=_live[1] is None):
+            try:
+                if stamp != _live_stamp:
+                    _reload(stamp)
+            finally:
+                _reload_lock.release()
+    return _live
+
+
+def get_vectorstore():
+    """The live FAISS index snapshot (see live_index), or None when no index has been built yet."""
+    return live_index()[1]
+
+
+def embed_query_cached(query: str) -> List[float]:
+    """Query embedding through the query embedding cache (level 1 of query_cache)."""
+    cache = get_query_cache()
+    key = cache.embedding_key(query)
+    vector = cache.embeddings.get(key)
+    if vector is None:
+        vector = get_embedding_service().embed_query(query)
+        cache.embeddings.put(key, vector)
+    return vector
+
+
+async def aembed_query_cached(query: str) -> List[float]:
+    """Async embed_query_cached; a miss is embedded on the embedding service's executor."""
+    cache = get_query_cache()
+    key = cache.embedding_key(query)
+    vector = cache.embeddings.get(key)
+    if vector is None:
+        vector = await get_embedding_service().aembed_query(query)
+        cache.embeddings.put(key, vector)
+    return vector
 
 
 # --- RAG Retrieval Logic ---
 # This function now uses the vectorstore to find relevant context.
-def retrieve_context(query: str, vectorstore: FAISS, k: int = 3, diversify_sources: bool = True, date_from: str = None, date_to: str = None) -> str:
+def select_documents(query: str, vectorstore: SegmentedIndex, k: int = 3, diversify_sources: bool = True, date_from: str = None, date_to: str = None, query_embedding: List[float] = None, sources: List[str] = None, companies: List[str] = None, types: List[str] = None) -> Tuple[List[Document], bool]:
     """
-    Advanced RAG context retrieval: deduplicate, diversify, enrich metadata, allow dynamic k.
+    Search + temporal/AI filtering, dedup, optional cross-encoder re-ranking, MMR diversity and the final order.
+    Returns the final ordered documents for the prompt, and whether they may be cached: False when the
+    re-ranker is on but skipped this query (under load), so the cheap ordering is not pinned in the result cache.
     """
-    if vectorstore is None:
-        logging.error("Vectorstore is not initialized. Cannot retrieve context.")
-        return f"User Query: {query}\n\nRelevant Context:\nError: Vectorstore not available."
-    try:
-        logging.info(f"Performing similarity search for query: {query}")
-        # Increased k for more context (default k=6, so 36 chunks)
-        docs: List[Document] = vectorstore.similarity_search(query, k=k*6) # get more for dedup/diversity
-
-        # --- Temporal Filtering (if requested) ---
-        if date_from or date_to:
-            from datetime import datetime
-            def in_range(doc):
-                date_str = doc.metadata.get('published_date', '')
-                try:
-                    date = datetime.fromisoformat(date_str[:19]) if date_str else None
-                except Exception:
-                    date = None
-                if date_from and date:
-                    if date < datetime.fromisoformat(date_from):
-                        return False
-                if date_to and date:
-                    if date > datetime.fromisoformat(date_to):
-                        return False
-                return True
-            docs = [doc for doc in docs if in_range(doc)]
-
-        # --- Expanded AI-Related Keywords ---
-        global keywords
-        # --- AI-Related Filtering ---
-        def is_ai_related(text):
-            text_lower = text.lower()
-            keywords = ["ai","artificial intelligence","machine learning","llm","agent","agents","company","companies"]
-            return any(kw in text_lower for kw in keywords)
-        filtered_docs = [doc for doc in docs if is_ai_related(doc.page_content) or is_ai_related(doc.metadata.get('title', ''))]
-        logging.info(f"AI-related docs found: {len(filtered_docs)} / {len(docs)} for query: '{query}'")
-
-        # Fallback: if too few, use keyword overlap
-        if len(filtered_docs) < k:
-            scored = []
-            query_terms = set(query.lower().split())
-            for doc in docs:
-                doc_text = doc.page_content.lower() + ' ' + doc.metadata.get('title', '').lower()
-                score = sum(1 for term in query_terms if term in doc_text)
-                scored.append((score, doc))
-            scored.sort(reverse=True, key=lambda x: x[0])
-            fallback_docs = [doc for score, doc in scored if score > 0][:k]
-            if len(fallback_docs) < k:
-                fallback_docs = docs[:k]
-            filtered_docs = filtered_docs + [doc for doc in fallback_docs if doc not in filtered_docs]
-        # Pass more context to the model (up to k*4, e.g., 24 chunks)
-        filtered_docs = filtered_docs[:k*4]
-        if not filtered_docs:
-            docs_sorted = sorted(docs, key=lambda d: d.metadata.get('published_date', ''), reverse=True)
-            filtered_docs = docs_sorted[:k]
-
-        # Deduplicate by title+source
-        seen = set()
-        deduped_docs = []
-        for doc in filtered_docs:
-            key = (doc.metadata.get('title', '').strip().lower(), doc.metadata.get('source', '').strip().lower())
-            if key in seen:
-                continue
-            seen.add(key)
-            deduped_docs.append(doc)
-
-        # Source diversity: try to balance sources
-        if diversify_sources:
-            by_source = {}
-            for doc in deduped_docs:
-                src = doc.metadata.get('source', 'unknown')
-                by_source.setdefault(src, []).append(doc)
-            selected = []
-            while len(selected) < k and any(by_source.values()):
-                for src in list(by_source.keys()):
-                    if by_source[src]:
-                        selected.append(by_source[src].pop(0))
-                    if len(selected) >= k:
-                        break
-            docs_final = selected
-        else:
-            docs_final = deduped_docs[:k]
-        logging.info(f"Selected {len(docs_final)} documents after source diversity.")
+    logging.info(f"Performing similarity search for query: {query}")
+    # Increased k for more context (default k=6, so 36 chunks)
+    if query_embedding is None:
+        query_embedding = embed_query_cached(query)
 
-        # Boost by recency and query keyword match
-        from datetime import datetime
-        def parse_date(date_str):
-            from datetime import datetime
-            try:
-                # Try ISO format
-                return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-            except Exception:
-                # Try YYYY-MM-DD or YYYY/MM/DD
-                import re
-                m = re.match(r'(\d{4})[-/](\d{2})[-/](\d{2})', date_str or '')
-                if m:
-                    try:
-                        return datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)))
-                    except Exception:
-                        pass
-                # If still fails, return a safe default (1970-01-01)
-                return datetime(1970, 1, 1)
-        def boost_score(doc):
-            score = 0
-            title = doc.metadata.get('title', '').lower()
-            content = doc.page_content.lower()
-            query_keywords = [w.lower() for w in query.split() if len(w) > 2]
-            if any(qk in title or qk in content for qk in query_keywords):
-                score += 2
-            date_str = doc.metadata.get('published_date', '')
-            try:
-                date_val = parse_date(date_str)
-                score += (date_val.timestamp()) / 1e12
-            except Exception:
-                score += 0
-            return score
-        docs_final.sort(key=boost_score, reverse=True)
-
-        # Format context for LLM: detailed, clear, always with title/source/url
-        context_blocks = []
-        for idx, doc in enumerate(docs_final):
-            context_blocks.append(f"--- Document {idx+1} ---\nTitle: {doc.metadata.get('title', 'N/A')}\nSource: {doc.metadata.get('source', 'N/A')}\nPublished: {doc.metadata.get('published_date', 'N/A')}\nURL: {doc.metadata.get('url', 'N/A')}\nContent: {doc.page_content}")
-        context_str = "\n\n".join(context_blocks)
-        # Compose the prompt to instruct for detailed, comprehensive answers
-        prompt = f"""
+    # --- Metadata Filtering (date/source/company/type) ---
+    # Pushed down into the FAISS search through the metadata index, so a narrow filter still yields k*6 chunks;
+    # stores without one (legacy pickled index) filter the search results instead.
+    filters = dict(date_from=date_from, date_to=date_to, sources=sources, companies=companies, types=types)
+    docs: List[Document] = vectorstore.similarity_search_filtered(query_embedding, k*6, **filters)
+    if docs is not None:
+        logging.info(f"Filtered search: {len(docs)} results")
+    else:
+        docs = vectorstore.similarity_search_by_vector(query_embedding, k=k*6) # get more for dedup/diversity
+        if any(filters.values()):
+            docs = [doc for doc in docs if metadata_matches(doc.metadata, **filters)]
+
+    # --- Hybrid Retrieval: BM25 hits from the lexical index, fused with the vector hits (RRF) ---
+    lexical_ids = set()
+    if vectorstore.has_lexical:
+        lexical_docs = vectorstore.lexical_search(query, k*6 if not any(filters.values()) else k*24)
+        if any(filters.values()):
+            lexical_docs = [doc for doc in lexical_docs if metadata_matches(doc.metadata, **filters)]
+        docs = reciprocal_rank_fusion([docs, lexical_docs[:k*6]], key=lambda doc: doc.id or id(doc), limit=k*6)
+        lexical_ids = {doc.id for doc in lexical_docs}
+        logging.info(f"Hybrid retrieval: fused {len(lexical_docs[:k*6])} BM25 hits into {len(docs)} candidates")
+
+    # --- Ranking features (AI-topic flag, title tokens, timestamp, length), precomputed per chunk; see ranking.py ---
+    features = vectorstore.ranking_features(docs)
+
+    # --- AI-Related Filtering ---
+    ai_related = features["ai_topic"]
+    filtered = np.flatnonzero(ai_related).tolist()
+    logging.info(f"AI-related docs found: {len(filtered)} / {len(docs)} for query: '{query}'")
+
+    # Fallback: if too few, top up with the best remaining candidates (already ranked by BM25 + vector fusion)
+    if len(filtered) < k:
+        filtered += np.flatnonzero(~ai_related)[:k - len(filtered)].tolist()
+    # Pass more context to the model (up to k*4, e.g., 24 chunks)
+    filtered = filtered[:k*4]
+
+    # Deduplicate by title+source
+    seen = set()
+    deduped = []
+    for i in filtered:
+        metadata = docs[i].metadata
+        key = (metadata.get('title', '').strip().lower(), metadata.get('source', '').strip().lower())
+        if key in seen:
+            continue
+        seen.add(key)
+        deduped.append(i)
+
+    # Optional cross-encoder re-ranking (reranker.py): None when it is off or skipped under load
+    reranker = get_reranker()
+    relevance = reranker.score(query, [docs[i].page_content for i in deduped]) if reranker is not None and deduped else None
+
+    # Diversity: maximal marginal relevance over the candidates' stored vectors (ranking.mmr), so near-duplicate
+    # chunks do not crowd the prompt; MMR_MAX_PER_SOURCE optionally caps each source.
+    vectors = vectorstore.vectors([docs[i] for i in deduped]) if diversify_sources else None
+    if vectors is not None:
+        picks = mmr(query_embedding, vectors, k, sources=[docs[i].metadata.get('source', 'unknown') for i in deduped],
+                    relevance=relevance)
+        selected = [deduped[p] for p in picks]
+    elif relevance is not None:
+        selected = [deduped[p] for p in np.argsort(-relevance, kind="stable")[:k]]
+    else:
+        selected = deduped[:k]
+    logging.info(f"Selected {len(selected)} documents after diversification.")
+
+    # Final order: cross-encoder relevance when available, else recency and query keyword match (title tokens,
+    # or a BM25 hit on the chunk text)
+    if relevance is not None:
+        relevance_of = dict(zip(deduped, relevance))
+        selected.sort(key=lambda i: -relevance_of[i])
+        return [docs[i] for i in selected], True
+    selected = np.array(selected, dtype=np.int64)
+    matched = np.array([docs[i].id in lexical_ids for i in selected], dtype=bool)
+    order = rank({name: values[selected] for name, values in features.items()}, query, matched)
+    return [docs[i] for i in selected[order]], reranker is None or not deduped
+
+
+def format_context_prompt(query: str, docs_final: List[Document]) -> str:
+    # Format context for LLM: detailed, clear, always with title/source/url
+    context_blocks = []
+    for idx, doc in enumerate(docs_final):
+        context_blocks.append(f"--- Document {idx+1} ---\nTitle: {doc.metadata.get('title', 'N/A')}\nSource: {doc.metadata.get('source', 'N/A')}\nPublished: {doc.metadata.get('published_date', 'N/A')}\nURL: {doc.metadata.get('url', 'N/A')}\nContent: {doc.page_content}")
+    context_str = "\n\n".join(context_blocks)
+    # Compose the prompt to instruct for detailed, comprehensive answers
+    prompt = f"""
 Research Context:
 {context_str}
 
@@ -323,28 +235,67 @@ Instructions:
 - Write clearly and thoroughly, not just a summary.
 Answer:
 """
-        return prompt
+    return prompt
+
+
+def retrieve_context(query: str, vectorstore: SegmentedIndex, k: int = 3, diversify_sources: bool = True, date_from: str = None, date_to: str = None, query_embedding: List[float] = None, sources: List[str] = None, companies: List[str] = None, types: List[str] = None, index_version: str = None) -> str:
+    """
+    Advanced RAG context retrieval: deduplicate, diversify, enrich metadata, allow dynamic k.
+    Pass `query_embedding` (from the embedding service's async API) to skip embedding the query here.
+    The selected documents are cached per (normalized query, k, filters, index version) when `index_version`,
+    the snapshot version `vectorstore` was taken with (live_index), is given; see query_cache.py.
+    """
+    if vectorstore is None:
+        logging.error("Vectorstore is not initialized. Cannot retrieve context.")
+        return f"User Query: {query}\n\nRelevant Context:\nError: Vectorstore not available."
+    try:
+        cache = get_query_cache()
+        key = None
+        docs_final = None
+        if index_version is not None:
+            key = cache.result_key(query, k, diversify_sources, date_from, date_to, index_version, sources, companies, types)
+            docs_final = cache.results.get(key)
+        if docs_final is None:
+            docs_final, cacheable = select_documents(query, vectorstore, k, diversify_sources, date_from, date_to,
+                                                     query_embedding, sources, companies, types)
+            if cacheable and key is not None:
+                cache.results.put(key, docs_final)
+        else:
+            logging.info(f"Query result cache hit for: {query}")
+        return format_context_prompt(query, docs_final)
     except Exception as e:
         logging.error(f"Error during context retrieval: {e}", exc_info=True)
         return f"User Query: {query}\n\nRelevant Context:\nError during retrieval: {e}"
 
 # --- Answer fetching part ---
 # This function must be async because it calls async functions (like gemini_query)
-async def get_research_answer(query: str, model: str) -> str:
+async def get_research_answer(query: str, model: str, date_from: str = None, date_to: str = None, sources: List[str] = None, companies: List[str] = None, types: List[str] = None) -> str:
     """
     Fetches a research answer using the specified model after retrieving context.
     Args:
         query: The user's original query.
         model: The name of the model to use ("gemini" or "deepseek").
+        date_from, date_to, sources, companies, types: Optional metadata filters for retrieval.
     Returns:
         The answer generated by the model (string), or an error message (string).
     """
     logging.info(f"Received query for model: {model}")
-    if 'vectorstore' not in globals() or vectorstore is None:
+    # First call loads the index from disk; keep that off the event loop.
+    version, vectorstore = await asyncio.to_thread(live_index)
+    if vectorstore is None:
         logging.error("Vectorstore is not available. Cannot process query.")
         return "Error: Research index not available. Please check backend startup logs."
+    # Embed on the embedding service's executor, not on the event loop (skipped when the results are cached)
+    cache = get_query_cache()
+    query_embedding = None
+    if cache.result_key(query, 3, True, date_from, date_to, version, sources, companies, types) not in cache.results:
+        query_embedding = await aembed_query_cached(query)
     # Use more context and instruct for detailed answer in the prompt
-    rag_prompt_with_context = retrieve_context(query, vectorstore)
+    # Off the event loop too: the optional cross-encoder pass is CPU-bound
+    rag_prompt_with_context = await asyncio.to_thread(retrieve_context, query, vectorstore, date_from=date_from,
+                                                      date_to=date_to, query_embedding=query_embedding,
+                                                      sources=sources, companies=companies, types=types,
+                                                      index_version=version)
     logging.info("Context retrieval step completed.")
     try:
         if model == "gemini":
@@ -362,4 +313,10 @@ async def get_research_answer(query: str, model: str) -> str:
             return "Unsupported model selected."
     except Exception as e:
         logging.error(f"Error in get_research_answer: {e}", exc_info=True)
-        return f"An error occurred while fetching the answer: {e}"
\ No newline at end of file
+        return f"An error occurred while fetching the answer: {e}"
+
+
+if __name__ == "__main__":
+    # Kept for `python rag_pipeline.py`; same as `python -m indexer build-index`.
+    from indexer import main
+    raise SystemExit(main(["build-index"]))
@@ -0,0 +1,202 @@
+"""
+ranking.py
+- Final ordering of the chunks chosen by rag_pipeline.select_documents, scored in one numpy pass over ranking
+  features precomputed per chunk at build time (metadata_index.chunk_features: publication timestamp, AI-topic
+  flag, lowercased title tokens, text length) and gathered by vector id (SegmentedIndex.ranking_features).
+- score = 2 when a query keyword appears in the title or the chunk is a BM25 hit for the query (the lexical index
+  already matched its text, so the chunk text is not lowercased and scanned per query), plus timestamp / 1e12
+  as the recency boost (undated chunks get none). Equal scores go to the longer chunk, then retrieval order.
+- mmr() picks the k chunks of the prompt from the candidates by maximal marginal relevance over their stored
+  vectors (SegmentedIndex.vectors; nothing is re-embedded): one matrix product gives every query and pairwise
+  cosine similarity, then each step takes the candidate maximizing
+  MMR_LAMBDA * sim(query, c) - (1 - MMR_LAMBDA) * max sim(c, already picked), so near-identical chunks do
+  not all make the cut whatever their source. MMR_MAX_PER_SOURCE (0 = off) caps the picks per source.
+- `python -m ranking bench` measures the per-query CPU time of the previous per-document Python scoring
+  (lowercase + substring scan of every chunk, date parsing) against feature gathering + the vectorized pass,
+  and of mmr().
+"""
+import argparse
+import logging
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+from langchain.schema import Document
+
+from metadata_index import MetadataIndex, is_ai_related, tokens
+
+# Relevance vs. novelty trade-off of mmr(): 1 ranks by query similarity alone, 0 by novelty alone.
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Most chunks mmr() takes from one source (0 = no cap); lifted once only capped sources have candidates left.
+MMR_MAX_PER_SOURCE = int(os.getenv("MMR_MAX_PER_SOURCE", "0"))
+
+
+def query_keywords(query):
+    """Lowercased query tokens longer than two characters."""
+    return [token for token in tokens(query).split() if len(token) > 2]
+
+
+def keyword_hits(title_tokens, keywords):
+    """Boolean array: whether any of `keywords` occurs in each title (substring of the title tokens)."""
+    hits = np.zeros(len(title_tokens), dtype=bool)
+    if len(title_tokens) and keywords:
+        titles = np.asarray(title_tokens, dtype=str)
+        for keyword in keywords:
+            hits |= np.char.find(titles, keyword) >= 0
+    return hits
+
+
+def scores(features, query, matched=None):
+    """Keyword/BM25 boost plus recency of every candidate (`matched`: boolean array of BM25 hits)."""
+    boost = keyword_hits(features["title_tokens"], query_keywords(query))
+    if matched is not None:
+        boost |= matched
+    return 2.0 * boost + np.nan_to_num(features["timestamp"], nan=0.0) / 1e12
+
+
+def rank(features, query, matched=None):
+    """Candidate positions, best first."""
+    n = len(features["timestamp"])
+    return np.lexsort((np.arange(n), -features["length"].astype(np.int64), -scores(features, query, matched)))
+
+
+def mmr(query_vector, vectors, k, lambda_mult=MMR_LAMBDA, sources=None, max_per_source=MMR_MAX_PER_SOURCE,
+        relevance=None):
+    """
+    Positions of up to k of the candidate `vectors` ((n, dim) array, in relevance order) chosen by maximal
+    marginal relevance to `query_vector`, in pick order. `sources` (one per candidate) enables the per-source cap;
+    `relevance` (e.g. cross-encoder scores, min-max scaled here) replaces the query similarity.
+    """
+    n = len(vectors)
+    if not n or k <= 0:
+        return []
+    matrix = np.vstack([np.asarray(query_vector, dtype=np.float32), np.asarray(vectors, dtype=np.float32)])
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    similarity = matrix[1:] @ matrix.T
+    pairwise = similarity[:, 1:]
+    if relevance is None:
+        relevance = similarity[:, 0]
+    else:
+        relevance = np.asarray(relevance, dtype=np.float32)
+        relevance = (relevance - relevance.min()) / max(float(np.ptp(relevance)), 1e-12)
+    redundancy = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    codes = None
+    if max_per_source and sources is not None:
+        _, codes = np.unique(np.asarray(sources, dtype=str), return_inverse=True)
+        per_source = np.zeros(codes.max() + 1, dtype=np.int64)
+    picked = []
+    for step in range(min(k, n)):
+        candidates = available
+        if codes is not None:
+            uncapped = available & (per_source[codes] < max_per_source)
+            if uncapped.any():
+                candidates = uncapped
+        score = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        best = int(np.argmax(np.where(candidates, score, -np.inf)))
+        picked.append(best)
+        available[best] = False
+        redundancy = pairwise[best] if step == 0 else np.maximum(redundancy, pairwise[best])
+        if codes is not None:
+            per_source[codes[best]] += 1
+    return picked
+
+
+def _legacy_order(docs, query):
+    """The per-document scoring rank() replaced (AI filter + keyword/recency boost), kept for the benchmark."""
+    docs = [doc for doc in docs if is_ai_related(doc.page_content) or is_ai_related(doc.metadata.get("title", ""))]
+
+    def parse_date(date_str):
+        try:
+            return datetime.fromisoformat(date_str.replace("Z", "+00:00"))
+        except Exception:
+            m = re.match(r"(\d{4})[-/](\d{2})[-/](\d{2})", date_str or "")
+            if m:
+                try:
+                    return datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+                except Exception:
+                    pass
+            return datetime(1970, 1, 1)
+
+    def boost_score(doc):
+        score = 0
+        title = doc.metadata.get("title", "").lower()
+        content = doc.page_content.lower()
+        if any(qk in title or qk in content for qk in [w.lower() for w in query.split() if len(w) > 2]):
+            score += 2
+        try:
+            score += parse_date(doc.metadata.get("published_date", "")).timestamp() / 1e12
+        except Exception:
+            pass
+        return score
+    return sorted(docs, key=boost_score, reverse=True)
+
+
+def _sample_candidates(n, text_chars):
+    rng = random.Random(0)
+    words = ["model", "agents", "inference", "training", "robotics", "policy", "chips", "benchmark", "data",
+             "research", "startup", "language", "vision", "safety", "ai", "cloud", "open", "source"]
+    docs = []
+    for i in range(n):
+        text = " ".join(rng.choice(words) for _ in range(text_chars // 7))[:text_chars]
+        date = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T10:00:00Z" if i % 5 else ""
+        docs.append(Document(page_content=text, id=f"chunk-{i}",
+                             metadata={"title": " ".join(rng.choice(words).title() for _ in range(6)),
+                                       "published_date": date, "source": f"source-{i % 7}"}))
+    return docs
+
+
+def benchmark(candidates=36, queries=200, text_chars=1000):
+    """
+    Mean per-query CPU milliseconds of the legacy scoring, of feature gathering + rank(), and of mmr() over
+    the candidates' vectors (random 384-d ones, the embedding size).
+    """
+    docs = _sample_candidates(candidates, text_chars)
+    table = MetadataIndex.build([doc.metadata for doc in docs], ids=[doc.id for doc in docs],
+                                texts=[doc.page_content for doc in docs])
+    query_list = [f"latest agents research {i}" for i in range(queries)]
+
+    def vectorized(query):
+        positions = [table.position(doc.id) for doc in docs]
+        features = table.features(positions)
+        keep = np.flatnonzero(features["ai_topic"])
+        features = {name: values[keep] for name, values in features.items()}
+        return [docs[keep[i]] for i in rank(features, query)]
+
+    results = {"candidates": candidates, "queries": queries}
+    for name, run in (("legacy", lambda q: _legacy_order(docs, q)), ("vectorized", vectorized)):
+        run(query_list[0])
+        start = time.process_time()
+        for query in query_list:
+            run(query)
+        results[f"{name}_ms_per_query"] = round((time.process_time() - start) * 1000 / queries, 4)
+    vectors = np.random.default_rng(0).standard_normal((candidates + 1, 384)).astype(np.float32)
+    sources = [doc.metadata["source"] for doc in docs]
+    start = time.process_time()
+    for _ in range(queries):
+        mmr(vectors[0], vectors[1:], 6, sources=sources, max_per_source=2)
+    results["mmr_ms_per_query"] = round((time.process_time() - start) * 1000 / queries, 4)
+    results["speedup"] = round(results["legacy_ms_per_query"] / max(results["vectorized_ms_per_query"], 1e-9), 2)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m ranking", description="Re-ranking tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="Per-query CPU time of legacy vs vectorized re-ranking, and of MMR.")
+    bench.add_argument("--candidates", type=int, default=36)
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("--text-chars", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    print(benchmark(args.candidates, args.queries, args.text_chars))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
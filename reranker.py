@@ -0,0 +1,159 @@
+"""
+reranker.py
+- Optional re-ranking stage of the query path: scores (query, chunk) pairs with a small cross-encoder on CPU
+  and hands rag_pipeline.select_documents a relevance score per candidate, which drives the MMR selection
+  (ranking.mmr) and the final order in place of the keyword/recency boost.
+- Off unless RERANKER is set: "cross-encoder" (sentence-transformers CrossEncoder, RERANK_MODEL) or
+  "module:factory" for any other scorer, a callable returning an object with score(query, texts) -> floats.
+- All uncached pairs of a query go through the model in one batched forward pass. Pair scores are cached in an
+  LRU keyed by a hash of (model, normalized query, chunk text), so repeated questions cost no inference.
+- RERANK_BUDGET_MS: before scoring, the stage estimates the pass from the measured per-pair time and skips
+  re-ranking (the caller keeps the vector/BM25 order) when it would not fit, or when RERANK_CONCURRENCY passes
+  are already running, so under load queries degrade to the cheap ordering instead of queueing on the CPU.
+  The estimate decays on every skip, so the stage measures again once the load has passed.
+"""
+import hashlib
+import importlib
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from query_cache import TTLCache, normalize_query
+
+# "" / "none" (off), "cross-encoder", or "module:factory".
+RERANKER = os.getenv("RERANKER", "none")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_CONCURRENCY = int(os.getenv("RERANK_CONCURRENCY", "1"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "50000"))
+RERANK_CACHE_TTL = float(os.getenv("RERANK_CACHE_TTL", "86400"))
+# Weight of a new measurement in the moving average of the per-pair inference time.
+_EWMA_WEIGHT = 0.2
+_SKIP_DECAY = 0.9
+
+
+class CrossEncoderScorer:
+    """sentence-transformers CrossEncoder on CPU; one predict() call per query."""
+
+    def __init__(self, model_name=RERANK_MODEL, max_length=RERANK_MAX_LENGTH):
+        from sentence_transformers import CrossEncoder
+        self.name = model_name
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+
+    def score(self, query, texts):
+        return self.model.predict([(query, text) for text in texts], batch_size=max(1, len(texts)),
+                                  show_progress_bar=False)
+
+
+def create_scorer(name=RERANKER):
+    """The configured scorer, or None when re-ranking is off or the scorer cannot be loaded."""
+    if not name or name.lower() == "none":
+        return None
+    try:
+        if name == "cross-encoder":
+            return CrossEncoderScorer()
+        module, _, factory = name.partition(":")
+        return getattr(importlib.import_module(module), factory or "create_scorer")()
+    except Exception as e:
+        logging.warning(f"[Reranker] {name} unavailable ({e}); re-ranking is off.")
+        return None
+
+
+class RerankStage:
+    """A scorer with the pair score cache, the latency budget and call statistics."""
+
+    def __init__(self, scorer, budget_ms=RERANK_BUDGET_MS, concurrency=RERANK_CONCURRENCY):
+        self.scorer = scorer
+        self.name = getattr(scorer, "name", type(scorer).__name__)
+        self.budget_ms = float(budget_ms)
+        self.cache = TTLCache(RERANK_CACHE_SIZE, RERANK_CACHE_TTL)
+        self._slots = threading.BoundedSemaphore(max(1, int(concurrency)))
+        self._lock = threading.Lock()
+        self.ms_per_pair = None
+        self.stats = {"queries": 0, "pairs_scored": 0, "skipped_budget": 0, "skipped_busy": 0, "errors": 0,
+                      "seconds": 0.0}
+
+    def _key(self, query, text):
+        return hashlib.sha1(f"{self.name}\0{query}\0{text}".encode("utf-8")).hexdigest()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def score(self, query, texts):
+        """
+        Relevance score of every text for `query` (float array aligned with `texts`; higher is better), or None
+        when re-ranking is skipped for this query (over budget, the scorer is busy, or it failed).
+        """
+        self._count("queries")
+        query = normalize_query(query)
+        keys = [self._key(query, text) for text in texts]
+        scores = np.array([self.cache.get(key, np.nan) for key in keys], dtype=np.float64)
+        todo = np.flatnonzero(np.isnan(scores))
+        if not len(todo):
+            return scores
+        if self.budget_ms > 0 and self.ms_per_pair is not None and self.ms_per_pair * len(todo) > self.budget_ms:
+            with self._lock:
+                self.stats["skipped_budget"] += 1
+                # Decay the estimate while skipping, so a slow spell does not disable re-ranking for good.
+                self.ms_per_pair *= _SKIP_DECAY
+            return None
+        if not self._slots.acquire(blocking=False):
+            self._count("skipped_busy")
+            return None
+        try:
+            start = time.perf_counter()
+            scored = np.asarray(self.scorer.score(query, [texts[i] for i in todo]), dtype=np.float64).reshape(-1)
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            logging.warning(f"[Reranker] Scoring failed ({e}); keeping the retrieval order.")
+            self._count("errors")
+            return None
+        finally:
+            self._slots.release()
+        with self._lock:
+            per_pair = elapsed * 1000 / len(todo)
+            self.ms_per_pair = per_pair if self.ms_per_pair is None else \
+                (1 - _EWMA_WEIGHT) * self.ms_per_pair + _EWMA_WEIGHT * per_pair
+            self.stats["pairs_scored"] += len(todo)
+            self.stats["seconds"] += elapsed
+        for i, value in zip(todo, scored):
+            scores[i] = value
+            self.cache.put(keys[i], float(value))
+        return scores
+
+    def warmup(self):
+        """Loads the model fully with one pass (not counted against the budget estimate)."""
+        start = time.perf_counter()
+        self.scorer.score("warmup", ["warmup"])
+        logging.info(f"[Reranker] {self.name} warmed up in {time.perf_counter() - start:.3f}s.")
+
+    def summary(self):
+        with self._lock:
+            out = {"model": self.name, "budget_ms": self.budget_ms, **self.stats,
+                   "ms_per_pair": round(self.ms_per_pair, 3) if self.ms_per_pair is not None else None}
+        out["cache"] = self.cache.summary()
+        return out
+
+
+_stage = None
+_stage_loaded = False
+_stage_lock = threading.Lock()
+
+
+def get_reranker():
+    """Process-wide RerankStage, created on first use; None when re-ranking is off."""
+    global _stage, _stage_loaded
+    if not _stage_loaded:
+        with _stage_lock:
+            if not _stage_loaded:
+                scorer = create_scorer()
+                if scorer is not None:
+                    logging.info(f"[Reranker] Loaded {getattr(scorer, 'name', RERANKER)}.")
+                    _stage = RerankStage(scorer)
+                _stage_loaded = True
+    return _stage
@@ -2,12 +2,17 @@ import schedule
 import time
 import subprocess
 import logging
+import sys
 from datetime import datetime
 
 logging.basicConfig(level=logging.INFO)
 
 # Command to run your indexing pipeline (modify if your entrypoint is different)
-INDEX_COMMAND = ["python", "rag_pipeline.py"]
+INDEX_COMMAND = [sys.executable, "-m", "indexer", "build-index"]
+# Background compaction of the delta segments builds append (segments.py); a no-op unless the policy says so.
+COMPACT_COMMAND = [sys.executable, "-m", "indexer", "compact"]
+# Drops documents past their source's retention (lifecycle.py); compaction later reclaims their space.
+EXPIRE_COMMAND = [sys.executable, "-m", "indexer", "expire"]
 
 
 def run_indexing():
@@ -21,10 +26,23 @@ def run_indexing():
     except Exception as e:
         logging.error(f"Error running indexing: {e}")
 
+
+def run_maintenance(name, command):
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode == 0:
+            logging.info(f"{name}: {result.stdout.strip()}")
+        else:
+            logging.error(f"{name} failed: {result.stderr}")
+    except Exception as e:
+        logging.error(f"Error running {name.lower()}: {e}")
+
 # Schedule: run once per day at 2:00 AM (customize as needed)
 schedule.every().day.at("02:00").do(run_indexing)
+schedule.every().day.at("03:00").do(run_maintenance, "Expiry", EXPIRE_COMMAND)
+schedule.every(30).minutes.do(run_maintenance, "Compaction", COMPACT_COMMAND)
 
-logging.info("Scheduler started. Will run the indexing pipeline daily at 2:00 AM.")
+logging.info("Scheduler started. Will run the indexing pipeline daily at 2:00 AM, expiry at 3:00 AM and compaction every 30 minutes.")
 
 while True:
     schedule.run_pending()
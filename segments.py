@@ -0,0 +1,496 @@
+"""
+segments.py
+- Log-structured snapshots: a snapshot directory holds the base (index.faiss, index.pkl, docstore.db,
+  metadata_index.npz, lexical.db and the HNSW / IVF search index, as written by save_vectorstore) plus
+  append-only delta segments:
+    snapshots/v000042/segments/000007/   index.faiss, index.pkl, docstore.db, metadata_index.npz, lexical.db of
+                                         the chunks added (or re-annotated) since the previous checkpoint, and
+                                         segment.json: when it was written and the ids it deletes ("tombstones")
+                                         from the base and older segments
+- Builders save through DeltaWriter: a checkpoint writes one new segment with just the changed chunks, and the
+  base and older segments are hard-linked into the next snapshot untouched, so the I/O of an ingest is
+  proportional to what it added rather than to the whole index.
+- The API opens a snapshot as a SegmentedIndex: searches fan out over the base and every segment and the hits
+  are merged by distance (BM25 score for lexical hits); chunks tombstoned by a newer segment are masked out.
+- compact() folds the segments back into a new base (rebuilding its search index) once there are
+  COMPACT_MAX_SEGMENTS of them, they add up to COMPACT_DELTA_FRACTION of the base, or the oldest is
+  COMPACT_MAX_AGE_HOURS old. `python -m indexer compact` runs it; scheduler.py runs it in the background.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import ExitStack
+
+import numpy as np
+from langchain.schema import Document
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from faiss_index_types import search_settings, write_search_index
+from snapshots import SnapshotManager
+from metadata_index import chunk_features, document_row
+from vector_store import DOCSTORE_FILE, SQLiteDocstore, count_documents, open_vectorstore, save_vectorstore, search_ids
+
+SEGMENTS_DIR = "segments"
+SEGMENT_FILE = "segment.json"
+COMPACT_MAX_SEGMENTS = int(os.getenv("COMPACT_MAX_SEGMENTS", "8"))
+COMPACT_DELTA_FRACTION = float(os.getenv("COMPACT_DELTA_FRACTION", "0.2"))
+COMPACT_MAX_AGE_HOURS = float(os.getenv("COMPACT_MAX_AGE_HOURS", "24"))
+# Tombstoned chunks a part may hold before plain searches stop over-fetching and search through a bitmap.
+MAX_OVERFETCH = 256
+
+
+def segment_dirs(faiss_index_path):
+    """Delta segment directories of a snapshot, oldest first."""
+    root = os.path.join(faiss_index_path, SEGMENTS_DIR)
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return []
+    return [os.path.join(root, name) for name in sorted(n for n in names if n.isdigit())]
+
+
+def read_segment(segment_path):
+    """segment.json of a segment: {'created_at': epoch seconds, 'tombstones': [ids]}."""
+    try:
+        with open(os.path.join(segment_path, SEGMENT_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"created_at": 0, "tombstones": []}
+
+
+def load_store(faiss_index_path, embeddings):
+    """
+    The builder's LangChain FAISS store for a snapshot: the base's index.pkl with each segment replayed on top
+    (its tombstones deleted, then its chunks merged in). None if the snapshot has no index yet.
+    """
+    from langchain_community.vectorstores import FAISS
+    if not os.path.exists(os.path.join(faiss_index_path, "index.faiss")):
+        return None
+    # allow_dangerous_deserialization is needed for loading FAISS indexes
+    store = FAISS.load_local(faiss_index_path, embeddings, allow_dangerous_deserialization=True)
+    for segment in segment_dirs(faiss_index_path):
+        dead = [vid for vid in read_segment(segment)["tombstones"] if vid in store.docstore._dict]
+        if dead:
+            store.delete(dead)
+        if os.path.exists(os.path.join(segment, "index.faiss")):
+            store.merge_from(FAISS.load_local(segment, embeddings, allow_dangerous_deserialization=True))
+    return store
+
+
+def iter_live_chunks(faiss_index_path):
+    """(id, metadata) of every chunk of a snapshot that no later segment tombstones, base first."""
+    parts = [faiss_index_path] + segment_dirs(faiss_index_path)
+    tombstones = [set(read_segment(segment)["tombstones"]) for segment in parts[1:]]
+    for i, part in enumerate(parts):
+        db_path = os.path.join(part, DOCSTORE_FILE)
+        if not os.path.exists(db_path):
+            continue
+        dead = set().union(*tombstones[i:])
+        docstore = SQLiteDocstore(db_path)
+        try:
+            for vid, metadata in docstore.iter_metadata():
+                if vid not in dead:
+                    yield vid, metadata
+        finally:
+            docstore.close()
+
+
+def _chunk_states(store):
+    """id -> hash of (content, metadata) of every chunk of a builder store."""
+    return {vid: hash((doc.page_content, json.dumps(doc.metadata, sort_keys=True, default=str)))
+            for vid, doc in store.docstore._dict.items()}
+
+
+def write_segment(store, faiss_index_path, ids, tombstones):
+    """
+    Appends a delta segment to the snapshot at `faiss_index_path`: the chunks `ids` of `store` (vectors copied
+    out of its flat index) and the `tombstones` ids they supersede. Written under a temporary name and renamed.
+    Returns the segment directory.
+    """
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    root = os.path.join(faiss_index_path, SEGMENTS_DIR)
+    os.makedirs(root, exist_ok=True)
+    existing = segment_dirs(faiss_index_path)
+    name = f"{int(os.path.basename(existing[-1])) + 1 if existing else 1:06d}"
+    tmp_path = os.path.join(root, f".{name}.tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    if ids:
+        positions = {vid: pos for pos, vid in store.index_to_docstore_id.items()}
+        vectors = np.vstack([store.index.reconstruct(int(positions[vid])) for vid in ids])
+        docs = store.docstore._dict
+        segment = FAISS(store.embedding_function, faiss.IndexFlat(store.index.d, store.index.metric_type),
+                        InMemoryDocstore({vid: docs[vid] for vid in ids}), dict(enumerate(ids)),
+                        normalize_L2=store._normalize_L2, distance_strategy=store.distance_strategy)
+        segment.index.add(vectors)
+        save_vectorstore(segment, tmp_path)
+    with open(os.path.join(tmp_path, SEGMENT_FILE), "w") as f:
+        json.dump({"created_at": time.time(), "tombstones": sorted(tombstones)}, f)
+    path = os.path.join(root, name)
+    os.rename(tmp_path, path)
+    logging.info(f"[Segments] Wrote segment {name}: {len(ids)} chunks, {len(tombstones)} tombstones.")
+    return path
+
+
+class DeltaWriter:
+    """
+    Saves a builder store as deltas against what was last saved (or loaded): the base when the snapshot has
+    none yet, else a segment with the chunks added or changed since and tombstones for the ones replaced or
+    deleted.
+    """
+
+    def __init__(self, store=None):
+        self._saved = _chunk_states(store) if store is not None else {}
+
+    def save(self, store, faiss_index_path):
+        """Returns "base", "segment", or None when nothing changed."""
+        current = _chunk_states(store)
+        if not os.path.exists(os.path.join(faiss_index_path, DOCSTORE_FILE)):
+            # No base yet (or one from before docstore.db): write it in full.
+            shutil.rmtree(os.path.join(faiss_index_path, SEGMENTS_DIR), ignore_errors=True)
+            save_vectorstore(store, faiss_index_path)
+            self._saved = current
+            return "base"
+        changed = [vid for vid, state in current.items() if self._saved.get(vid) != state]
+        gone = [vid for vid in self._saved if vid not in current]
+        if not changed and not gone:
+            return None
+        write_segment(store, faiss_index_path, changed, [vid for vid in changed if vid in self._saved] + gone)
+        self._saved = current
+        return "segment"
+
+
+def segment_stats(faiss_index_path):
+    """Base chunk count and, per segment, its chunks, tombstones and age in seconds."""
+    now = time.time()
+    stats = {"base": _stored_count(faiss_index_path), "segments": []}
+    for segment in segment_dirs(faiss_index_path):
+        info = read_segment(segment)
+        stats["segments"].append({"name": os.path.basename(segment), "chunks": _stored_count(segment),
+                                  "tombstones": len(info["tombstones"]),
+                                  "age_seconds": round(now - info["created_at"], 1)})
+    return stats
+
+
+def _stored_count(path):
+    db_path = os.path.join(path, DOCSTORE_FILE)
+    if not os.path.exists(db_path):
+        return 0
+    docstore = SQLiteDocstore(db_path)
+    try:
+        return docstore.count()
+    finally:
+        docstore.close()
+
+
+def compaction_reason(faiss_index_path):
+    """Why the snapshot's segments are due to be folded into the base, or None if they are not."""
+    stats = segment_stats(faiss_index_path)
+    segments = stats["segments"]
+    if not segments:
+        return None
+    if len(segments) >= COMPACT_MAX_SEGMENTS:
+        return f"{len(segments)} segments"
+    delta = sum(s["chunks"] + s["tombstones"] for s in segments)
+    if delta >= COMPACT_DELTA_FRACTION * max(stats["base"], 1):
+        return f"{delta} delta entries over a base of {stats['base']}"
+    oldest = max(s["age_seconds"] for s in segments)
+    if oldest >= COMPACT_MAX_AGE_HOURS * 3600:
+        return f"oldest segment {oldest / 3600:.1f}h old"
+    return None
+
+
+def compact(faiss_index_path, embeddings=None, force=False, index_type=None, memory_budget_mb=None, nprobe=None,
+            ef_search=None, wait=False):
+    """
+    Folds the live snapshot's segments into a new base, rebuilds its search index and publishes it, when the
+    compaction policy (or `force`) says so. Holds the build lock; without `wait`, gives up at once if a build
+    holds it. `embeddings` defaults to the embedding service, loaded only when there is work to do.
+    Search index settings not given here are those the index was last built with (search_settings).
+    Returns the published version, or None.
+    """
+    snapshots = SnapshotManager(faiss_index_path)
+    with ExitStack() as stack:
+        try:
+            stack.enter_context(snapshots.build_lock(blocking=wait))
+        except RuntimeError as e:
+            logging.info(f"[Segments] Compaction skipped: {e}")
+            return None
+        build = snapshots.begin()
+        stack.callback(build.close)
+        reason = "forced" if force and segment_dirs(build.path) else compaction_reason(build.path)
+        if reason is None:
+            logging.info("[Segments] Nothing to compact.")
+            return None
+        logging.info(f"[Segments] Compacting {len(segment_dirs(build.path))} segments ({reason})...")
+        start = time.perf_counter()
+        if embeddings is None:
+            from embedding_service import get_embedding_service
+            embeddings = get_embedding_service()
+        settings = search_settings(build.path, index_type, memory_budget_mb, nprobe, ef_search)
+        store = load_store(build.path, embeddings)
+        shutil.rmtree(os.path.join(build.path, SEGMENTS_DIR))
+        save_vectorstore(store, build.path)
+        write_search_index(build.path, store, **settings)
+        version = build.publish({"vectors": store.index.ntotal, "segments": 0, "compacted": reason})
+        logging.info(f"[Segments] Compacted into {version} in {time.perf_counter() - start:.1f}s.")
+        return version
+
+
+class SegmentedIndex:
+    """
+    The API's view of a snapshot: `parts` (the base store, then one ReadOnlyFAISS per segment) searched as one
+    index. Chunks tombstoned by a later segment are dropped from the earlier parts' results: plain searches
+    over-fetch by the number of dead chunks of a part (or, past MAX_OVERFETCH, search through a bitmap of
+    the live ones); masked searches AND the filter mask with it.
+    """
+
+    def __init__(self, parts, dead=None):
+        self.parts = parts
+        self._dead = [set() for _ in parts] if dead is None else dead
+        self._alive = []
+        for i, part in enumerate(parts):
+            positions = _positions(part, self._dead[i])
+            self._dead[i] = {part.index_to_docstore_id[pos] for pos in positions}
+            alive = None
+            if positions:
+                alive = np.ones(count_documents(part), dtype=bool)
+                alive[positions] = False
+            self._alive.append(alive)
+        self._lookups = [_position_lookup(part) for part in parts]
+        self._descending = getattr(parts[0], "distance_strategy", None) == DistanceStrategy.MAX_INNER_PRODUCT
+
+    @property
+    def base(self):
+        return self.parts[0]
+
+    @property
+    def has_lexical(self):
+        return any(getattr(part, "lexical_index", None) is not None for part in self.parts)
+
+    def _search_part(self, i, embedding, k, mask=None):
+        part, dead, alive = self.parts[i], self._dead[i], self._alive[i]
+        if alive is not None:
+            if mask is None and (len(dead) <= MAX_OVERFETCH or not hasattr(part, "flat_index")):
+                hits = search_ids(part, embedding, k + len(dead))
+                return [(vid, dist) for vid, dist in hits if vid not in dead][:k]
+            mask = alive if mask is None else mask & alive
+        return search_ids(part, embedding, k, mask)
+
+    def _merge(self, hits, k):
+        """Top k of (distance, part, id) hits from several parts, as Documents."""
+        hits.sort(key=lambda hit: hit[0], reverse=self._descending)
+        docs = (self.parts[i].docstore.search(vid) for _, i, vid in hits[:k])
+        return [doc for doc in docs if isinstance(doc, Document)]
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        hits = []
+        for i in range(len(self.parts)):
+            hits += [(dist, i, vid) for vid, dist in self._search_part(i, embedding, k)]
+        return self._merge(hits, k)
+
+    def similarity_search_filtered(self, embedding, k, date_from=None, date_to=None, sources=None, companies=None,
+                                   types=None):
+        """
+        The k nearest chunks matching the filters, filtered inside the search of every part. None when no
+        filter is given or a part has no metadata index (the caller then filters the results instead).
+        """
+        if any(getattr(part, "metadata_index", None) is None for part in self.parts):
+            return None
+        masks = [part.metadata_index.mask(date_from, date_to, sources, companies, types) for part in self.parts]
+        if masks[0] is None:
+            return None
+        hits = []
+        for i, mask in enumerate(masks):
+            hits += [(dist, i, vid) for vid, dist in self._search_part(i, embedding, k, mask)]
+        return self._merge(hits, k)
+
+    def lexical_search(self, query, limit):
+        """The best BM25 matches for `query` across the parts as Documents, best first."""
+        hits = []
+        for i, part in enumerate(self.parts):
+            lexical_index = getattr(part, "lexical_index", None)
+            if lexical_index is None:
+                continue
+            dead = self._dead[i]
+            hits += [(score, i, vid) for vid, score in lexical_index.search(query, limit + len(dead), with_scores=True)
+                     if vid not in dead]
+        hits.sort(key=lambda hit: hit[0])
+        docs = (self.parts[i].docstore.search(vid) for _, i, vid in hits[:limit])
+        return [doc for doc in docs if isinstance(doc, Document)]
+
+    def count(self):
+        """Live chunks across the parts."""
+        return sum(count_documents(part) - len(dead) for part, dead in zip(self.parts, self._dead))
+
+    def page(self, cursor=None, limit=10):
+        """
+        One page of live chunk metadata rows (MetadataIndex.row()), base first, and the cursor of the next page
+        (None after the last). Cursors ("part:position") are only valid for the snapshot that returned them.
+        """
+        part, position = parse_cursor(cursor)
+        rows = []
+        while part < len(self.parts) and len(rows) < limit:
+            if position >= count_documents(self.parts[part]):
+                part, position = part + 1, 0
+                continue
+            alive = self._alive[part]
+            for pos, row in _part_rows(self.parts[part], position, limit - len(rows)):
+                position = pos + 1
+                if alive is None or alive[pos]:
+                    rows.append(row)
+        while part < len(self.parts) and position >= count_documents(self.parts[part]):
+            part, position = part + 1, 0
+        return rows, (f"{part}:{position}" if part < len(self.parts) else None)
+
+    def metadata(self, vector_id):
+        """Metadata row of a live chunk by id (None if it is not in the index)."""
+        for part, dead in zip(reversed(self.parts), reversed(self._dead)):
+            if vector_id in dead:
+                return None
+            metadata_index = getattr(part, "metadata_index", None)
+            if metadata_index is not None and metadata_index.has_rows:
+                position = metadata_index.position(vector_id)
+                if position is not None:
+                    return metadata_index.row(position)
+                continue
+            doc = part.docstore.search(vector_id)
+            if isinstance(doc, Document):
+                return document_row(doc)
+        return None
+
+    def _locate(self, docs):
+        """(part, position) of each live candidate Document, newest part first (None if not found)."""
+        out = []
+        for doc in docs:
+            location = None
+            for i in range(len(self.parts) - 1, -1, -1):
+                if doc.id in self._dead[i]:
+                    break
+                position = self._lookups[i](doc.id)
+                if position is not None:
+                    location = (i, position)
+                    break
+            out.append(location)
+        return out
+
+    def ranking_features(self, docs):
+        """
+        Ranking features (MetadataIndex.features) of candidate Documents as arrays aligned with `docs`: gathered
+        from the metadata table of the part holding each chunk, computed from the Document where it has none.
+        """
+        n = len(docs)
+        out = {"timestamp": np.full(n, np.nan), "ai_topic": np.zeros(n, dtype=bool),
+               "title_tokens": np.empty(n, dtype=object), "length": np.zeros(n, dtype=np.int32)}
+        by_part = {}
+        for row, location in enumerate(self._locate(docs)):
+            metadata_index = getattr(self.parts[location[0]], "metadata_index", None) if location else None
+            if metadata_index is not None and metadata_index.has_features:
+                rows, positions = by_part.setdefault(location[0], ([], []))
+                rows.append(row)
+                positions.append(location[1])
+                continue
+            for name, value in chunk_features(docs[row].metadata, docs[row].page_content).items():
+                out[name][row] = value
+        for i, (rows, positions) in by_part.items():
+            for name, values in self.parts[i].metadata_index.features(positions).items():
+                out[name][rows] = values
+        return out
+
+    def vectors(self, docs):
+        """
+        Stored vectors of candidate Documents as a float32 (len(docs), dim) array, reconstructed from each part's
+        flat index (nothing is re-embedded). None if a candidate is not in the index.
+        """
+        locations = self._locate(docs)
+        if any(location is None for location in locations):
+            return None
+        out = np.zeros((len(docs), self.base.index.d), dtype=np.float32)
+        for row, (i, position) in enumerate(locations):
+            out[row] = getattr(self.parts[i], "flat_index", self.parts[i].index).reconstruct(int(position))
+        return out
+
+    def filter_summary(self):
+        """MetadataIndex.summary() over the live chunks of every part ({} without metadata indexes)."""
+        if any(getattr(part, "metadata_index", None) is None for part in self.parts):
+            return {}
+        out = {}
+        for part, alive in zip(self.parts, self._alive):
+            summary = part.metadata_index.summary(alive)
+            for column in part.metadata_index.COLUMNS:
+                for value, n in summary[column].items():
+                    out.setdefault(column, {})[value] = out.get(column, {}).get(value, 0) + n
+            out["dated"] = out.get("dated", 0) + summary["dated"]
+            if "date_range" in summary:
+                low, high = out.get("date_range", summary["date_range"])
+                out["date_range"] = [min(low, summary["date_range"][0]), max(high, summary["date_range"][1])]
+        return out
+
+    def describe(self):
+        return {"chunks": self.count(), "segments": len(self.parts) - 1,
+                "tombstoned": sum(len(dead) for dead in self._dead)}
+
+
+def parse_cursor(cursor):
+    """(part, position) of a SegmentedIndex.page() cursor ((0, 0) for none); ValueError if it is malformed."""
+    if not cursor:
+        return 0, 0
+    part, sep, position = cursor.partition(":")
+    if not (sep and part.isdigit() and position.isdigit()):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return int(part), int(position)
+
+
+def _positions(store, ids):
+    if not ids:
+        return []
+    if isinstance(store.docstore, SQLiteDocstore):
+        return store.docstore.positions_of(ids)
+    return [pos for pos, vid in store.index_to_docstore_id.items() if vid in ids]
+
+
+def _position_lookup(store):
+    """
+    Function mapping a chunk id to its index position in one part (None if absent): through its metadata table or
+    on-disk docstore, else (stores loaded with load_local) through a reverse map of index_to_docstore_id built here.
+    """
+    metadata_index = getattr(store, "metadata_index", None)
+    if metadata_index is not None and metadata_index.ids is not None:
+        return metadata_index.position
+    if isinstance(store.docstore, SQLiteDocstore):
+        def lookup(vector_id):
+            positions = store.docstore.positions_of([vector_id])
+            return positions[0] if positions else None
+        return lookup
+    return {vid: pos for pos, vid in store.index_to_docstore_id.items()}.get
+
+
+def _part_rows(store, start, limit):
+    """
+    (position, row) of up to `limit` chunks of one part from `start`: from its metadata table when it has one,
+    else (older snapshots) from the decoded chunks.
+    """
+    end = min(start + limit, count_documents(store))
+    metadata_index = getattr(store, "metadata_index", None)
+    if metadata_index is not None and metadata_index.has_rows:
+        return [(pos, metadata_index.row(pos)) for pos in range(start, end)]
+    mapping = store.index_to_docstore_id
+    return [(pos, document_row(store.docstore.search(mapping[pos]))) for pos in range(start, end)]
+
+
+def open_segments(base, faiss_index_path, embeddings):
+    """SegmentedIndex over the already opened `base` store of a snapshot and its segments."""
+    parts, dead = [base], [set()]
+    for segment in segment_dirs(faiss_index_path):
+        tombstones = set(read_segment(segment)["tombstones"])
+        for ids in dead:
+            ids |= tombstones
+        store = open_vectorstore(segment, embeddings) if os.path.exists(os.path.join(segment, "index.faiss")) else None
+        if store is not None:
+            parts.append(store)
+            dead.append(set())
+    return SegmentedIndex(parts, dead)
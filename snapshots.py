@@ -0,0 +1,234 @@
+"""
+snapshots.py
+- Versioned, immutable snapshots of the search index under faiss_index/:
+    faiss_index/CURRENT              name of the live version (replaced atomically by rename)
+    faiss_index/snapshots/v000042/   index.faiss, index.pkl, docstore.db, metadata_index.npz, lexical.db,
+                                     search.faiss, index_params.json, manifest.json, segments/ (segments.py)
+    faiss_index/registry.db, near_dup.db   builder state, shared across versions
+- A build stages into a fresh directory: files of the live version, delta segments included, are hard-linked in
+  (every writer replaces files by rename, so the live copies are never touched), the build writes over them or
+  adds segments, and publish() renames the directory into place and flips CURRENT.
+- Readers only stat CURRENT; a new version is opened next to the old one and swapped in, so in-flight queries
+  finish on the snapshot they started with. Superseded versions are garbage-collected once they have been
+  superseded for SNAPSHOT_GC_GRACE_SECONDS, keeping the newest SNAPSHOT_KEEP.
+- Layouts from before snapshots (index files directly in faiss_index/) are still served until the first publish.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from contextlib import contextmanager
+
+CURRENT_FILE = "CURRENT"
+SNAPSHOTS_DIR = "snapshots"
+MANIFEST_FILE = "manifest.json"
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "3"))
+SNAPSHOT_GC_GRACE_SECONDS = float(os.getenv("SNAPSHOT_GC_GRACE_SECONDS", "600"))
+# Files of the pre-snapshot layout, removed from faiss_index/ by the first publish.
+LEGACY_FILES = ("index.faiss", "index.pkl", "docstore.db", "metadata_index.npz", "lexical.db", "search.faiss",
+                "index_params.json")
+_VERSION_RE = re.compile(r"^v(\d{6,})$")
+
+
+class SnapshotManager:
+    """Staging, publishing, resolving and garbage-collecting index snapshots under one index root."""
+
+    def __init__(self, root):
+        self.root = root
+        self.snapshots_dir = os.path.join(root, SNAPSHOTS_DIR)
+
+    def versions(self):
+        """Published versions, oldest first."""
+        try:
+            names = os.listdir(self.snapshots_dir)
+        except OSError:
+            return []
+        return sorted((n for n in names if _VERSION_RE.match(n)), key=lambda n: int(n[1:]))
+
+    def current_version(self):
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def current(self):
+        """
+        (version, directory) of the live index: the CURRENT snapshot, else a pre-snapshot layout in the
+        root (versioned by its index.pkl mtime), else (None, None).
+        """
+        version = self.current_version()
+        if version:
+            return version, os.path.join(self.snapshots_dir, version)
+        try:
+            return f"legacy-{os.stat(os.path.join(self.root, 'index.pkl')).st_mtime_ns}", self.root
+        except OSError:
+            return None, None
+
+    def pointer_stamp(self):
+        """Cheap change token for readers: CURRENT's mtime (or the legacy index.pkl's); None if neither exists."""
+        for name in (CURRENT_FILE, "index.pkl"):
+            try:
+                return os.stat(os.path.join(self.root, name)).st_mtime_ns
+            except OSError:
+                continue
+        return None
+
+    @contextmanager
+    def build_lock(self, blocking=False):
+        """
+        Exclusive lock for builders and the compactor (readers never take it). Without `blocking`, a second
+        concurrent holder fails fast with RuntimeError; with it, waits for the lock.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".build.lock"), "w") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                raise RuntimeError(f"Another build holds {self.root}/.build.lock")
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def stage(self, empty=False):
+        """
+        Creates a staging directory seeded with the live version's files (unless `empty`).
+        Returns its path; pass it to publish() or discard().
+        """
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        staging = os.path.join(self.snapshots_dir, f".staging-{os.getpid()}-{time.time_ns()}")
+        os.makedirs(staging)
+        version, source = self.current()
+        if version and not empty:
+            for name in self._files(source):
+                os.makedirs(os.path.dirname(os.path.join(staging, name)), exist_ok=True)
+                os.link(os.path.join(source, name), os.path.join(staging, name))
+        return staging
+
+    def changed(self, staging):
+        """Whether `staging` differs from the live version (a file added, removed or replaced)."""
+        version, source = self.current()
+        if not version:
+            return os.path.exists(os.path.join(staging, "index.faiss"))
+        names, live = self._files(staging), self._files(source)
+        if names != live:
+            return True
+        return any(os.stat(os.path.join(staging, n)).st_ino != os.stat(os.path.join(source, n)).st_ino for n in names)
+
+    def _files(self, directory):
+        """Index files of a version directory as paths relative to it (the manifest excluded)."""
+        if directory == self.root:
+            return {n for n in LEGACY_FILES if os.path.isfile(os.path.join(directory, n))}
+        files = set()
+        for parent, _, names in os.walk(directory):
+            for name in names:
+                files.add(os.path.relpath(os.path.join(parent, name), directory))
+        files.discard(MANIFEST_FILE)
+        return files
+
+    def publish(self, staging, info=None):
+        """Moves `staging` into place as the next version, flips CURRENT to it and collects old versions."""
+        previous = self.current_version()
+        existing = self.versions()
+        version = f"v{(int(existing[-1][1:]) + 1 if existing else 1):06d}"
+        manifest = {"version": version, "parent": previous, "published_at": time.time(),
+                    "files": sorted(os.listdir(staging)), **(info or {})}
+        with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+        _fsync_dir(staging)
+        os.rename(staging, os.path.join(self.snapshots_dir, version))
+        pointer = os.path.join(self.root, CURRENT_FILE)
+        with open(pointer + ".tmp", "w") as f:
+            f.write(version + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer + ".tmp", pointer)
+        _fsync_dir(self.root)
+        logging.info(f"[Snapshots] Published {version} (previous: {previous}).")
+        if previous is None:
+            for name in LEGACY_FILES:
+                path = os.path.join(self.root, name)
+                if os.path.exists(path):
+                    os.remove(path)
+        self.collect_garbage()
+        return version
+
+    def begin(self, empty=False):
+        """Starts a build: a SnapshotBuild staged from the live version (or empty, for full rebuilds)."""
+        return SnapshotBuild(self, empty)
+
+    def discard(self, staging):
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def manifest(self, version):
+        try:
+            with open(os.path.join(self.snapshots_dir, version, MANIFEST_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def collect_garbage(self, keep=SNAPSHOT_KEEP, grace_seconds=SNAPSHOT_GC_GRACE_SECONDS):
+        """
+        Removes versions beyond the newest `keep` that were superseded more than `grace_seconds` ago (readers
+        still on them have had time to swap), and staging directories left by crashed builds.
+        Returns the removed version names.
+        """
+        keep = max(1, keep)
+        versions = self.versions()
+        current = self.current_version()
+        removed = []
+        now = time.time()
+        for older, newer in zip(versions[:-keep], versions[1:]):
+            if older == current:
+                continue
+            if now - self.manifest(newer).get("published_at", now) < grace_seconds:
+                continue
+            shutil.rmtree(os.path.join(self.snapshots_dir, older), ignore_errors=True)
+            removed.append(older)
+        for name in os.listdir(self.snapshots_dir) if os.path.isdir(self.snapshots_dir) else ():
+            path = os.path.join(self.snapshots_dir, name)
+            if name.startswith(".staging-") and now - os.stat(path).st_mtime > max(grace_seconds, 86400):
+                shutil.rmtree(path, ignore_errors=True)
+        if removed:
+            logging.info(f"[Snapshots] Garbage-collected {removed}.")
+        return removed
+
+    def summary(self):
+        version = self.current_version()
+        return {"current": version, "versions": self.versions(), **({"manifest": self.manifest(version)} if version else {})}
+
+
+class SnapshotBuild:
+    """
+    A build's staging directory. Write index files to `path`; publish() makes them the live version (if anything
+    changed) and re-stages from it, so a build can publish several times. close() drops unpublished changes.
+    """
+
+    def __init__(self, manager, empty=False):
+        self.manager = manager
+        self.path = manager.stage(empty)
+        self.published = []
+
+    def publish(self, info=None):
+        if not self.manager.changed(self.path):
+            logging.info("[Snapshots] Index unchanged; nothing to publish.")
+            return None
+        version = self.manager.publish(self.path, info)
+        self.published.append(version)
+        self.path = self.manager.stage()
+        return version
+
+    def close(self):
+        self.manager.discard(self.path)
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,244 @@
+"""
+vector_store.py
+- Storage layer of an index snapshot directory (snapshots.py), split by role:
+    builder (indexer.py, async_ingest.py): the LangChain FAISS store with its in-memory docstore, persisted
+        with save_vectorstore(), which also exports every chunk, in index order, to docstore.db;
+    API (rag_pipeline.get_vectorstore): open_vectorstore() memory-maps the vector index (FAISS mmap I/O flags)
+        and reads chunks from docstore.db on demand through a small hot LRU, instead of unpickling index.pkl.
+- Metadata filters run inside the search: save_vectorstore() also writes the columnar metadata index
+  (metadata_index.py), and search_ids() searches the flat index through an IDSelectorBitmap of the matches.
+- save_vectorstore() also brings the BM25 index (lexical_index.py) up to date for hybrid retrieval.
+- The same files make up the base of a snapshot and each of its delta segments (segments.py), which the API
+  opens as one ReadOnlyFAISS per directory and searches together.
+- Files are swapped in with a rename, never rewritten in place, so a process that mapped the old files keeps a
+  consistent view, and several API workers share one copy of the index through the page cache.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+from langchain.schema import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+
+from faiss_index_types import mapping_fingerprint, read_index_mmap
+from lexical_index import LEXICAL_INDEX_FILE, LexicalIndex, write_lexical_index
+from metadata_index import METADATA_INDEX_FILE, MetadataIndex
+from query_cache import TTLCache
+
+DOCSTORE_FILE = "docstore.db"
+# Chunks kept decoded in memory per process; everything else is read from docstore.db (and the page cache).
+DOCSTORE_CACHE_SIZE = int(os.getenv("DOCSTORE_CACHE_SIZE", "2048"))
+
+_SCHEMA = """
+CREATE TABLE docs (
+    position INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    page_content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def export_docstore(vectorstore, faiss_index_path):
+    """Writes the chunks of `vectorstore` to docstore.db in index order (temp file + rename)."""
+    path = os.path.join(faiss_index_path, DOCSTORE_FILE)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(_SCHEMA)
+        mapping = vectorstore.index_to_docstore_id
+        docs = vectorstore.docstore._dict
+        conn.executemany("INSERT INTO docs (position, id, page_content, metadata) VALUES (?, ?, ?, ?)",
+                         ((pos, mapping[pos], docs[mapping[pos]].page_content,
+                           json.dumps(docs[mapping[pos]].metadata, default=str)) for pos in range(len(mapping))))
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                         [("count", str(len(mapping))), ("fingerprint", mapping_fingerprint(mapping))])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+
+def save_vectorstore(vectorstore, faiss_index_path):
+    """
+    Persists the builder's store: index.faiss and index.pkl (LangChain format, for the next build),
+    docstore.db and the metadata table metadata_index.npz (for readers). Each file is written under a temporary
+    name and renamed into place. lexical.db is updated incrementally.
+    """
+    write_lexical_index(vectorstore, faiss_index_path)
+    vectorstore.save_local(faiss_index_path, index_name="index.tmp")
+    os.replace(os.path.join(faiss_index_path, "index.tmp.faiss"), os.path.join(faiss_index_path, "index.faiss"))
+    export_docstore(vectorstore, faiss_index_path)
+    mapping, docs = vectorstore.index_to_docstore_id, vectorstore.docstore._dict
+    ordered = [mapping[pos] for pos in range(len(mapping))]
+    MetadataIndex.build((docs[vid].metadata for vid in ordered), ids=ordered,
+                        texts=(docs[vid].page_content for vid in ordered)).save(
+        os.path.join(faiss_index_path, METADATA_INDEX_FILE))
+    # index.pkl last: its mtime is what readers watch for a new version.
+    os.replace(os.path.join(faiss_index_path, "index.tmp.pkl"), os.path.join(faiss_index_path, "index.pkl"))
+
+
+class SQLiteDocstore(Docstore):
+    """Read-only LangChain docstore over docstore.db with a hot LRU of decoded chunks."""
+
+    def __init__(self, path, cache_size=DOCSTORE_CACHE_SIZE):
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._hot = TTLCache(cache_size, 0)
+        meta = dict(self._query("SELECT key, value FROM meta"))
+        self.fingerprint = meta.get("fingerprint")
+        self._count = int(meta.get("count", 0))
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _document(row):
+        return Document(id=row[0], page_content=row[1], metadata=json.loads(row[2]))
+
+    def search(self, search):
+        doc = self._hot.get(search)
+        if doc is None:
+            rows = self._query("SELECT id, page_content, metadata FROM docs WHERE id = ?", (search,))
+            if not rows:
+                return f"ID {search} not found."
+            doc = self._document(rows[0])
+            self._hot.put(search, doc)
+        return doc
+
+    def id_at(self, position):
+        rows = self._query("SELECT id FROM docs WHERE position = ?", (int(position),))
+        if not rows:
+            raise KeyError(position)
+        return rows[0][0]
+
+    def positions_of(self, ids):
+        """Index positions of those of `ids` that are in this docstore."""
+        ids = list(ids)
+        positions = []
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            positions += [row[0] for row in self._query(
+                f"SELECT position FROM docs WHERE id IN ({','.join('?' * len(batch))})", batch)]
+        return positions
+
+    def count(self):
+        return self._count
+
+    def iter_metadata(self, batch_size=1000):
+        """(id, metadata) of every chunk in index order, read in batches."""
+        position = -1
+        while True:
+            rows = self._query("SELECT position, id, metadata FROM docs WHERE position > ? ORDER BY position LIMIT ?",
+                               (position, batch_size))
+            if not rows:
+                return
+            for position, vid, metadata in rows:
+                yield vid, json.loads(metadata)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PositionMap(Mapping):
+    """index position -> docstore id, looked up in docstore.db (stands in for index_to_docstore_id)."""
+
+    def __init__(self, docstore):
+        self._docstore = docstore
+
+    def __getitem__(self, position):
+        return self._docstore.id_at(position)
+
+    def __len__(self):
+        return self._docstore.count()
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+
+class ReadOnlyFAISS(FAISS):
+    """
+    The API's FAISS store for one snapshot directory. `index` may be swapped for an HNSW / IVF search index;
+    `flat_index` stays the exact index that masked searches run on, with `metadata_index` (None if missing)
+    supplying the filter masks. `lexical_index` (None if missing) is its BM25 index.
+    """
+
+    def __init__(self, embeddings, index, docstore, metadata_index=None, lexical_index=None):
+        super().__init__(embeddings, index, docstore, PositionMap(docstore))
+        self.flat_index = index
+        self.metadata_index = metadata_index
+        self.lexical_index = lexical_index
+
+
+def open_vectorstore(faiss_index_path, embeddings):
+    """
+    Read-only FAISS store over the memory-mapped index.faiss, docstore.db and the metadata index.
+    Returns None when docstore.db is missing (an index built before it existed; the next build writes it).
+    """
+    db_path = os.path.join(faiss_index_path, DOCSTORE_FILE)
+    if not os.path.exists(db_path):
+        return None
+    docstore = SQLiteDocstore(db_path)
+    index = read_index_mmap(os.path.join(faiss_index_path, "index.faiss"))
+    if index.ntotal != docstore.count():
+        logging.warning(f"[Vector Store] index.faiss has {index.ntotal} vectors, {db_path} {docstore.count()} chunks.")
+        docstore.close()
+        return None
+    metadata_index = None
+    metadata_path = os.path.join(faiss_index_path, METADATA_INDEX_FILE)
+    if os.path.exists(metadata_path):
+        metadata_index = MetadataIndex.load(metadata_path)
+        if len(metadata_index) != index.ntotal:
+            logging.warning(f"[Vector Store] {metadata_path} is out of sync with index.faiss; filters run after search.")
+            metadata_index = None
+    lexical_path = os.path.join(faiss_index_path, LEXICAL_INDEX_FILE)
+    lexical_index = LexicalIndex(lexical_path, read_only=True) if os.path.exists(lexical_path) else None
+    return ReadOnlyFAISS(embeddings, index, docstore, metadata_index, lexical_index)
+
+
+def search_ids(vectorstore, embedding, k, mask=None):
+    """
+    (docstore id, distance) of the k nearest chunks of a store, nearest first. With a boolean `mask` over index
+    positions, only chunks where it is True are searched, exactly, inside FAISS (on `flat_index`).
+    """
+    import faiss
+    vector = np.array([embedding], dtype=np.float32)
+    if vectorstore._normalize_L2:
+        faiss.normalize_L2(vector)
+    if mask is None:
+        distances, positions = vectorstore.index.search(vector, k)
+    else:
+        matching = int(mask.sum())
+        if not matching:
+            return []
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        index = getattr(vectorstore, "flat_index", vectorstore.index)
+        distances, positions = index.search(vector, min(k, matching), params=faiss.SearchParameters(sel=selector))
+    mapping = vectorstore.index_to_docstore_id
+    return [(mapping[int(pos)], float(dist)) for pos, dist in zip(positions[0], distances[0]) if pos >= 0]
+
+
+def store_fingerprint(vectorstore):
+    """mapping_fingerprint() of a store, read from docstore.db metadata when it was opened by open_vectorstore()."""
+    if isinstance(vectorstore.docstore, SQLiteDocstore):
+        return vectorstore.docstore.fingerprint
+    return mapping_fingerprint(vectorstore.index_to_docstore_id)
+
+
+def count_documents(vectorstore):
+    """Number of chunks in a store opened by open_vectorstore() or FAISS.load_local()."""
+    if isinstance(vectorstore.docstore, SQLiteDocstore):
+        return vectorstore.docstore.count()
+    return len(vectorstore.index_to_docstore_id)